@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Appointment.settings")
+# Serve /chatbot/stream/ from the async view when running under ASGI
+# (e.g. `uvicorn Appointment.asgi:application`)
+os.environ.setdefault("CHAT_STREAM_ASYNC", "1")
 
 application = get_asgi_application()
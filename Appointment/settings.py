@@ -96,3 +96,91 @@ AUTHENTICATION_BACKENDS = (
 )
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+# Ollama (local LLM) configuration shared by the web chat and WhatsApp paths
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "symptomwise")
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", 10))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 3))
+OLLAMA_FIRST_TOKEN_TIMEOUT = float(os.environ.get("OLLAMA_FIRST_TOKEN_TIMEOUT", 30))
+OLLAMA_TOTAL_TIMEOUT = float(os.environ.get("OLLAMA_TOTAL_TIMEOUT", 120))
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", 2))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", 0.25))
+
+# Chat SSE stream: tokens are coalesced into one frame per window or byte budget
+CHAT_STREAM_COALESCE_WINDOW = float(os.environ.get("CHAT_STREAM_COALESCE_WINDOW", 0.05))
+CHAT_STREAM_COALESCE_BYTES = int(os.environ.get("CHAT_STREAM_COALESCE_BYTES", 256))
+# Route /chatbot/stream/ to the async view; Appointment.asgi turns this on
+CHAT_STREAM_ASYNC = os.environ.get("CHAT_STREAM_ASYNC", "0") == "1"
+
+# Offline hospital geocoding (manage.py geocode_hospitals); "nominatim" or "csv"
+GEOCODER_BACKEND = os.environ.get("GEOCODER_BACKEND", "nominatim")
+GEOCODER_GAZETTEER = os.environ.get("GEOCODER_GAZETTEER", "")
+GEOCODE_CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", str(BASE_DIR / "geocode_cache.json"))
+
+# WhatsApp conversation state: "local" (in-process LRU) or "cache" (shared Django cache)
+WHATSAPP_SESSION_BACKEND = os.environ.get("WHATSAPP_SESSION_BACKEND", "local")
+WHATSAPP_SESSION_TTL = int(os.environ.get("WHATSAPP_SESSION_TTL", 1800))
+WHATSAPP_SESSION_MAX_ENTRIES = int(os.environ.get("WHATSAPP_SESSION_MAX_ENTRIES", 10000))
+WHATSAPP_SESSION_CACHE_ALIAS = os.environ.get("WHATSAPP_SESSION_CACHE_ALIAS", "default")
+
+# Acknowledge Twilio immediately and reply from a background worker pool
+WHATSAPP_WEBHOOK_ASYNC = os.environ.get("WHATSAPP_WEBHOOK_ASYNC", "1") == "1"
+WHATSAPP_WORKERS = int(os.environ.get("WHATSAPP_WORKERS", 4))
+WHATSAPP_DEDUPE_TTL = int(os.environ.get("WHATSAPP_DEDUPE_TTL", 3600))
+
+# Seconds TenantMiddleware keeps a resolved hospital (Hospital saves invalidate it sooner)
+TENANT_REGISTRY_TTL = int(os.environ.get("TENANT_REGISTRY_TTL", 300))
+# Misses (unknown subdomains/slugs) are remembered in a bounded LRU
+TENANT_REGISTRY_NEGATIVE_TTL = int(os.environ.get("TENANT_REGISTRY_NEGATIVE_TTL", 60))
+TENANT_REGISTRY_NEGATIVE_SIZE = int(os.environ.get("TENANT_REGISTRY_NEGATIVE_SIZE", 1024))
+# Seconds a process trusts its copy of a cache version (tenants/versioning.py) before re-reading it
+CACHE_VERSION_CHECK_INTERVAL = float(os.environ.get("CACHE_VERSION_CHECK_INTERVAL", 2.0))
+
+# Seconds dashboard counters are cached per hospital (writes invalidate them sooner)
+HOSPITAL_STATS_CACHE_TTL = int(os.environ.get("HOSPITAL_STATS_CACHE_TTL", 60))
+
+# Seconds a doctor's computed free slots for a day are cached (bookings invalidate them sooner)
+SLOT_CACHE_TTL = int(os.environ.get("SLOT_CACHE_TTL", 300))
+# Seconds a slot stays reserved for the patient filling in the booking form
+SLOT_HOLD_TTL = int(os.environ.get("SLOT_HOLD_TTL", 300))
+
+# Email outbox (myapp/outbox.py), delivered by `manage.py send_queued_emails`
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+# Retry delay doubles from the base up to the max (seconds)
+EMAIL_OUTBOX_RETRY_BASE = int(os.environ.get("EMAIL_OUTBOX_RETRY_BASE", 60))
+EMAIL_OUTBOX_RETRY_MAX = int(os.environ.get("EMAIL_OUTBOX_RETRY_MAX", 3600))
+# Seconds before a batch claimed by a crashed worker is picked up again
+EMAIL_OUTBOX_CLAIM_TIMEOUT = int(os.environ.get("EMAIL_OUTBOX_CLAIM_TIMEOUT", 600))
+
+# Hospitals with their own smtp_* settings: open connections kept per SMTP config
+TENANT_SMTP_POOL_SIZE = int(os.environ.get("TENANT_SMTP_POOL_SIZE", 2))
+# Seconds an unused tenant SMTP connection stays open
+TENANT_SMTP_IDLE_TIMEOUT = int(os.environ.get("TENANT_SMTP_IDLE_TIMEOUT", 60))
+# Seconds to wait on a tenant SMTP server before the send fails and is retried
+TENANT_SMTP_TIMEOUT = int(os.environ.get("TENANT_SMTP_TIMEOUT", 10))
+
+# Web chat turns are buffered per process and bulk-written by a background thread
+CHAT_TRANSCRIPT_BATCH_SIZE = int(os.environ.get("CHAT_TRANSCRIPT_BATCH_SIZE", 50))
+CHAT_TRANSCRIPT_FLUSH_INTERVAL = float(os.environ.get("CHAT_TRANSCRIPT_FLUSH_INTERVAL", 2.0))
+# Turns kept while the database is unavailable; older ones are dropped
+CHAT_TRANSCRIPT_MAX_PENDING = int(os.environ.get("CHAT_TRANSCRIPT_MAX_PENDING", 5000))
+
+# Chat prompt budget (chatbot/context_window.py); keep CHAT_CONTEXT_NUM_CTX equal to num_ctx in the Modelfile
+CHAT_CONTEXT_NUM_CTX = int(os.environ.get("CHAT_CONTEXT_NUM_CTX", 4096))
+# Tokens reserved for the Modelfile SYSTEM prompt and for the generated answer
+CHAT_CONTEXT_SYSTEM_TOKENS = int(os.environ.get("CHAT_CONTEXT_SYSTEM_TOKENS", 768))
+CHAT_CONTEXT_RESPONSE_TOKENS = int(os.environ.get("CHAT_CONTEXT_RESPONSE_TOKENS", 1024))
+# Size of the rolling summary of turns that no longer fit
+CHAT_CONTEXT_SUMMARY_TOKENS = int(os.environ.get("CHAT_CONTEXT_SUMMARY_TOKENS", 384))
+# Conversations whose Ollama context array is kept in memory for reuse
+CHAT_CONTEXT_CACHE_SIZE = int(os.environ.get("CHAT_CONTEXT_CACHE_SIZE", 256))
+
+# Cache of AI answers keyed on the normalized prompt (chatbot/response_cache.py);
+# hospitals opt out with Hospital.ai_response_cache_enabled
+CHAT_RESPONSE_CACHE_ENABLED = os.environ.get("CHAT_RESPONSE_CACHE_ENABLED", "1") == "1"
+CHAT_RESPONSE_CACHE_SIZE = int(os.environ.get("CHAT_RESPONSE_CACHE_SIZE", 1024))
+CHAT_RESPONSE_CACHE_TTL = int(os.environ.get("CHAT_RESPONSE_CACHE_TTL", 21600))
+# Hashed into the cache key, so edits to the model definition invalidate cached answers
+CHAT_MODELFILE_PATH = os.environ.get("CHAT_MODELFILE_PATH", str(BASE_DIR / "Modelfile"))
@@ -0,0 +1,179 @@
+"""
+Appointment booking with short-lived slot holds.
+
+While a patient fills in the booking form the page holds the chosen slot
+(``hold_slot``); other patients trying to hold or book it get a
+``slot_held`` conflict until the hold expires after ``SLOT_HOLD_TTL``
+seconds or is released. Holds are ``SlotHold`` rows: a unique constraint
+per slot means only one holder can win, whichever worker serves them, and
+a unique holder column means a holder keeps at most one hold (taking a new
+slot moves it). Expired rows are deleted by the next ``hold_slot``.
+
+``book_slot`` claims (or refreshes) the hold, then inserts the appointment
+in a transaction that locks the doctor row (``select_for_update``, a no-op
+on SQLite which serializes writers anyway). The partial unique constraint
+on active appointments is the final arbiter: an IntegrityError becomes a
+``slot_taken`` conflict instead of a generic error, and the caller's hold
+is released on either ``slot_taken`` path.
+"""
+import datetime
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.utils import timezone
+
+from .models import Appointment, Doctor, SlotHold
+from .slots import RELEASED_STATUSES, as_date
+
+logger = logging.getLogger(__name__)
+
+# SQLite reports writer contention as OperationalError("database is locked")
+LOCK_RETRIES = 5
+
+
+class BookingConflict(Exception):
+    """A slot could not be held or booked; ``code`` is machine-readable"""
+
+    MESSAGES = {
+        'slot_held': 'This time slot is being booked by someone else. Please pick another time or try again in a few minutes.',
+        'slot_taken': 'This time slot has just been booked. Please pick another time.',
+    }
+
+    def __init__(self, code, doctor_id=None, day=None, slot_time=None):
+        self.code = code
+        self.doctor_id = doctor_id
+        self.day = day
+        self.slot_time = slot_time
+        super().__init__(self.MESSAGES.get(code, 'This time slot is not available.'))
+
+    @property
+    def message(self):
+        return str(self)
+
+    def to_dict(self):
+        return {
+            'code': self.code,
+            'message': self.message,
+            'doctor_id': self.doctor_id,
+            'date': self.day.isoformat() if self.day else None,
+            'time': self.slot_time,
+        }
+
+
+def normalize_time(value):
+    """'9:30', '09:30', '09:30:00' or a time object -> '09:30'"""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%H:%M')
+    hour, minute = str(value).split(':')[:2]
+    return f"{int(hour):02d}:{int(minute):02d}"
+
+
+def _retry_locked(operation, what):
+    """Run ``operation``, retrying when SQLite reports writer contention"""
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return operation()
+        except OperationalError as e:
+            if attempt == LOCK_RETRIES - 1:
+                raise
+            logger.info(f"{what} hit a locked database ({str(e)}); retrying")
+            # Jittered so contending writers do not retry in lockstep
+            time.sleep(random.uniform(0.02, 0.05) * (attempt + 1))
+
+
+def hold_slot(doctor_id, day, slot_time, holder, ttl=None):
+    """
+    Hold a slot for ``holder`` (e.g. a session key). Re-holding your own
+    slot refreshes its expiry; a slot held by someone else raises
+    ``BookingConflict('slot_held')``. Any other slot ``holder`` held is
+    released. Returns the hold TTL in seconds.
+    """
+    ttl = ttl or getattr(settings, 'SLOT_HOLD_TTL', 300)
+    day = as_date(day)
+    slot_time = normalize_time(slot_time)
+
+    def claim():
+        now = timezone.now()
+        with transaction.atomic():
+            SlotHold.objects.filter(expires_at__lte=now).delete()
+            current = SlotHold.objects.filter(
+                doctor_id=doctor_id, appointment_date=day, appointment_time=slot_time,
+            ).values_list('holder', flat=True).first()
+            if current is not None and current != holder:
+                raise BookingConflict('slot_held', doctor_id, day, slot_time)
+            # Moving the holder's row releases whatever slot it held before
+            fields = {
+                'doctor_id': doctor_id, 'appointment_date': day, 'appointment_time': slot_time,
+                'expires_at': now + datetime.timedelta(seconds=ttl),
+            }
+            if not SlotHold.objects.filter(holder=holder).update(**fields):
+                SlotHold.objects.create(holder=holder, **fields)
+
+    for attempt in range(LOCK_RETRIES):
+        try:
+            _retry_locked(claim, f"Hold on doctor {doctor_id}")
+            return ttl
+        except IntegrityError:
+            # Another request claimed the slot, or created this holder's row, first;
+            # look again to tell the two apart
+            if attempt == LOCK_RETRIES - 1:
+                raise BookingConflict('slot_held', doctor_id, day, slot_time)
+
+
+def release_slot(doctor_id, day, slot_time, holder):
+    """Drop a hold, but only if ``holder`` owns it"""
+    _retry_locked(
+        lambda: SlotHold.objects.filter(
+            holder=holder, doctor_id=doctor_id,
+            appointment_date=as_date(day), appointment_time=normalize_time(slot_time),
+        ).delete(),
+        f"Release on doctor {doctor_id}",
+    )
+
+
+def slot_holder(doctor_id, day, slot_time):
+    return SlotHold.objects.filter(
+        doctor_id=doctor_id, appointment_date=as_date(day), appointment_time=normalize_time(slot_time),
+        expires_at__gt=timezone.now(),
+    ).values_list('holder', flat=True).first()
+
+
+def book_slot(doctor, hospital, day, slot_time, holder, **fields):
+    """
+    Create an appointment for a held (or free) slot, or raise BookingConflict.
+
+    ``fields`` are passed to ``Appointment`` (patient details, reason, fee...).
+    """
+    day = as_date(day)
+    slot_time = normalize_time(slot_time)
+    hold_slot(doctor.id, day, slot_time, holder)
+
+    def insert():
+        with transaction.atomic():
+            # Serialize bookings per doctor where the database supports row locks
+            Doctor.objects.select_for_update().filter(pk=doctor.pk).values_list('pk', flat=True).first()
+            taken = Appointment.objects.filter(
+                doctor=doctor, appointment_date=day, appointment_time=slot_time,
+            ).exclude(status__in=RELEASED_STATUSES).exists()
+            if taken:
+                raise BookingConflict('slot_taken', doctor.id, day, slot_time)
+            return Appointment.objects.create(
+                doctor=doctor, hospital=hospital, appointment_date=day, appointment_time=slot_time, **fields
+            )
+
+    try:
+        appointment = _retry_locked(insert, f"Booking for doctor {doctor.id}")
+    except BookingConflict:
+        # The slot is gone for good: let the caller's hold go with it
+        release_slot(doctor.id, day, slot_time, holder)
+        raise
+    except IntegrityError:
+        # Another request inserted the same slot between our check and insert
+        release_slot(doctor.id, day, slot_time, holder)
+        raise BookingConflict('slot_taken', doctor.id, day, slot_time)
+
+    release_slot(doctor.id, day, slot_time, holder)
+    return appointment
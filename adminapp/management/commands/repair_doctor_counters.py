@@ -0,0 +1,58 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from adminapp.models import Appointment, Doctor, DoctorReview
+from adminapp.signals import UNCOUNTED_APPOINTMENT_STATUSES
+
+
+def expected_average(rating_total, total_reviews):
+    if not total_reviews:
+        return Decimal('0.00')
+    return (Decimal(rating_total) / total_reviews).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class Command(BaseCommand):
+    help = 'Verify and repair the review and appointment counters stored on doctors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report doctors whose counters are out of date')
+
+    def handle(self, *args, **options):
+        # One GROUP BY per source table, independent of the number of doctors
+        reviews = {
+            row['doctor_id']: row
+            for row in DoctorReview.objects.filter(is_published=True).order_by()
+            .values('doctor_id').annotate(total_reviews=Count('pk'), rating_total=Sum('rating'))
+        }
+        appointments = dict(
+            Appointment.objects.exclude(status__in=UNCOUNTED_APPOINTMENT_STATUSES).order_by()
+            .values('doctor_id').annotate(total=Count('pk')).values_list('doctor_id', 'total')
+        )
+
+        stale = []
+        doctors = Doctor.objects.only('id', 'title', 'first_name', 'last_name', *Doctor.COUNTER_FIELDS)
+        for doctor in doctors.iterator():
+            review_row = reviews.get(doctor.id, {})
+            expected = {
+                'total_reviews': review_row.get('total_reviews', 0),
+                'rating_total': review_row.get('rating_total') or 0,
+                'total_appointments': appointments.get(doctor.id, 0),
+            }
+            expected['average_rating'] = expected_average(expected['rating_total'], expected['total_reviews'])
+            if any(getattr(doctor, field) != value for field, value in expected.items()):
+                for field, value in expected.items():
+                    setattr(doctor, field, value)
+                stale.append(doctor)
+
+        if options['check']:
+            self.stdout.write(f'{len(stale)} doctors have out-of-date counters')
+            for doctor in stale[:20]:
+                self.stdout.write(f'  {doctor}: expected {doctor.total_reviews} reviews, {doctor.total_appointments} appointments')
+            return
+
+        with transaction.atomic():
+            Doctor.objects.bulk_update(stale, list(Doctor.COUNTER_FIELDS), batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f'Repaired counters for {len(stale)} doctors'))
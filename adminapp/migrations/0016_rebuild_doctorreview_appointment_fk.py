@@ -0,0 +1,31 @@
+# adminapp/migrations/0016_rebuild_doctorreview_appointment_fk.py
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# 0010 renamed adminapp_appointment to adminapp_appointment_temp before
+# rebuilding it. SQLite rewrote the foreign key of
+# adminapp_doctorreview.appointment_id to follow the rename, so the column
+# still references the dropped temp table and every review insert fails.
+# Toggling db_constraint makes the schema editor rebuild the table with a
+# reference to the real appointment table; the final state is unchanged.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminapp', '0015_alter_doctor_unique_together_appointment_zipcode_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctorreview',
+            name='appointment',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='adminapp.appointment'),
+        ),
+        migrations.AlterField(
+            model_name='doctorreview',
+            name='appointment',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='adminapp.appointment'),
+        ),
+    ]
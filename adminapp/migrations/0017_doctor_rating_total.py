@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adminapp', '0016_rebuild_doctorreview_appointment_fk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_total',
+            field=models.IntegerField(default=0, help_text='Sum of published review ratings'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 import secrets
 import uuid
 from django.utils import timezone
@@ -91,8 +91,11 @@ class Doctor(TenantAwareModel):
     # as they are now handled by the DoctorAvailability model.
     
     # Ratings & Reviews
+    # Maintained from DoctorReview/Appointment writes (see adminapp/signals.py);
+    # repair with `manage.py repair_doctor_counters`
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     total_reviews = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0, help_text="Sum of published review ratings")
     total_appointments = models.IntegerField(default=0)
     
     # Metadata
@@ -104,12 +107,24 @@ class Doctor(TenantAwareModel):
     # User account (optional)
     user = models.OneToOneField(User, on_delete=models.SET_NULL, null=True, blank=True)
     
+    COUNTER_FIELDS = ('average_rating', 'total_reviews', 'rating_total', 'total_appointments')
+    
     class Meta:
         ordering = ['last_name', 'first_name']
     
     def __str__(self):
         return f"{self.title} {self.first_name} {self.last_name}"
     
+    def save(self, *args, **kwargs):
+        # Counters are updated in place with F() expressions; a regular save
+        # of an existing doctor must not write back a stale in-memory copy
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
     @property
     def full_name(self):
         return f"{self.title} {self.first_name} {self.last_name}"
@@ -206,10 +221,24 @@ class Appointment(TenantAwareModel):
     def save(self, *args, **kwargs):
         if not self.appointment_id:
             self.appointment_id = f"APT-{uuid.uuid4().hex[:8].upper()}"
-        super().save(*args, **kwargs)
+        # post_save/post_delete update the doctor's counters (adminapp/signals.py); the
+        # row and its counter change commit or roll back together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
     
     class Meta:
-        unique_together = [('hospital', 'doctor', 'appointment_date', 'appointment_time')]
+        constraints = [
+            # Cancelled appointments give their slot back
+            models.UniqueConstraint(
+                fields=['hospital', 'doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_active_appointment_slot',
+            ),
+        ]
         ordering = ['-appointment_date', '-appointment_time']
     
     def __str__(self):
@@ -219,6 +248,29 @@ class Appointment(TenantAwareModel):
     def patient_full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+
+class SlotHold(models.Model):
+    """
+    A patient's short-lived claim on a slot while filling in the booking form
+    (see adminapp/booking.py). One hold per slot and one per holder.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='slot_holds')
+    appointment_date = models.DateField()
+    appointment_time = models.TimeField()
+    holder = models.CharField(max_length=100, unique=True, help_text="Session key of the holding browser")
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                name='unique_slot_hold',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor_id} {self.appointment_date} {self.appointment_time} held by {self.holder}"
+
 class DoctorReview(TenantAwareModel):
     """
     Patient reviews for doctors
@@ -244,4 +296,14 @@ class DoctorReview(TenantAwareModel):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.patient_name} - {self.doctor.full_name} ({self.rating}/5)"
\ No newline at end of file
+        return f"{self.patient_name} - {self.doctor.full_name} ({self.rating}/5)"
+    
+    def save(self, *args, **kwargs):
+        # post_save/post_delete update the doctor's and hospital's rating counters; the
+        # row and its counter changes commit or roll back together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Django signals for the adminapp
+
+Keeps the denormalized Doctor counters current:
+
+* ``total_reviews``/``rating_total``/``average_rating`` from published
+  DoctorReview rows
+* ``total_appointments`` from Appointment rows that are not cancelled
+
+Each write applies its difference with one F-expression UPDATE of the
+doctor row, so concurrent reviews or bookings never lose an increment.
+The handlers run inside the transaction of the write itself
+(``Appointment``/``DoctorReview`` wrap ``save`` and ``delete`` in
+``atomic``) and let errors propagate, so a row is never committed
+without its counter change.
+``manage.py repair_doctor_counters`` verifies and rebuilds the counters.
+
+Also invalidates cached free slots (``adminapp/slots.py``): appointment
+writes drop the affected doctor-days, availability and doctor changes drop
+every cached day of the doctor.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import slots
+from .models import Appointment, Doctor, DoctorAvailability, DoctorReview
+
+logger = logging.getLogger(__name__)
+
+UNCOUNTED_APPOINTMENT_STATUSES = ('cancelled',)
+
+
+def review_counts(doctor_id, is_published, rating):
+    """(doctor_id, rating) a review adds to its doctor's counters, or None"""
+    if not doctor_id or not is_published:
+        return None
+    return doctor_id, rating
+
+
+def appointment_counts(doctor_id, status):
+    """Doctor id an appointment is counted for, or None"""
+    if not doctor_id or status in UNCOUNTED_APPOINTMENT_STATUSES:
+        return None
+    return doctor_id
+
+
+def apply_review_delta(doctor_id, count, rating):
+    """Add ``count`` reviews totalling ``rating`` points and recompute the average in the same UPDATE"""
+    # Every right-hand side sees the row before the update, so the average
+    # is computed from the new totals without reading them first
+    Doctor.objects.filter(pk=doctor_id).update(
+        total_reviews=F('total_reviews') + count,
+        rating_total=F('rating_total') + rating,
+        average_rating=Case(
+            When(Q(total_reviews__gt=-count), then=(
+                Cast(F('rating_total') + rating, FloatField()) / (F('total_reviews') + count)
+            )),
+            default=Value(0.0),
+        ),
+    )
+
+
+def move_review(old, new):
+    if old == new:
+        return
+    with transaction.atomic():
+        if old and new and old[0] == new[0]:
+            apply_review_delta(new[0], 0, new[1] - old[1])
+            return
+        if old:
+            apply_review_delta(old[0], -1, -old[1])
+        if new:
+            apply_review_delta(new[0], 1, new[1])
+
+
+def move_appointment(old, new):
+    if old == new:
+        return
+    with transaction.atomic():
+        if old:
+            Doctor.objects.filter(pk=old).update(total_appointments=F('total_appointments') - 1)
+        if new:
+            Doctor.objects.filter(pk=new).update(total_appointments=F('total_appointments') + 1)
+
+
+@receiver(pre_save, sender=DoctorReview)
+def remember_review_counts(sender, instance, **kwargs):
+    instance._doctor_counts = None
+    if instance._state.adding or instance.pk is None:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values('doctor_id', 'is_published', 'rating').first()
+    if stored:
+        instance._doctor_counts = review_counts(stored['doctor_id'], stored['is_published'], stored['rating'])
+
+
+@receiver(post_save, sender=DoctorReview)
+def update_doctor_rating(sender, instance, **kwargs):
+    move_review(
+        getattr(instance, '_doctor_counts', None),
+        review_counts(instance.doctor_id, instance.is_published, instance.rating),
+    )
+
+
+@receiver(post_delete, sender=DoctorReview)
+def remove_doctor_rating(sender, instance, **kwargs):
+    move_review(review_counts(instance.doctor_id, instance.is_published, instance.rating), None)
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_counts(sender, instance, **kwargs):
+    instance._doctor_counts = None
+    instance._stored_slot = None
+    if instance._state.adding or instance.pk is None:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values('doctor_id', 'status', 'appointment_date').first()
+    if stored:
+        instance._doctor_counts = appointment_counts(stored['doctor_id'], stored['status'])
+        instance._stored_slot = (stored['doctor_id'], stored['appointment_date'])
+
+
+@receiver(post_save, sender=Appointment)
+def update_doctor_appointments(sender, instance, **kwargs):
+    move_appointment(
+        getattr(instance, '_doctor_counts', None),
+        appointment_counts(instance.doctor_id, instance.status),
+    )
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_doctor_appointment(sender, instance, **kwargs):
+    move_appointment(appointment_counts(instance.doctor_id, instance.status), None)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_slots(sender, instance, **kwargs):
+    """A booking, cancellation or reschedule changes the doctor's free slots for that day"""
+    days = {(instance.doctor_id, slots.as_date(instance.appointment_date))}
+    stored = getattr(instance, '_stored_slot', None)
+    if stored:
+        days.add(stored)
+
+    def invalidate():
+        try:
+            for doctor_id, day in days:
+                slots.invalidate_doctor_day(doctor_id, day)
+        except Exception as e:
+            logger.error(f"Error invalidating slots for appointment {instance.pk}: {str(e)}")
+
+    # After commit: a lookup racing the booking transaction would otherwise
+    # recompute from the old rows and cache the just-booked slot as free
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=DoctorAvailability)
+@receiver(post_delete, sender=DoctorAvailability)
+def invalidate_availability_slots(sender, instance, **kwargs):
+    slots.bump_doctor_version(instance.doctor_id)
+
+
+@receiver(post_save, sender=Doctor)
+def invalidate_doctor_slots(sender, instance, created, **kwargs):
+    # Consultation length or availability may have changed
+    if not created:
+        slots.bump_doctor_version(instance.pk)
@@ -0,0 +1,247 @@
+"""
+Free appointment slots for doctors.
+
+A doctor's day is computed as interval arithmetic on minutes since
+midnight:
+
+1. the active ``DoctorAvailability`` windows for the weekday, sorted and
+   merged,
+2. minus the sorted, merged intervals of booked (not cancelled)
+   appointments,
+3. cut into ``consultation_duration`` slots aligned to each window's start.
+
+Results are cached per doctor-day (``SLOT_CACHE_TTL`` seconds) as a list
+of slot start minutes. Appointment writes delete the affected doctor-day
+(see ``adminapp/signals.py``); availability or doctor changes bump a
+per-doctor version so every cached day of that doctor is recomputed.
+Slots that already started today are dropped on read, never cached.
+Entries and versions live in Django's default cache, so invalidation
+reaches exactly the processes sharing it; with the per-process LocMem
+cache other workers can serve a day for up to ``SLOT_CACHE_TTL`` seconds
+after it changed (booking itself is still guarded by the database).
+
+Batch helpers compute many doctors and days with three queries in total
+(doctors, availability windows, appointments) for the cache misses.
+"""
+import datetime
+import logging
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SLOT_CACHE_PREFIX = 'adminapp:slots:'
+DEFAULT_SLOT_MINUTES = 30
+# Appointments in these states free their slot
+RELEASED_STATUSES = ('cancelled',)
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def as_date(value):
+    """Appointment dates may still be ISO strings right after a create from form data"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+
+def merge_intervals(intervals):
+    """Sort and merge overlapping or touching [start, end) intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(start, end, busy, busy_ends=None):
+    """
+    Parts of [start, end) not covered by ``busy`` (sorted, merged
+    intervals; ``busy_ends`` is their list of end points)
+    """
+    if busy_ends is None:
+        busy_ends = [b_end for _, b_end in busy]
+    free = []
+    cursor = start
+    # Skip busy intervals that end before the window starts
+    index = bisect_right(busy_ends, start)
+    for b_start, b_end in busy[index:]:
+        if b_start >= end:
+            break
+        if b_start > cursor:
+            free.append((cursor, b_start))
+        cursor = max(cursor, b_end)
+    if cursor < end:
+        free.append((cursor, end))
+    return free
+
+
+def compute_slots(windows, booked, duration):
+    """
+    Slot start minutes of a day: ``windows`` and ``booked`` are lists of
+    (start, end) minutes, ``duration`` the slot length in minutes
+    """
+    duration = duration or DEFAULT_SLOT_MINUTES
+    busy = merge_intervals(booked)
+    busy_ends = [b_end for _, b_end in busy]
+    slots = []
+    for w_start, w_end in merge_intervals(windows):
+        for f_start, f_end in subtract_intervals(w_start, w_end, busy, busy_ends):
+            # First grid point of this window at or after the free interval
+            offset = -(-(f_start - w_start) // duration) * duration
+            slot = w_start + offset
+            while slot + duration <= f_end:
+                slots.append(slot)
+                slot += duration
+    return slots
+
+
+def doctor_version_key(doctor_id):
+    return f"{SLOT_CACHE_PREFIX}{doctor_id}:version"
+
+
+def day_cache_key(doctor_id, version, day):
+    return f"{SLOT_CACHE_PREFIX}{doctor_id}:v{version}:{day.isoformat()}"
+
+
+def doctor_version(doctor_id):
+    # Kept next to the cached days it versions, in the same cache
+    key = doctor_version_key(doctor_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_doctor_version(doctor_id):
+    """Invalidate every cached day of a doctor (availability or duration changed)"""
+    try:
+        cache.incr(doctor_version_key(doctor_id))
+    except ValueError:
+        cache.set(doctor_version_key(doctor_id), 2, timeout=None)
+
+
+def invalidate_doctor_day(doctor_id, day):
+    """Drop one cached doctor-day after a booking or cancellation"""
+    version = doctor_version(doctor_id)
+    cache.delete(day_cache_key(doctor_id, version, as_date(day)))
+
+
+def _compute_days(doctors, days):
+    """Slot minutes for every (doctor id, day) pair, straight from the database"""
+    from .models import Appointment, DoctorAvailability
+
+    doctor_ids = [doctor.id for doctor in doctors]
+    windows = {}
+    for row in DoctorAvailability.objects.filter(
+        doctor_id__in=doctor_ids, is_active=True
+    ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time'):
+        windows.setdefault((row[0], row[1]), []).append((to_minutes(row[2]), to_minutes(row[3])))
+
+    booked = {}
+    for doctor_id, day, start, duration in Appointment.objects.filter(
+        doctor_id__in=doctor_ids, appointment_date__in=days
+    ).exclude(status__in=RELEASED_STATUSES).values_list(
+        'doctor_id', 'appointment_date', 'appointment_time', 'duration'
+    ):
+        start = to_minutes(start)
+        booked.setdefault((doctor_id, day), []).append((start, start + (duration or DEFAULT_SLOT_MINUTES)))
+
+    result = {}
+    for doctor in doctors:
+        for day in days:
+            if not doctor.is_available:
+                result[(doctor.id, day)] = []
+                continue
+            result[(doctor.id, day)] = compute_slots(
+                windows.get((doctor.id, day.weekday()), []),
+                booked.get((doctor.id, day), []),
+                doctor.consultation_duration,
+            )
+    return result
+
+
+def _drop_past(slots, day, now):
+    if day < now.date():
+        return []
+    if day > now.date():
+        return slots
+    current = now.hour * 60 + now.minute
+    return [slot for slot in slots if slot > current]
+
+
+def doctors_free_slots(doctors, days, now=None):
+    """
+    Free slots as ``{doctor_id: {day: ['09:00', ...]}}`` for several doctors
+    and days, computing only the doctor-days missing from the cache
+    """
+    doctors = list(doctors)
+    days = sorted({as_date(day) for day in days})
+    if not doctors or not days:
+        return {}
+    now = now or timezone.localtime()
+
+    versions = cache.get_many([doctor_version_key(doctor.id) for doctor in doctors])
+    keys = {}
+    for doctor in doctors:
+        version = versions.get(doctor_version_key(doctor.id))
+        if version is None:
+            version = doctor_version(doctor.id)
+        for day in days:
+            keys[(doctor.id, day)] = day_cache_key(doctor.id, version, day)
+
+    cached = cache.get_many(list(keys.values()))
+    found = {pair: cached[key] for pair, key in keys.items() if key in cached}
+    missing = [pair for pair in keys if pair not in found]
+    if missing:
+        missing_doctors = {doctor_id for doctor_id, _ in missing}
+        computed = _compute_days(
+            [doctor for doctor in doctors if doctor.id in missing_doctors],
+            sorted({day for _, day in missing}),
+        )
+        computed = {pair: computed[pair] for pair in missing}
+        cache.set_many(
+            {keys[pair]: slots for pair, slots in computed.items()},
+            timeout=getattr(settings, 'SLOT_CACHE_TTL', 300),
+        )
+        found.update(computed)
+
+    availability = {}
+    for (doctor_id, day), slots in found.items():
+        availability.setdefault(doctor_id, {})[day] = [
+            format_minutes(slot) for slot in _drop_past(slots, day, now)
+        ]
+    return availability
+
+
+def free_slots(doctor, day, now=None):
+    """Free slot times ('HH:MM') of one doctor on one day"""
+    day = as_date(day)
+    return doctors_free_slots([doctor], [day], now=now).get(doctor.id, {}).get(day, [])
+
+
+def hospital_free_slots(hospital, days, now=None):
+    """Batch mode: free slots of every available doctor of a hospital"""
+    from .models import Doctor
+
+    doctors = Doctor.objects.filter(hospital=hospital, is_available=True).only(
+        'id', 'is_available', 'consultation_duration'
+    )
+    return doctors_free_slots(doctors, days, now=now)
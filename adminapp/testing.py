@@ -0,0 +1,12 @@
+"""
+Test fixtures shared by the apps' test suites (see also ``tenants/testing.py``).
+"""
+from .models import Category, Doctor
+
+
+def make_doctor(hospital, last_name='One', category=None, **fields):
+    """Create a doctor of ``hospital``, in a new 'Cardiology' category unless one is given"""
+    if category is None:
+        category = Category.objects.create(hospital=hospital, name='Cardiology')
+    fields.setdefault('first_name', 'A')
+    return Doctor.objects.create(hospital=hospital, category=category, last_name=last_name, **fields)
@@ -1,3 +1,332 @@
-from django.test import TestCase
+import datetime
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from tenants.testing import make_hospital
+from .booking import BookingConflict, book_slot, hold_slot, release_slot, slot_holder
+from .models import Appointment, Doctor, DoctorAvailability, DoctorReview, SlotHold
+from .slots import compute_slots, doctors_free_slots, free_slots, hospital_free_slots
+from .testing import make_doctor
+
+
+class DoctorCountersTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.other = make_doctor(self.hospital, 'Two', category=self.doctor.category)
+
+    def review(self, rating, **fields):
+        return DoctorReview.objects.create(
+            hospital=self.hospital, doctor=fields.pop('doctor', self.doctor), patient_name='P', rating=rating, **fields
+        )
+
+    def book(self, hour, **fields):
+        return Appointment.objects.create(
+            hospital=self.hospital, doctor=self.doctor, first_name='P', last_name='Q', phone='9876543210',
+            email='p@test.com', date_of_birth=datetime.date(1990, 1, 1), gender='other',
+            appointment_date=datetime.date(2030, 1, 1), appointment_time=datetime.time(hour), **fields
+        )
+
+    def counters(self, doctor=None):
+        return Doctor.objects.values('total_reviews', 'rating_total', 'average_rating', 'total_appointments').get(
+            pk=(doctor or self.doctor).pk
+        )
+
+    def test_review_writes_update_rating_counters(self):
+        stale_copy = Doctor.objects.get(pk=self.doctor.pk)
+        first = self.review(5)
+        second = self.review(4)
+        self.review(1, is_published=False)
+        self.assertEqual(self.counters()['total_reviews'], 2)
+        self.assertEqual(self.counters()['average_rating'], Decimal('4.50'))
+
+        # Saving a doctor loaded earlier does not overwrite the counters
+        stale_copy.bio = 'Cardiologist'
+        stale_copy.save()
+        self.assertEqual(self.counters()['total_reviews'], 2)
+
+        second.rating = 2
+        second.save()
+        self.assertEqual(self.counters()['average_rating'], Decimal('3.50'))
+
+        first.doctor = self.other
+        first.save()
+        self.assertEqual(self.counters()['average_rating'], Decimal('2.00'))
+        self.assertEqual(self.counters(self.other)['total_reviews'], 1)
+
+        second.delete()
+        self.assertEqual(self.counters(), {
+            'total_reviews': 0, 'rating_total': 0, 'average_rating': Decimal('0.00'), 'total_appointments': 0,
+        })
+
+    def test_appointment_writes_update_appointment_counter(self):
+        appointment = self.book(9)
+        self.book(10)
+        self.assertEqual(self.counters()['total_appointments'], 2)
+
+        appointment.status = 'cancelled'
+        appointment.save()
+        self.assertEqual(self.counters()['total_appointments'], 1)
+        appointment.delete()
+        self.assertEqual(self.counters()['total_appointments'], 1)
+
+    def test_failed_counter_update_rolls_back_the_write(self):
+        with mock.patch('adminapp.signals.move_appointment', side_effect=OperationalError('database table is locked')):
+            with self.assertRaises(OperationalError):
+                self.book(9)
+        self.assertFalse(Appointment.objects.exists())
+
+        review = self.review(5)
+        with mock.patch('adminapp.signals.move_review', side_effect=OperationalError('database table is locked')):
+            with self.assertRaises(OperationalError):
+                review.delete()
+        self.assertTrue(DoctorReview.objects.filter(pk=review.pk).exists())
+        self.assertEqual(self.counters()['total_reviews'], 1)
+
+    def test_repair_command_recomputes_counters(self):
+        self.review(5)
+        self.review(2)
+        self.book(9)
+        Doctor.objects.update(total_reviews=7, rating_total=0, average_rating=1, total_appointments=0)
+
+        out = StringIO()
+        call_command('repair_doctor_counters', '--check', stdout=out)
+        self.assertIn('2 doctors have out-of-date counters', out.getvalue())
+        self.assertEqual(self.counters()['total_reviews'], 7)
+
+        with self.assertNumQueries(6):
+            # Reviews GROUP BY, appointments GROUP BY, doctors, then one UPDATE inside a savepoint
+            call_command('repair_doctor_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), {
+            'total_reviews': 2, 'rating_total': 7, 'average_rating': Decimal('3.50'), 'total_appointments': 1,
+        })
+        self.assertEqual(self.counters(self.other)['total_reviews'], 0)
+
+
+class SlotArithmeticTest(SimpleTestCase):
+    def test_windows_minus_bookings(self):
+        windows = [(540, 720), (840, 960), (600, 660)]  # 09-12, 14-16, overlapping 10-11
+        booked = [(570, 600), (600, 615), (900, 960)]  # 09:30-10:15, 15:00-16:00
+        self.assertEqual(
+            compute_slots(windows, booked, 30),
+            [540, 630, 660, 690, 840, 870],  # 10:15-10:30 is too short; the grid stays on the half hour
+        )
+
+    def test_no_windows_means_no_slots(self):
+        self.assertEqual(compute_slots([], [], 30), [])
+
+
+class SlotEngineTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.other = make_doctor(self.hospital, 'Two', category=self.doctor.category)
+        self.day = datetime.date(2030, 1, 7)  # a Monday
+        self.now = timezone.make_aware(datetime.datetime(2030, 1, 1, 8, 0))
+        for doctor in (self.doctor, self.other):
+            DoctorAvailability.objects.create(
+                hospital=self.hospital, doctor=doctor, day_of_week=0,
+                start_time=datetime.time(9), end_time=datetime.time(11),
+            )
+
+    def book(self, time, **fields):
+        return Appointment.objects.create(
+            hospital=self.hospital, doctor=self.doctor, first_name='P', last_name='Q', phone='9876543210',
+            email='p@test.com', date_of_birth=datetime.date(1990, 1, 1), gender='other',
+            appointment_date=self.day, appointment_time=time, **fields
+        )
+
+    def slots(self):
+        return free_slots(self.doctor, self.day, now=self.now)
+
+    def test_bookings_and_cancellations_update_cached_slots(self):
+        self.assertEqual(self.slots(), ['09:00', '09:30', '10:00', '10:30'])
+        with self.assertNumQueries(0):
+            self.slots()
+
+        # The cached day is dropped once the booking commits, not before
+        with self.captureOnCommitCallbacks() as callbacks:
+            appointment = self.book(datetime.time(9, 30))
+            self.assertEqual(self.slots(), ['09:00', '09:30', '10:00', '10:30'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.slots(), ['09:00', '10:00', '10:30'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.status = 'cancelled'
+            appointment.save()
+        self.assertEqual(self.slots(), ['09:00', '09:30', '10:00', '10:30'])
+
+    def test_availability_and_duration_changes_recompute(self):
+        self.slots()
+        self.doctor.consultation_duration = 60
+        self.doctor.save()
+        self.assertEqual(self.slots(), ['09:00', '10:00'])
+
+        DoctorAvailability.objects.create(
+            hospital=self.hospital, doctor=self.doctor, day_of_week=0,
+            start_time=datetime.time(14), end_time=datetime.time(15),
+        )
+        self.assertEqual(self.slots(), ['09:00', '10:00', '14:00'])
+        # Tuesdays have no availability; past days and started slots are dropped
+        self.assertEqual(free_slots(self.doctor, self.day + datetime.timedelta(days=1), now=self.now), [])
+        late = timezone.make_aware(datetime.datetime(2030, 1, 7, 9, 45))
+        self.assertEqual(free_slots(self.doctor, self.day, now=late), ['10:00', '14:00'])
+
+    def test_hospital_batch_mode_uses_three_queries(self):
+        self.book(datetime.time(10))
+        days = [self.day, self.day + datetime.timedelta(days=7)]
+        with self.assertNumQueries(3):
+            # Doctors, availability windows, appointments
+            availability = hospital_free_slots(self.hospital, days, now=self.now)
+        self.assertEqual(availability[self.doctor.id][self.day], ['09:00', '09:30', '10:30'])
+        self.assertEqual(availability[self.other.id][days[1]], ['09:00', '09:30', '10:00', '10:30'])
+        with self.assertNumQueries(0):
+            doctors_free_slots([self.doctor, self.other], days, now=self.now)
+
+
+PATIENT = {
+    'first_name': 'P', 'last_name': 'Q', 'phone': '9876543210', 'email': 'p@test.com',
+    'date_of_birth': datetime.date(1990, 1, 1), 'gender': 'other',
+}
+
+
+class BookingFixture:
+    def setUp(self):
+        cache.clear()
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        self.day = datetime.date(2030, 1, 7)
+
+    def book(self, holder, slot_time='09:30'):
+        return book_slot(self.doctor, self.hospital, self.day, slot_time, holder, **PATIENT)
+
+
+class BookingTest(BookingFixture, TestCase):
+    def test_holds_block_other_patients(self):
+        hold_slot(self.doctor.id, self.day, '9:30', 'alice')
+        with self.assertRaises(BookingConflict) as raised:
+            self.book('bob')
+        self.assertEqual(raised.exception.to_dict()['code'], 'slot_held')
+        self.assertEqual(raised.exception.to_dict()['time'], '09:30')
+
+        appointment = self.book('alice')
+        self.assertEqual(appointment.doctor, self.doctor)
+        # Booking releases the hold; the slot is now taken in the database
+        with self.assertRaises(BookingConflict) as raised:
+            self.book('bob')
+        self.assertEqual(raised.exception.code, 'slot_taken')
+
+    def test_released_holds_and_cancellations_free_the_slot(self):
+        hold_slot(self.doctor.id, self.day, '09:30', 'alice')
+        release_slot(self.doctor.id, self.day, '09:30', 'bob')  # not bob's hold
+        with self.assertRaises(BookingConflict):
+            self.book('bob')
+        release_slot(self.doctor.id, self.day, '09:30', 'alice')
+
+        appointment = self.book('bob')
+        appointment.status = 'cancelled'
+        appointment.save()
+        self.assertEqual(self.book('carol').status, 'scheduled')
+
+    def test_a_holder_keeps_one_hold(self):
+        hold_slot(self.doctor.id, self.day, '09:30', 'alice')
+        hold_slot(self.doctor.id, self.day, '10:00', 'alice')
+        # Alice's first slot went back when she picked another one
+        self.assertEqual(self.book('bob').appointment_time, '09:30')
+        with self.assertRaises(BookingConflict):
+            self.book('bob', '10:00')
+
+    def test_losing_a_booking_releases_the_hold(self):
+        self.book('alice')
+        with self.assertRaises(BookingConflict) as raised:
+            self.book('bob')
+        self.assertEqual(raised.exception.code, 'slot_taken')
+        self.assertFalse(SlotHold.objects.filter(holder='bob').exists())
+
+    def test_expired_holds_do_not_block(self):
+        hold_slot(self.doctor.id, self.day, '09:30', 'alice')
+        self.assertEqual(slot_holder(self.doctor.id, self.day, '9:30'), 'alice')
+        SlotHold.objects.update(expires_at=timezone.now())
+        self.assertIsNone(slot_holder(self.doctor.id, self.day, '09:30'))
+        self.assertEqual(self.book('bob').appointment_time, '09:30')
+        self.assertEqual(SlotHold.objects.count(), 0)
+
+    def test_hold_view_only_holds_free_slots(self):
+        DoctorAvailability.objects.create(
+            hospital=self.hospital, doctor=self.doctor, day_of_week=0,
+            start_time=datetime.time(9), end_time=datetime.time(10),
+        )
+        hold = {'doctor_id': self.doctor.id, 'date': '2030-01-07', 'time': '9:00'}
+        self.assertEqual(self.client.post('/hold-slot/', dict(hold, doctor_id=0)).status_code, 404)
+        response = self.client.post('/hold-slot/', dict(hold, time='15:00'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error']['code'], 'slot_taken')
+
+        self.assertTrue(self.client.post('/hold-slot/', hold).json()['held'])
+        self.assertTrue(self.client.post('/hold-slot/', dict(hold, time='09:30')).json()['held'])
+        self.assertEqual(self.book('bob', '09:00').appointment_time, '09:00')
+
+    def test_booking_view_reports_conflicts(self):
+        hold_slot(self.doctor.id, self.day, '09:30', 'someone-else')
+        data = dict(PATIENT, hospital=str(self.hospital.id), doctor=self.doctor.id, date='2030-01-07',
+                    time='09:30', zipcode='400001')
+        response = self.client.post('/bookappointment/', data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error']['code'], 'slot_held')
+
+        DoctorAvailability.objects.create(
+            hospital=self.hospital, doctor=self.doctor, day_of_week=0,
+            start_time=datetime.time(9), end_time=datetime.time(11),
+        )
+        response = self.client.post('/hold-slot/', {'doctor_id': self.doctor.id, 'date': '2030-01-07', 'time': '10:00'})
+        self.assertEqual(response.json(), {'held': True, 'expires_in': 300})
+        response = self.client.post('/bookappointment/', dict(data, time='10:00'))
+        self.assertRedirects(response, f"/appointment/confirmation/{Appointment.objects.get().appointment_id}/",
+                             fetch_redirect_response=False)
+
+
+class ConcurrentBookingTest(BookingFixture, TransactionTestCase):
+    def race(self, holder_for, attempts=8):
+        barrier = threading.Barrier(attempts)
+        results = []
+
+        def attempt(index):
+            try:
+                barrier.wait()
+                results.append(self.book(holder_for(index)))
+            except BookingConflict as conflict:
+                results.append(conflict)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(index,)) for index in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        booked = [result for result in results if isinstance(result, Appointment)]
+        conflicts = [result for result in results if isinstance(result, BookingConflict)]
+        self.assertEqual(len(booked), 1)
+        self.assertEqual(len(conflicts), attempts - 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor).count(), 1)
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.total_appointments, 1)
+        return conflicts
+
+    def test_exactly_one_concurrent_booking_wins(self):
+        self.race(lambda index: f'patient-{index}')
+
+    def test_double_submitted_form_books_once(self):
+        # Same holder: every request passes the hold, the database decides
+        conflicts = self.race(lambda index: 'patient')
+        self.assertEqual({conflict.code for conflict in conflicts}, {'slot_taken'})
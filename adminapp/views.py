@@ -4,6 +4,7 @@ from django.contrib import messages
 from .models import *
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from tenants.stats import get_hospital_stats
 
 
 # Create your views here.
@@ -14,28 +15,15 @@ def admindash(request):
         return redirect('adminlogin')
     adminid=request.session.get('adminid')
     
-    # Add these context variables
-    from myapp.models import UserInfo, Enquiry
-    from .models import Doctor, Category, Appointment
-    
-    # Use tenant-aware counts
-    if hasattr(request, 'hospital') and request.hospital:
-        user_count = UserInfo.tenant_objects.count()
-        book_count = Appointment.tenant_objects.count()
-        cat_count = Category.tenant_objects.count()
-        enq_count = Enquiry.tenant_objects.count()
-    else:
-        user_count = UserInfo.objects.count()
-        book_count = Appointment.objects.count()
-        cat_count = Category.objects.count()
-        enq_count = Enquiry.objects.count()
+    # Tenant counts when a hospital is selected, platform-wide otherwise
+    stats = get_hospital_stats(getattr(request, 'hospital', None))
     
     context={
         'adminid':adminid,
-        'user_count': user_count,
-        'book_count': book_count,
-        'cat_count': cat_count,
-        'enq_count': enq_count,
+        'user_count': stats['patients'],
+        'book_count': stats['appointments'],
+        'cat_count': stats['categories'],
+        'enq_count': stats['enquiries'],
         'hospital': getattr(request, 'hospital', None),
     }
     return render(request,'admindash.html',context)
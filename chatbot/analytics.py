@@ -0,0 +1,214 @@
+"""
+Incremental ChatAnalytics rollup.
+
+``manage.py rollup_chat_analytics`` keeps one ChatAnalytics row per
+hospital per day, so dashboards read a few precomputed rows instead of
+scanning ChatMessage.
+
+Each run only looks at rows added since the stored watermark (highest
+ChatMessage, ChatSession and WhatsAppSession ids already seen, see
+``AnalyticsWatermark``). Ids rather than timestamps are used because
+buffered chat turns (``chatbot/transcripts.py``) can be inserted after
+later-timestamped ones. The days those new rows fall on are recomputed
+completely with GROUP BY queries in the database and upserted with
+``bulk_create(update_conflicts=True)``. Rows, watermark and upserts are
+written in one transaction, so a run is idempotent and a crashed run is
+simply repeated.
+
+Feedback (``is_helpful``) given on an old message does not add a row;
+``--since`` recomputes a date range to pick such edits up. Days are
+split in ``TIME_ZONE``.
+
+The retention sweep (``chatbot/retention.py``) trims messages and purges
+expired guest sessions, so the raw rows of older days shrink over time.
+A recomputed day therefore never lowers a stored row: if the new count of
+messages or sessions is below the stored one, raw data has been deleted
+since and the stored totals are kept as they are. ``--since`` and
+``--full`` are only exact for days whose raw rows are still complete;
+feedback edits on a day that has since been trimmed are not picked up.
+"""
+import datetime
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AnalyticsWatermark, ChatAnalytics, ChatMessage, ChatSession, WhatsAppSession
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'chat_analytics'
+
+MESSAGE_METRICS = {
+    'total_messages': Count('id'),
+    'user_messages': Count('id', filter=Q(role='user')),
+    'assistant_messages': Count('id', filter=Q(role='assistant')),
+    'avg_response_time': Avg('processing_time', filter=Q(role='assistant')),
+    'avg_confidence_score': Avg('confidence_score', filter=Q(role='assistant')),
+    'helpful_responses': Count('id', filter=Q(is_helpful=True)),
+    'unhelpful_responses': Count('id', filter=Q(is_helpful=False)),
+    'doctor_recommendations': Count('id', filter=Q(message_type='doctor_recommendation')),
+    'appointment_bookings': Count('id', filter=Q(message_type='appointment_booking')),
+    'hospital_inquiries': Count('id', filter=Q(message_type='hospital_info')),
+}
+SESSION_METRICS = {
+    'total_sessions': Count('id', distinct=True),
+    'guest_sessions': Count('id', filter=Q(is_guest=True), distinct=True),
+    'user_sessions': Count('id', filter=Q(is_guest=False), distinct=True),
+    'whatsapp_sessions': Count('id', filter=Q(whatsappsession__isnull=False), distinct=True),
+}
+METRIC_FIELDS = list(SESSION_METRICS) + list(MESSAGE_METRICS)
+
+
+def day_range(days):
+    """Aware [start, end) datetimes covering ``days`` in the current time zone"""
+    start = timezone.make_aware(datetime.datetime.combine(min(days), datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(max(days) + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def _days(queryset, field):
+    return set(
+        queryset.annotate(day=TruncDate(field)).order_by().values_list('day', flat=True).distinct()
+    )
+
+
+def touched_days(watermark, upper):
+    """Days that received messages, sessions or WhatsApp links after the watermark"""
+    days = _days(ChatMessage.objects.filter(
+        id__gt=watermark.last_message_id, id__lte=upper['message']
+    ), 'timestamp')
+    days |= _days(ChatSession.objects.filter(
+        id__gt=watermark.last_session_id, id__lte=upper['session']
+    ), 'created_at')
+    days |= _days(WhatsAppSession.objects.filter(
+        id__gt=watermark.last_whatsapp_session_id, id__lte=upper['whatsapp_session']
+    ), 'chat_session__created_at')
+    return days
+
+
+def compute_rows(days):
+    """{(hospital_id, day): metrics} for ``days``, aggregated in the database"""
+    start, end = day_range(days)
+    rows = {}
+    grouped = [
+        (ChatMessage.objects.filter(timestamp__gte=start, timestamp__lt=end)
+         .annotate(day=TruncDate('timestamp')).order_by()
+         .values('session__hospital_id', 'day').annotate(**MESSAGE_METRICS), 'session__hospital_id'),
+        (ChatSession.objects.filter(created_at__gte=start, created_at__lt=end)
+         .annotate(day=TruncDate('created_at')).order_by()
+         .values('hospital_id', 'day').annotate(**SESSION_METRICS), 'hospital_id'),
+    ]
+    for queryset, hospital_field in grouped:
+        for row in queryset:
+            key = (row.pop(hospital_field), row.pop('day'))
+            if key[1] in days:
+                rows.setdefault(key, {}).update(row)
+    for metrics in rows.values():
+        for field in METRIC_FIELDS:
+            if metrics.get(field) is None:
+                metrics[field] = 0
+    return rows
+
+
+def is_complete(stored, metrics):
+    """False if ``metrics`` count fewer messages or sessions than the stored row (raw rows were deleted)"""
+    return (
+        metrics is not None
+        and metrics['total_messages'] >= stored['total_messages']
+        and metrics['total_sessions'] >= stored['total_sessions']
+    )
+
+
+def write_rows(days, rows):
+    """Upsert ``rows`` for ``days``, keeping stored rows the raw data no longer fully covers; returns rows written"""
+    stored = ChatAnalytics.objects.filter(date__in=days).values(
+        'hospital_id', 'date', 'total_messages', 'total_sessions'
+    )
+    rows = dict(rows)
+    for row in stored:
+        key = (row['hospital_id'], row['date'])
+        if not is_complete(row, rows.get(key)):
+            rows.pop(key, None)
+
+    # Rows without a hospital cannot be upserted (NULLs never conflict) and are re-inserted
+    untenanted_days = [day for hospital_id, day in rows if not hospital_id]
+    if untenanted_days:
+        ChatAnalytics.objects.filter(hospital__isnull=True, date__in=untenanted_days).delete()
+
+    objs = [
+        ChatAnalytics(hospital_id=hospital_id, date=day, **metrics)
+        for (hospital_id, day), metrics in rows.items()
+    ]
+    ChatAnalytics.objects.bulk_create(
+        [obj for obj in objs if obj.hospital_id],
+        update_conflicts=True,
+        unique_fields=['hospital', 'date'],
+        update_fields=METRIC_FIELDS,
+        batch_size=500,
+    )
+    ChatAnalytics.objects.bulk_create([obj for obj in objs if not obj.hospital_id], batch_size=500)
+    return len(objs)
+
+
+def rollup_chat_analytics(since=None, full=False):
+    """
+    Fold new chat activity into ChatAnalytics. ``since`` (a date) also
+    recomputes every day from then to today; ``full`` recomputes all days.
+    Stored totals are never lowered (see the module docstring).
+    Returns {'days': .., 'rows': .., 'seconds': ..}
+    """
+    started = time.monotonic()
+    with transaction.atomic():
+        # Concurrent runs queue up here instead of racing on the watermark
+        watermark, _ = AnalyticsWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        # Rows inserted while we run are left for the next run
+        upper = {
+            'message': ChatMessage.objects.aggregate(value=Max('id'))['value'] or 0,
+            'session': ChatSession.objects.aggregate(value=Max('id'))['value'] or 0,
+            'whatsapp_session': WhatsAppSession.objects.aggregate(value=Max('id'))['value'] or 0,
+        }
+        if full:
+            days = _days(ChatMessage.objects.all(), 'timestamp') | _days(ChatSession.objects.all(), 'created_at')
+        else:
+            days = touched_days(watermark, upper)
+        if since:
+            today = timezone.localdate()
+            days |= {since + datetime.timedelta(days=i) for i in range((today - since).days + 1)}
+
+        written = write_rows(days, compute_rows(days)) if days else 0
+
+        watermark.last_message_id = max(watermark.last_message_id, upper['message'])
+        watermark.last_session_id = max(watermark.last_session_id, upper['session'])
+        watermark.last_whatsapp_session_id = max(watermark.last_whatsapp_session_id, upper['whatsapp_session'])
+        watermark.save()
+
+    result = {'days': len(days), 'rows': written, 'seconds': time.monotonic() - started}
+    logger.info(f"Chat analytics rollup: {result['rows']} rows over {result['days']} days in {result['seconds']:.2f}s")
+    return result
+
+
+def chat_summary(hospital_id, days=30):
+    """Totals over the last ``days`` days, read from the precomputed ChatAnalytics rows"""
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    totals = ChatAnalytics.objects.filter(hospital_id=hospital_id, date__gte=since).aggregate(
+        sessions=Sum('total_sessions'),
+        whatsapp_sessions=Sum('whatsapp_sessions'),
+        messages=Sum('total_messages'),
+        replies=Sum('assistant_messages'),
+        response_time_total=Sum(F('avg_response_time') * F('assistant_messages'), output_field=FloatField()),
+        helpful_responses=Sum('helpful_responses'),
+        unhelpful_responses=Sum('unhelpful_responses'),
+        doctor_recommendations=Sum('doctor_recommendations'),
+        appointment_bookings=Sum('appointment_bookings'),
+    )
+    response_time_total = totals.pop('response_time_total') or 0
+    summary = {key: value or 0 for key, value in totals.items()}
+    # Daily averages weighted by that day's number of replies
+    summary['avg_response_time'] = (
+        round(response_time_total / summary['replies'], 2) if summary['replies'] else 0
+    )
+    return summary
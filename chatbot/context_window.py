@@ -0,0 +1,217 @@
+"""
+Token-budgeted conversation context for Ollama prompts.
+
+The model runs with ``num_ctx 4096`` (see ``Modelfile``); whatever does not
+fit is silently truncated by Ollama, and every prompt token costs
+prompt-eval time. ``ContextWindow`` builds each prompt from:
+
+* the rolling summary of older turns (``CHAT_CONTEXT_SUMMARY_TOKENS``),
+* as many recent turns as fit the remaining budget, newest first,
+* the new message,
+
+leaving ``CHAT_CONTEXT_SYSTEM_TOKENS`` for the Modelfile SYSTEM prompt and
+``CHAT_CONTEXT_RESPONSE_TOKENS`` for the answer. Turns that fall out of
+the window are folded into the summary (an extractive one-line digest per
+turn, so no extra model call) and removed from the stored history.
+
+Ollama returns the evaluated conversation as a ``context`` token array.
+When the next message of a conversation reaches the same process and the
+stored turn counter still matches, the array is passed back and only the
+new message is sent, so the earlier turns are not evaluated again. The
+arrays live in a bounded in-process LRU; a miss simply rebuilds the
+prompt from summary and window.
+
+Token counts are estimated from character length (no tokenizer is loaded
+in the web process); ``CHARS_PER_TOKEN`` errs on the side of more tokens.
+"""
+import logging
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Mistral-family tokenizers average roughly 3.5-4 characters per token on English text
+CHARS_PER_TOKEN = 3.5
+USER_LABEL = 'Patient'
+ASSISTANT_LABEL = 'SymptomWise'
+DIGEST_CHARS = 160
+
+_sentence_end = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def pair_entries(entries):
+    """
+    WhatsApp history ([{'user': ..}, {'ai': ..}, ...]) as turns
+    ([{'user': .., 'assistant': ..}, ...])
+    """
+    turns = []
+    for entry in entries:
+        if 'user' in entry:
+            turns.append({'user': entry['user'], 'assistant': ''})
+        elif 'ai' in entry and turns and not turns[-1]['assistant']:
+            turns[-1]['assistant'] = entry['ai']
+        elif 'ai' in entry:
+            turns.append({'user': '', 'assistant': entry['ai']})
+    return turns
+
+
+def _first_sentence(text):
+    text = ' '.join((text or '').split())
+    sentence = _sentence_end.split(text, 1)[0]
+    if len(sentence) > DIGEST_CHARS:
+        sentence = sentence[:DIGEST_CHARS].rsplit(' ', 1)[0] + '...'
+    return sentence
+
+
+def digest_turn(turn):
+    """One summary line for a turn that left the window"""
+    parts = []
+    if turn.get('user'):
+        parts.append(f"{USER_LABEL}: {_first_sentence(turn['user'])}")
+    if turn.get('assistant'):
+        parts.append(f"{ASSISTANT_LABEL}: {_first_sentence(turn['assistant'])}")
+    return ' / '.join(parts)
+
+
+def format_turn(turn):
+    lines = []
+    if turn.get('user'):
+        lines.append(f"{USER_LABEL}: {turn['user']}")
+    if turn.get('assistant'):
+        lines.append(f"{ASSISTANT_LABEL}: {turn['assistant']}")
+    return '\n'.join(lines)
+
+
+@dataclass
+class PromptPlan:
+    prompt: str
+    history: list  # turns still inside the window; store these back
+    summary: str
+    options: dict = field(default_factory=dict)  # extra /api/generate fields
+    reused_context: bool = False
+
+    @property
+    def prompt_tokens(self):
+        return estimate_tokens(self.prompt)
+
+
+class ContextCache:
+    """Bounded LRU of Ollama context arrays: key -> (turn, tokens)"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, turn, tokens):
+        # array('l') keeps a 4096-token context at ~32KB instead of ~150KB of ints
+        with self._lock:
+            self._entries[key] = (turn, array('l', tokens))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class ContextWindow:
+    def __init__(self, num_ctx=None, system_tokens=None, response_tokens=None, summary_tokens=None, cache_size=None):
+        self.num_ctx = num_ctx or getattr(settings, 'CHAT_CONTEXT_NUM_CTX', 4096)
+        self.system_tokens = system_tokens if system_tokens is not None else getattr(settings, 'CHAT_CONTEXT_SYSTEM_TOKENS', 768)
+        self.response_tokens = response_tokens or getattr(settings, 'CHAT_CONTEXT_RESPONSE_TOKENS', 1024)
+        self.summary_tokens = summary_tokens or getattr(settings, 'CHAT_CONTEXT_SUMMARY_TOKENS', 384)
+        self.cache = ContextCache(cache_size or getattr(settings, 'CHAT_CONTEXT_CACHE_SIZE', 256))
+
+    @property
+    def prompt_budget(self):
+        """Tokens available for summary, recent turns and the new message"""
+        return self.num_ctx - self.system_tokens - self.response_tokens
+
+    def fold_summary(self, summary, dropped):
+        lines = [line for line in (summary or '').splitlines() if line]
+        lines.extend(digest_turn(turn) for turn in dropped)
+        # Oldest digests go first once the summary is over its budget
+        while lines and estimate_tokens('\n'.join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return '\n'.join(lines)
+
+    def fit(self, history, summary, message):
+        """Split ``history`` into (turns kept in the window, updated summary)"""
+        budget = self.prompt_budget - estimate_tokens(message) - self.summary_tokens
+        used = 0
+        split = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            cost = estimate_tokens(format_turn(history[index])) + 1
+            if used + cost > budget:
+                break
+            used += cost
+            split = index
+        kept, dropped = list(history[split:]), history[:split]
+        return kept, self.fold_summary(summary, dropped) if dropped else (summary or '')
+
+    def render(self, history, summary, message):
+        sections = []
+        if summary:
+            sections.append(f"Summary of the earlier conversation:\n{summary}")
+        if history:
+            sections.append("Recent conversation:\n" + '\n'.join(format_turn(turn) for turn in history))
+        if not sections:
+            return message
+        sections.append(f"{USER_LABEL}: {message}\n{ASSISTANT_LABEL}:")
+        return '\n\n'.join(sections)
+
+    def plan(self, message, history=(), summary='', key=None, turn=0):
+        """
+        Prompt for ``message``. ``key``/``turn`` identify the conversation and
+        how many turns it has had, for reusing a cached Ollama context.
+        """
+        kept, summary = self.fit(list(history), summary, message)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                cached_turn, tokens = cached
+                fits = len(tokens) + estimate_tokens(message) + self.response_tokens <= self.num_ctx
+                if cached_turn == turn and fits:
+                    return PromptPlan(message, kept, summary, {'context': list(tokens)}, reused_context=True)
+                # Stale (another worker answered since) or too long to extend
+                self.cache.discard(key)
+        return PromptPlan(self.render(kept, summary, message), kept, summary)
+
+    def remember(self, key, turn, context):
+        """Keep the ``context`` array Ollama returned after ``turn`` turns"""
+        if key is not None and context:
+            self.cache.set(key, turn, context)
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def get_context_window():
+    """Return the process-wide context window manager"""
+    global _window
+    if _window is None:
+        with _window_lock:
+            if _window is None:
+                _window = ContextWindow()
+    return _window
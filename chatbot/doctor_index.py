@@ -0,0 +1,147 @@
+"""
+Materialized specialty -> doctor index for chatbot recommendations.
+
+Doctors (except those of inactive hospitals) are loaded in one query and
+kept per process, grouped by tenant and pre-sorted by rank: available
+first, then featured, rating and experience. A specialty lookup scans the in-memory
+rows once (matching the doctor's bio, category name, or the specialty
+linked to the doctor or category) and memoizes the ranked result, so
+repeat lookups are a single dict fetch and no chat turn runs the old
+``icontains`` queries.
+
+Doctor, Category, MedicalSpecialty and Hospital signals bump the index
+version (see ``chatbot/signals.py``). The version lives in the database
+(``tenants/versioning.py``), so every process rebuilds within
+``CACHE_VERSION_CHECK_INTERVAL`` seconds of a change, the writing process
+immediately.
+"""
+import logging
+import threading
+
+from django.db.models import Q
+
+from tenants import versioning
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'chatbot:doctor_index:version'
+MAX_MEMOIZED_LOOKUPS = 1024
+
+
+def doctor_entry(doctor):
+    """JSON-safe snapshot of the doctor fields the web chat and WhatsApp bot return"""
+    try:
+        image = doctor.profile_image.url if doctor.profile_image else None
+    except ValueError:
+        image = None
+    category = doctor.category
+    hospital = doctor.hospital
+    return {
+        'id': doctor.id,
+        'name': doctor.full_name,
+        'specialty': doctor.bio or (category.name if category else 'General Medicine'),
+        'experience': f"{doctor.experience_years} Years" if doctor.experience_years else 'Experienced',
+        'hospital': hospital.name if hospital else 'Unknown Hospital',
+        'hospital_phone': str(hospital.phone) if hospital and hospital.phone else 'N/A',
+        'consultation_fee': float(doctor.consultation_fee) if doctor.consultation_fee else 500.0,
+        'image': image,
+    }
+
+
+class IndexedDoctor:
+    __slots__ = ('hospital_id', 'city', 'is_available', 'search_text', 'specialty_names', 'rank', 'data')
+
+    def __init__(self, doctor):
+        category = doctor.category
+        specialty_names = set()
+        for specialty in (doctor.specialty, category.specialty if category else None):
+            if specialty is not None:
+                specialty_names.add(specialty.name.lower())
+
+        self.hospital_id = str(doctor.hospital_id) if doctor.hospital_id else None
+        self.city = doctor.hospital.city.lower() if doctor.hospital else ''
+        self.is_available = doctor.is_available
+        self.search_text = f"{doctor.bio}\n{category.name if category else ''}".lower()
+        self.specialty_names = specialty_names
+        self.rank = (
+            not doctor.is_available,
+            not doctor.is_featured,
+            -float(doctor.average_rating or 0),
+            -(doctor.experience_years or 0),
+            doctor.last_name,
+            doctor.first_name,
+        )
+        self.data = doctor_entry(doctor)
+
+    def matches(self, specialty):
+        return specialty in self.specialty_names or specialty in self.search_text
+
+
+class DoctorIndex:
+    """
+    Ranked doctors per tenant with memoized specialty lookups
+    """
+
+    def __init__(self, doctors):
+        self.doctors = sorted((IndexedDoctor(doctor) for doctor in doctors), key=lambda d: d.rank)
+        self.by_hospital = {}
+        for doctor in self.doctors:
+            self.by_hospital.setdefault(doctor.hospital_id, []).append(doctor)
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def find(self, specialty, limit=5, hospital_id=None, city=None, available_only=True):
+        """Best-ranked doctors for a specialty, optionally limited to one tenant or city"""
+        if not specialty:
+            return []
+        key = (specialty.lower(), str(hospital_id) if hospital_id else None,
+               city.lower() if city else None, available_only)
+        matched = self._lookups.get(key)
+        if matched is None:
+            matched = self._match(*key)
+            with self._lock:
+                if len(self._lookups) >= MAX_MEMOIZED_LOOKUPS:
+                    self._lookups.clear()
+                self._lookups[key] = matched
+        return [dict(doctor.data) for doctor in matched[:limit]]
+
+    def _match(self, specialty, hospital_id, city, available_only):
+        doctors = self.by_hospital.get(hospital_id, []) if hospital_id else self.doctors
+        return [
+            doctor for doctor in doctors
+            if (doctor.is_available or not available_only)
+            and (city is None or doctor.city == city)
+            and doctor.matches(specialty)
+        ]
+
+
+_index = None
+_index_version = None
+_build_lock = threading.Lock()
+
+
+def bump_version():
+    """Invalidate every process's doctor index"""
+    versioning.bump_version(VERSION_CACHE_KEY)
+
+
+def get_doctor_index():
+    """Return the doctor index, rebuilding it if doctors or categories changed"""
+    global _index, _index_version
+    version = versioning.get_version(VERSION_CACHE_KEY)
+    if _index is not None and _index_version == version:
+        return _index
+
+    with _build_lock:
+        if _index is None or _index_version != version:
+            from adminapp.models import Doctor
+
+            doctors = Doctor.objects.filter(
+                Q(hospital__isnull=True) | Q(hospital__is_active=True)
+            ).select_related(
+                'hospital', 'category', 'category__specialty', 'specialty'
+            )
+            _index = DoctorIndex(doctors)
+            _index_version = version
+            logger.info(f"Doctor index rebuilt (version {version}, {len(_index.doctors)} doctors)")
+    return _index
@@ -0,0 +1,378 @@
+"""
+Keyword engine for triage, emergency, specialty and remedy detection.
+
+All keyword vocabularies used by the web chat and the WhatsApp bot are
+compiled once at import into a single word-level Aho-Corasick automaton.
+``scan(text)`` walks the text once and returns every keyword hit tagged
+with its category, so callers no longer loop over keyword lists doing
+``kw in text`` for each one.
+
+Matching works on whole words (with light "-ing"/plural/"e" folding), so
+"heart" no longer fires inside "hearty" while "headaches" still matches
+"headache". Overlapping keywords are all reported: "heart attack" is both
+an urgent phrase and an emergency keyword.
+"""
+import re
+from collections import deque
+from functools import lru_cache
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)*")
+
+
+def normalize_token(word):
+    """Fold '-ing', simple plurals and a trailing 'e' so 'headaches' == 'headache'"""
+    if len(word) > 5 and word.endswith('ing'):
+        word = word[:-3]
+    elif len(word) > 2 and not word.endswith(('ss', 'us', 'is')):
+        if word.endswith('es'):
+            word = word[:-2]
+        elif word.endswith('s'):
+            word = word[:-1]
+    if len(word) > 2 and word.endswith('e'):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    text = text.lower().replace('’', "'")
+    return [normalize_token(token) for token in TOKEN_RE.findall(text)]
+
+
+# Normalised form of every word seen so far; chat text reuses a small vocabulary
+_token_cache = {}
+_TOKEN_CACHE_LIMIT = 50000
+
+
+class KeywordMatches:
+    """Every keyword found in one text, grouped by category"""
+
+    def __init__(self, hits):
+        # {category: {value: best_rank}}
+        self._hits = hits
+
+    def has(self, category):
+        return category in self._hits
+
+    def first(self, category, default=None):
+        """Value of the highest-priority (lowest rank) keyword in the category"""
+        values = self._hits.get(category)
+        if not values:
+            return default
+        return min(values, key=values.get)
+
+    def values(self, category):
+        """All matched values in the category, in priority order"""
+        values = self._hits.get(category, {})
+        return sorted(values, key=values.get)
+
+
+class KeywordEngine:
+    """
+    Word-level Aho-Corasick automaton over several keyword categories.
+
+    ``vocabulary`` maps a category to either a list of keywords or an
+    ordered ``{keyword: value}`` dict. A keyword's position in its category
+    is its rank; ``KeywordMatches.first`` uses it to reproduce the old
+    "first keyword in the list wins" behaviour.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for category, keywords in vocabulary.items():
+            if not isinstance(keywords, dict):
+                keywords = {keyword: keyword for keyword in keywords}
+            self.vocabulary[category] = dict(keywords)
+            for rank, (keyword, value) in enumerate(keywords.items()):
+                self._add(tokenize(keyword), (category, value, rank))
+
+        self._known_tokens = {token for edges in self._goto for token in edges}
+        self._build_failure_links()
+
+    def _add(self, tokens, payload):
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            next_state = self._goto[state].get(token)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][token] = next_state
+            state = next_state
+        self._output[state].append(payload)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(token, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # Inherit matches that end here via the failure chain
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def scan(self, text):
+        hits = {}
+        if not text:
+            return KeywordMatches(hits)
+        goto, fail, output, known = self._goto, self._fail, self._output, self._known_tokens
+        state = 0
+        for word in TOKEN_RE.findall(text.lower().replace('’', "'")):
+            token = _token_cache.get(word)
+            if token is None:
+                token = normalize_token(word)
+                if len(_token_cache) < _TOKEN_CACHE_LIMIT:
+                    _token_cache[word] = token
+            if token not in known:
+                # No keyword contains this word, so every partial match dies here
+                state = 0
+                continue
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for category, value, rank in output[state]:
+                values = hits.setdefault(category, {})
+                if rank < values.get(value, rank + 1):
+                    values[value] = rank
+        return KeywordMatches(hits)
+
+    def keywords(self, category):
+        return list(self.vocabulary.get(category, {}))
+
+
+# --- Vocabularies ---------------------------------------------------------
+
+FALLBACK_EMERGENCY_KEYWORDS = [
+    'chest pain', 'heart attack', 'stroke', 'difficulty breathing',
+    'severe pain', 'bleeding', 'unconscious', 'emergency'
+]
+
+# keyword -> canned fallback reply key, in the order the replies are tried
+FALLBACK_TOPIC_KEYWORDS = {
+    'headache': 'headache',
+    'fever': 'fever',
+    'cough': 'cough',
+    'dizzy': 'dizzy',
+    'dizziness': 'dizzy',
+    'stomach': 'stomach',
+    'nausea': 'stomach',
+    'vomiting': 'stomach',
+    'appointment': 'appointment',
+    'book': 'appointment',
+    'better': 'better',
+    'fine': 'better',
+    'okay': 'better',
+    'good': 'better',
+}
+
+FEELING_BETTER_KEYWORDS = [
+    'feel better', 'feeling better', 'i\'m better', 'better now', 'i feel better',
+    'feeling fine', 'i\'m fine', 'fine now', 'okay now', 'i am okay',
+    'resolved', 'no longer', 'not anymore', 'symptoms gone', 'much better',
+    'all good', 'recovered', 'back to normal', 'no more symptoms'
+]
+
+EMERGENCY_KEYWORDS = [
+    'bleeding', 'blood', 'chest pain', 'heart attack', 'stroke', 'unconscious',
+    'difficulty breathing', 'severe pain', 'accident', 'injury', 'broken bone',
+    'head injury', 'poisoning', 'overdose', 'suicide', 'emergency', 'urgent',
+    'severe', 'critical', 'dying', 'death', 'ambulance', 'hospital now'
+]
+
+APPOINTMENT_KEYWORDS = [
+    'book appointment', 'schedule appointment', 'see doctor', 'visit doctor',
+    'appointment', 'yes book', 'yes schedule'
+]
+
+# URGENT/EMERGENCY symptoms - Require immediate medical attention
+URGENT_KEYWORDS = [
+    # Cardiovascular emergencies
+    'chest pain', 'heart attack', 'cardiac arrest', 'severe chest pressure',
+    'crushing chest pain', 'radiating arm pain', 'jaw pain with chest',
+
+    # Respiratory emergencies
+    'difficulty breathing', 'can\'t breathe', 'choking', 'gasping for air',
+    'severe shortness of breath', 'blue lips', 'blue fingernails',
+
+    # Neurological emergencies
+    'stroke', 'sudden weakness', 'facial drooping', 'slurred speech',
+    'severe headache', 'worst headache ever', 'sudden confusion',
+    'loss of consciousness', 'unconscious', 'seizure', 'convulsions',
+
+    # Trauma and bleeding
+    'severe bleeding', 'heavy bleeding', 'bleeding heavily', 'hemorrhage',
+    'head injury', 'broken bone', 'compound fracture', 'severe trauma',
+
+    # Poisoning and overdose
+    'poisoning', 'overdose', 'toxic', 'swallowed poison',
+
+    # Severe pain
+    'severe pain', 'excruciating pain', 'unbearable pain', '10/10 pain',
+    'severe abdominal pain', 'appendicitis symptoms',
+
+    # Other emergencies
+    'suicide', 'suicidal thoughts', 'want to die', 'emergency',
+    'critical', 'dying', 'life threatening', 'ambulance needed',
+    'vomiting blood', 'coughing blood', 'blood in stool',
+    'severe allergic reaction', 'anaphylaxis', 'swollen throat'
+]
+
+# SEMI-URGENT symptoms - Need medical attention within 24-48 hours
+SEMI_URGENT_KEYWORDS = [
+    # Persistent symptoms
+    'persistent fever', 'fever for days', 'high fever', 'fever above 102',
+    'persistent vomiting', 'vomiting for hours', 'severe nausea',
+    'persistent diarrhea', 'severe diarrhea', 'dehydration',
+
+    # Respiratory issues
+    'severe cough', 'coughing for weeks', 'shortness of breath',
+    'wheezing', 'chest tightness',
+
+    # Pain and discomfort
+    'moderate pain', 'persistent headache', 'severe headache',
+    'migraine', 'back pain severe', 'joint pain severe',
+
+    # Infections and inflammation
+    'infection', 'infected wound', 'rash spreading', 'severe rash',
+    'swelling', 'inflammation', 'red streaks', 'pus',
+
+    # Digestive issues
+    'severe stomach pain', 'abdominal pain', 'difficulty swallowing',
+    'blood in urine', 'painful urination',
+
+    # Mental health urgent
+    'severe depression', 'panic attacks', 'severe anxiety',
+
+    # Other semi-urgent
+    'dizziness severe', 'fainting', 'irregular heartbeat',
+    'vision problems', 'sudden vision loss', 'eye injury',
+    'worsening', 'getting worse', 'not improving',
+    'need to see doctor', 'should see doctor', '24-48 hours'
+]
+
+# Built-in specialty keywords; chatbot.specialty_matcher layers DB keywords on top
+SPECIALTY_KEYWORDS = {
+    'cardiologist': 'Cardiologist',
+    'cardiology': 'Cardiologist',
+    'heart': 'Cardiologist',
+    'cardiac': 'Cardiologist',
+    'chest pain': 'Cardiologist',
+    'neurologist': 'Neurologist',
+    'neurology': 'Neurologist',
+    'brain': 'Neurologist',
+    'nervous': 'Neurologist',
+    'headache': 'Neurologist',
+    'migraine': 'Neurologist',
+    'dizziness': 'Neurologist',
+    'seizure': 'Neurologist',
+    'orthopedic': 'Orthopedic Surgeon',
+    'orthopedist': 'Orthopedic Surgeon',
+    'bone': 'Orthopedic Surgeon',
+    'joint': 'Orthopedic Surgeon',
+    'fracture': 'Orthopedic Surgeon',
+    'back pain': 'Orthopedic Surgeon',
+    'knee pain': 'Orthopedic Surgeon',
+    'dermatologist': 'Dermatologist',
+    'dermatology': 'Dermatologist',
+    'skin': 'Dermatologist',
+    'rash': 'Dermatologist',
+    'acne': 'Dermatologist',
+    'eczema': 'Dermatologist',
+    'psychiatrist': 'Psychiatrist',
+    'psychiatry': 'Psychiatrist',
+    'mental': 'Psychiatrist',
+    'depression': 'Psychiatrist',
+    'anxiety': 'Psychiatrist',
+    'stress': 'Psychiatrist',
+    'ophthalmologist': 'Ophthalmologist',
+    'ophthalmology': 'Ophthalmologist',
+    'eye': 'Ophthalmologist',
+    'vision': 'Ophthalmologist',
+    'blurred vision': 'Ophthalmologist',
+    'general practitioner': 'General Practitioner',
+    'gp': 'General Practitioner',
+    'family doctor': 'General Practitioner',
+    'fever': 'General Practitioner',
+    'cold': 'General Practitioner',
+    'flu': 'General Practitioner',
+    'cough': 'General Practitioner'
+}
+
+# Symptoms with a home-remedy list, in lookup order
+REMEDY_KEYWORDS = ['headache', 'fever', 'cough', 'cold', 'stomach', 'dizzy', 'dizziness']
+
+MEDICAL_TERMS = [
+    'headache', 'fever', 'cough', 'chest pain', 'back pain',
+    'diabetes', 'hypertension', 'asthma', 'arthritis', 'depression',
+    'anxiety', 'migraine', 'allergies', 'infection', 'inflammation'
+]
+
+WHATSAPP_EMERGENCY_KEYWORDS = EMERGENCY_KEYWORDS + [
+    'can\'t breathe', 'choking', 'seizure', 'convulsion', 'paralysis',
+    'severe bleeding', 'heavy bleeding', 'vomiting blood', 'coughing blood',
+    'severe headache', 'worst headache', 'sudden headache', 'blurred vision',
+    'loss of consciousness', 'fainting', 'collapsed', 'not responding'
+]
+
+WHATSAPP_URGENT_KEYWORDS = [
+    'chest pain', 'heart attack', 'severe chest pressure', 'difficulty breathing', 'can\'t breathe', 'choking',
+    'stroke', 'sudden weakness', 'facial drooping', 'slurred speech', 'severe headache', 'loss of consciousness',
+    'unconscious', 'seizure', 'severe bleeding', 'heavy bleeding', 'broken bone', 'poisoning', 'overdose',
+    'suicide', 'critical', 'dying', 'ambulance needed', 'vomiting blood', 'coughing blood', 'severe allergic reaction'
+]
+
+WHATSAPP_SEMI_URGENT_KEYWORDS = [
+    'persistent fever', 'fever for days', 'high fever', 'severe cough', 'wheezing', 'chest tightness',
+    'persistent vomiting', 'severe diarrhea', 'dehydration', 'moderate pain', 'persistent headache',
+    'migraine', 'infection', 'rash spreading', 'swelling', 'dizziness severe', 'fainting', 'irregular heartbeat',
+    'vision problems', 'worsening', 'not improving', 'should see doctor', '24-48 hours'
+]
+
+WHATSAPP_SPECIALTY_KEYWORDS = {
+    'cardiologist': 'Cardiologist', 'heart': 'Cardiologist',
+    'neurologist': 'Neurologist', 'brain': 'Neurologist', 'stroke': 'Neurologist',
+    'orthopedic': 'Orthopedic Surgeon', 'bone': 'Orthopedic Surgeon',
+    'dermatologist': 'Dermatologist', 'skin': 'Dermatologist',
+    'psychiatrist': 'Psychiatrist', 'mental': 'Psychiatrist',
+    'ophthalmologist': 'Ophthalmologist', 'eye': 'Ophthalmologist',
+    'gastroenterologist': 'Gastroenterologist', 'stomach': 'Gastroenterologist',
+    'dentist': 'Dentist',
+    'general practitioner': 'General Practitioner', 'fever': 'General Practitioner', 'cold': 'General Practitioner'
+}
+
+WHATSAPP_REMEDY_KEYWORDS = ['headache', 'fever', 'cough', 'cold', 'stomach']
+
+VOCABULARY = {
+    'fallback_emergency': FALLBACK_EMERGENCY_KEYWORDS,
+    'fallback_topic': FALLBACK_TOPIC_KEYWORDS,
+    'feeling_better': FEELING_BETTER_KEYWORDS,
+    'emergency': EMERGENCY_KEYWORDS,
+    'appointment': APPOINTMENT_KEYWORDS,
+    'urgent': URGENT_KEYWORDS,
+    'semi_urgent': SEMI_URGENT_KEYWORDS,
+    'remedy': REMEDY_KEYWORDS,
+    'medical_term': MEDICAL_TERMS,
+    'whatsapp_emergency': WHATSAPP_EMERGENCY_KEYWORDS,
+    'whatsapp_urgent': WHATSAPP_URGENT_KEYWORDS,
+    'whatsapp_semi_urgent': WHATSAPP_SEMI_URGENT_KEYWORDS,
+    'whatsapp_specialty': WHATSAPP_SPECIALTY_KEYWORDS,
+    'whatsapp_remedy': WHATSAPP_REMEDY_KEYWORDS,
+}
+
+ENGINE = KeywordEngine(VOCABULARY)
+
+
+@lru_cache(maxsize=256)
+def scan(text):
+    """Scan text once against every category (cached for repeated lookups)"""
+    return ENGINE.scan(text)
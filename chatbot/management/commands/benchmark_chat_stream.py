@@ -0,0 +1,92 @@
+import json
+import time
+from unittest import mock
+
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from chatbot import views
+from chatbot.streaming import sse_frame
+
+
+class FakeOllama:
+    """Stands in for Ollama, producing tokens at a fixed model rate"""
+
+    def __init__(self, tokens, token_interval):
+        self.tokens = tokens
+        self.token_interval = token_interval
+
+    def stream(self, prompt, **options):
+        for token in self.tokens:
+            if self.token_interval:
+                time.sleep(self.token_interval)
+            yield {'response': token}
+        yield {'response': '', 'done': True}
+
+
+def legacy_generate(chunks):
+    """The pre-coalescing loop: one frame per token plus a 20 ms sleep"""
+    for chunk in chunks:
+        if 'response' in chunk and chunk['response']:
+            yield sse_frame({'token': chunk['response']})
+            time.sleep(0.02)
+        if chunk.get('done', False):
+            yield sse_frame({'recommendations': {}, 'done': True})
+            break
+
+
+class Command(BaseCommand):
+    help = 'Measure worker-seconds per chat response with and without the per-token sleep'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=400, help='Tokens per simulated response')
+        parser.add_argument('--token-interval-ms', type=float, default=0.0,
+                            help='Simulated model time per token (0 isolates server overhead)')
+        parser.add_argument('--runs', type=int, default=3, help='Responses to average over')
+
+    def handle(self, *args, **options):
+        tokens = [f"word{i} " for i in range(options['tokens'])]
+        interval = options['token_interval_ms'] / 1000.0
+        runs = options['runs']
+
+        self.stdout.write(
+            f"Simulating {len(tokens)} tokens/response, "
+            f"{options['token_interval_ms']:.1f} ms model time per token, {runs} runs"
+        )
+
+        before = self.measure(runs, lambda: legacy_generate(FakeOllama(tokens, interval).stream('')))
+        after = self.measure(runs, lambda: self.current_stream(FakeOllama(tokens, interval)))
+
+        for label, (seconds, frames, size) in (('before (sleep per token)', before), ('after (coalesced)', after)):
+            self.stdout.write(
+                f"  {label:26} {seconds:8.3f} worker-s/response  {frames:5d} frames  {size:7d} bytes"
+            )
+        if after[0] > 0:
+            self.stdout.write(self.style.SUCCESS(f"Speed-up: {before[0] / after[0]:.1f}x fewer worker-seconds"))
+
+    def current_stream(self, fake):
+        """Drive the real chat_stream view against the fake model"""
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a headache', 'location': {'city': 'Gorakhpur'}}),
+            content_type='application/json',
+        )
+        request.session = SessionStore()
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'process_medical_response', return_value={}):
+            response = views.chat_stream(request)
+            for frame in response.streaming_content:
+                yield frame
+
+    def measure(self, runs, make_stream):
+        total_seconds = 0.0
+        frames = size = 0
+        for _ in range(runs):
+            frames = size = 0
+            started = time.perf_counter()
+            for frame in make_stream():
+                frames += 1
+                size += len(frame)
+            total_seconds += time.perf_counter() - started
+        return total_seconds / runs, frames, size
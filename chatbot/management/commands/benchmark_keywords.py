@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.keywords import ENGINE, VOCABULARY
+
+SENTENCES = [
+    "Based on what you've described, this sounds like a tension headache that is often triggered by stress or poor sleep.",
+    "Make sure you stay hydrated and rest in a quiet, dark room for a few hours.",
+    "If the pain becomes severe or you notice blurred vision, please see a doctor within 24-48 hours.",
+    "A mild fever with a cough usually points to a viral infection such as the common cold or flu.",
+    "Monitor your temperature regularly and increase your fluid intake throughout the day.",
+    "Over-the-counter medication can help, but always follow the dosage instructions on the label.",
+    "Persistent symptoms that are not improving after a week should be evaluated by a general practitioner.",
+    "Light stretching and a warm compress may ease muscle tension in the neck and shoulders.",
+    "Avoid screens before bed and keep a regular sleep schedule to reduce how often these episodes occur.",
+    "If you ever experience chest pain, difficulty breathing or sudden weakness, call 108 immediately.",
+    "Eating bland foods like bananas, rice and toast can settle an upset stomach.",
+    "Keeping a symptom diary helps your doctor understand patterns and possible triggers.",
+]
+
+
+def make_corpus(count, size, seed=7):
+    """Build realistic ~size-byte model responses from canned medical sentences"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        parts = []
+        length = 0
+        while length < size:
+            sentence = rng.choice(SENTENCES)
+            parts.append(sentence)
+            length += len(sentence) + 1
+        corpus.append(' '.join(parts))
+    return corpus
+
+
+def legacy_scan(text):
+    """The previous approach: one lower() plus an `in` test per keyword, per category"""
+    text_lower = text.lower()
+    return {
+        category: [keyword for keyword in ENGINE.keywords(category) if keyword in text_lower]
+        for category in VOCABULARY
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare per-keyword substring scans with the compiled keyword engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--responses', type=int, default=500, help='Number of simulated model responses')
+        parser.add_argument('--size', type=int, default=2048, help='Approximate bytes per response')
+
+    def handle(self, *args, **options):
+        corpus = make_corpus(options['responses'], options['size'])
+        keyword_count = sum(len(ENGINE.keywords(category)) for category in VOCABULARY)
+        self.stdout.write(
+            f"Scanning {len(corpus)} responses of ~{options['size']} bytes "
+            f"against {keyword_count} keywords in {len(VOCABULARY)} categories"
+        )
+
+        before = self.measure(legacy_scan, corpus)
+        # Bypass the lru_cache on chatbot.keywords.scan so every call does real work
+        after = self.measure(ENGINE.scan, corpus)
+
+        for label, seconds in (('before (substring loops)', before), ('after (compiled engine)', after)):
+            self.stdout.write(f"  {label:26} {seconds * 1e6:9.1f} us/response")
+        if after > 0:
+            self.stdout.write(self.style.SUCCESS(f"Speed-up: {before / after:.1f}x"))
+
+    def measure(self, scan, corpus):
+        started = time.perf_counter()
+        for text in corpus:
+            scan(text)
+        return (time.perf_counter() - started) / len(corpus)
@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.analytics import rollup_chat_analytics
+
+
+class Command(BaseCommand):
+    help = 'Fold chat activity since the last run into the daily ChatAnalytics rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Also recompute every day from this date (YYYY-MM-DD) to today; '
+                                 'days trimmed by the retention sweep keep their stored totals')
+        parser.add_argument('--full', action='store_true', help='Recompute every day that has chat activity')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+
+        result = rollup_chat_analytics(since=since, full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Upserted {result['rows']} analytics rows for {result['days']} days in {result['seconds']:.2f}s"
+        ))
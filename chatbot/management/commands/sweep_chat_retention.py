@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.retention import purge_expired_sessions, trim_messages
+
+
+class Command(BaseCommand):
+    help = 'Trim chat sessions to their message cap and delete expired guest sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per DELETE when trimming messages')
+        parser.add_argument('--session-batch-size', type=int, default=500, help='Expired sessions deleted per batch')
+        parser.add_argument('--skip-trim', action='store_true', help='Only purge expired guest sessions')
+        parser.add_argument('--skip-expired', action='store_true', help='Only trim messages over the cap')
+
+    def report(self, label, result):
+        self.stdout.write(
+            f"{label}: {result.rows} rows in {result.batches} batches, "
+            f"{result.seconds:.2f}s ({result.rows_per_second:.0f} rows/s)"
+        )
+
+    def handle(self, *args, **options):
+        if not options['skip_expired']:
+            self.report('Expired guest sessions', purge_expired_sessions(options['session_batch_size']))
+        if not options['skip_trim']:
+            self.report('Messages over cap', trim_messages(options['batch_size']))
+        self.stdout.write(self.style.SUCCESS('Chat retention sweep complete'))
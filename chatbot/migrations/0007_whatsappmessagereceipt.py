@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_analyticswatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhatsAppMessageReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_sid', models.CharField(max_length=64, unique=True)),
+                ('received_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -73,11 +73,17 @@ class ChatSession(TenantAwareModel):
         return self.user.get_full_name() or self.user.username if self.user else "Unknown User"
     
     def cleanup_old_messages(self):
-        """Remove old messages beyond the limit"""
-        messages = self.messages.order_by('-timestamp')
-        if messages.count() > self.max_messages:
-            old_messages = messages[self.max_messages:]
-            ChatMessage.objects.filter(id__in=[m.id for m in old_messages]).delete()
+        """Remove old messages beyond the limit; returns how many were deleted"""
+        # Newest message past the limit: it and everything older go in one DELETE
+        boundary = list(self.messages.order_by('-timestamp', '-id').values_list(
+            'timestamp', 'id'
+        )[self.max_messages:self.max_messages + 1])
+        if not boundary:
+            return 0
+        timestamp, message_id = boundary[0]
+        return self.messages.filter(
+            models.Q(timestamp__lt=timestamp) | models.Q(timestamp=timestamp, id__lte=message_id)
+        ).delete()[0]
 
 class ChatMessage(models.Model):
     """
@@ -87,8 +93,9 @@ class ChatMessage(models.Model):
     role = models.CharField(max_length=10, choices=[('user', 'User'), ('assistant', 'Assistant'), ('system', 'System')])
     content = models.TextField()
     
-    # Message metadata
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Message metadata (a default rather than auto_now_add, so buffered
+    # turns written later by chatbot/transcripts.py keep their own time)
+    timestamp = models.DateTimeField(default=timezone.now)
     message_type = models.CharField(max_length=30, choices=[
         ('text', 'Text'),
         ('doctor_recommendation', 'Doctor Recommendation'),
@@ -203,6 +210,31 @@ class ChatAnalytics(TenantAwareModel):
     def __str__(self):
         return f"Analytics for {self.date} - {self.hospital.name if self.hospital else 'No Hospital'}"
 
+class AnalyticsWatermark(models.Model):
+    """
+    Highest ids already folded into ChatAnalytics by ``manage.py rollup_chat_analytics``
+    (see ``chatbot/analytics.py``)
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_message_id = models.BigIntegerField(default=0)
+    last_session_id = models.BigIntegerField(default=0)
+    last_whatsapp_session_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: message {self.last_message_id}, session {self.last_session_id}"
+
+class WhatsAppMessageReceipt(models.Model):
+    """
+    MessageSid of an accepted inbound WhatsApp message, so Twilio's webhook
+    retries are dropped by every worker (see ``chatbot/whatsapp_worker.py``)
+    """
+    message_sid = models.CharField(max_length=64, unique=True)
+    received_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.message_sid} at {self.received_at}"
+
 class UserIntent(models.Model):
     """
     AI training data for user intent recognition
@@ -0,0 +1,227 @@
+"""
+Shared Ollama client for the web chat and WhatsApp paths.
+
+One pooled, keep-alive ``requests.Session`` is reused for every call so
+each chat message does not pay for a fresh TCP connection. Timeouts are
+split per phase (connect, first token, total) and connection resets are
+retried with exponential backoff before any token has been received.
+
+The async streaming view uses the same client through ``astream``, which
+keeps one ``httpx.AsyncClient`` per running event loop.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_MODEL = "symptomwise"
+
+
+class OllamaError(Exception):
+    """Base error raised by the Ollama client"""
+
+
+class OllamaResponseError(OllamaError):
+    """Ollama answered with a non-200 status"""
+
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+        super().__init__(f"Ollama API returned status {status_code}")
+
+
+class OllamaClient:
+    """
+    Pooled HTTP client for the Ollama ``/api/generate`` endpoint
+    """
+
+    RETRYABLE_ERRORS = (requests.exceptions.ConnectionError,)
+    ASYNC_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+
+    def __init__(self, base_url=None, model=None, pool_size=None,
+                 connect_timeout=None, first_token_timeout=None,
+                 total_timeout=None, max_retries=None, retry_backoff=None):
+        self.base_url = (base_url or getattr(settings, 'OLLAMA_BASE_URL', DEFAULT_BASE_URL)).rstrip('/')
+        self.model = model or getattr(settings, 'OLLAMA_MODEL', DEFAULT_MODEL)
+        self.pool_size = pool_size or getattr(settings, 'OLLAMA_POOL_SIZE', 10)
+        self.connect_timeout = connect_timeout or getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', 3.0)
+        self.first_token_timeout = first_token_timeout or getattr(settings, 'OLLAMA_FIRST_TOKEN_TIMEOUT', 30.0)
+        self.total_timeout = total_timeout or getattr(settings, 'OLLAMA_TOTAL_TIMEOUT', 120.0)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'OLLAMA_MAX_RETRIES', 2)
+        self.retry_backoff = retry_backoff if retry_backoff is not None else getattr(settings, 'OLLAMA_RETRY_BACKOFF', 0.25)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+
+        # httpx.AsyncClient is bound to the loop it was first used on
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def generate_url(self):
+        return f"{self.base_url}/api/generate"
+
+    def _post(self, payload, stream, read_timeout):
+        """POST to Ollama, retrying connection resets with exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    self.generate_url,
+                    data=json.dumps(payload),
+                    stream=stream,
+                    timeout=(self.connect_timeout, read_timeout),
+                )
+            except self.RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f"Ollama connection failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code != 200:
+                text = response.text
+                response.close()
+                raise OllamaResponseError(response.status_code, text)
+            return response
+
+    def generate(self, prompt, **options):
+        """Run a blocking (non-streaming) generation and return the decoded JSON body"""
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        payload.update(options)
+        response = self._post(payload, stream=False, read_timeout=self.total_timeout)
+        return response.json()
+
+    def stream(self, prompt, **options):
+        """
+        Open a streaming generation and return an iterator of decoded chunks.
+
+        The connection is established (and retried) before this returns, so
+        callers can fall back cleanly if Ollama is unreachable. The iterator
+        enforces the total timeout while tokens are being read.
+        """
+        payload = {"model": self.model, "prompt": prompt, "stream": True}
+        payload.update(options)
+        started = time.monotonic()
+        response = self._post(payload, stream=True, read_timeout=self.first_token_timeout)
+        return self._iter_chunks(response, started)
+
+    def _iter_chunks(self, response, started):
+        try:
+            for line in response.iter_lines():
+                if time.monotonic() - started > self.total_timeout:
+                    raise requests.exceptions.Timeout(
+                        f"Ollama generation exceeded total timeout of {self.total_timeout}s"
+                    )
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line.decode('utf-8'))
+                except json.JSONDecodeError:
+                    continue
+                yield chunk
+                if chunk.get('done', False):
+                    break
+        finally:
+            response.close()
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                headers={'Content-Type': 'application/json'},
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _apost(self, payload):
+        """Async twin of ``_post`` for streaming requests"""
+        client = self._get_async_client()
+        timeout = httpx.Timeout(
+            self.total_timeout,
+            connect=self.connect_timeout,
+            read=self.first_token_timeout,
+            pool=self.total_timeout,
+        )
+        attempt = 0
+        while True:
+            request = client.build_request('POST', self.generate_url, content=json.dumps(payload), timeout=timeout)
+            try:
+                response = await client.send(request, stream=True)
+            except self.ASYNC_RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f"Ollama connection failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code != 200:
+                text = (await response.aread()).decode('utf-8', errors='replace')
+                await response.aclose()
+                raise OllamaResponseError(response.status_code, text)
+            return response
+
+    async def astream(self, prompt, **options):
+        """
+        Async version of ``stream``: connect (with retries) and return an
+        async iterator of decoded chunks.
+        """
+        payload = {"model": self.model, "prompt": prompt, "stream": True}
+        payload.update(options)
+        started = time.monotonic()
+        response = await self._apost(payload)
+        return self._aiter_chunks(response, started)
+
+    async def _aiter_chunks(self, response, started):
+        try:
+            async for line in response.aiter_lines():
+                if time.monotonic() - started > self.total_timeout:
+                    raise httpx.ReadTimeout(
+                        f"Ollama generation exceeded total timeout of {self.total_timeout}s"
+                    )
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield chunk
+                if chunk.get('done', False):
+                    break
+        finally:
+            await response.aclose()
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client():
+    """Return the process-wide shared Ollama client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
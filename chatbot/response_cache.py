@@ -0,0 +1,168 @@
+"""
+Response cache for repeated chat prompts.
+
+Many conversations open with near-identical messages ("I have a
+headache", "fever since 2 days"), and each of them would otherwise pay a
+full generation. ``ResponseCache`` maps a normalized prompt to the answer
+the model gave for it:
+
+* prompts are lowercased and reduced to words, articles, greetings and
+  filler are dropped and number words become digits, so "Hi doctor, I
+  have a Headache!" and "i have headache" share an entry; anything that
+  can change the triage (negation, tense, duration, intensity, who is
+  ill) stays in the key,
+* the key also holds the model name and a hash of the ``Modelfile``, so
+  changing the model, its parameters or its SYSTEM prompt starts afresh,
+* entries live in a bounded in-process LRU (``CHAT_RESPONSE_CACHE_SIZE``)
+  and expire after ``CHAT_RESPONSE_CACHE_TTL`` seconds.
+
+Only prompts that carry their whole conversation are cached; a prompt
+continuing a reused Ollama context (see ``context_window.py``) depends on
+state the key does not see. Hospitals can opt out with
+``Hospital.ai_response_cache_enabled``; ``CHAT_RESPONSE_CACHE_ENABLED``
+switches the cache off everywhere.
+
+A hit is replayed as Ollama-shaped chunks (``replay_chunks``), so it goes
+through the same coalescing and SSE frames as a live answer. Hit/miss
+counters, overall and per hospital, are reported by ``stats()`` and
+exported through the hospital stats API.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Only words that never change the triage: articles, greetings and filler.
+# Tense, duration, intensity and who is ill all stay in the key.
+STOPWORDS = frozenset([
+    'a', 'an', 'the', 'please', 'hi', 'hello', 'hey', 'doctor', 'um', 'uh',
+])
+NUMBER_WORDS = {
+    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6',
+    'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+}
+
+_word = re.compile(r'[a-z0-9]+')
+_token = re.compile(r'\s*\S+')
+
+
+def normalize_prompt(text):
+    words = []
+    for word in _word.findall((text or '').lower()):
+        word = NUMBER_WORDS.get(word, word)
+        if word.isdigit():
+            word = str(int(word))
+        if word not in STOPWORDS:
+            words.append(word)
+    return ' '.join(words)
+
+
+def modelfile_digest(path=None):
+    """Short hash of the Modelfile, or '' if it cannot be read"""
+    path = path or getattr(settings, 'CHAT_MODELFILE_PATH', settings.BASE_DIR / 'Modelfile')
+    try:
+        with open(path, 'rb') as modelfile:
+            return hashlib.sha256(modelfile.read()).hexdigest()[:16]
+    except OSError as e:
+        logger.warning(f"Could not read Modelfile for the response cache key: {str(e)}")
+        return ''
+
+
+def response_cache_enabled(hospital=None):
+    if not getattr(settings, 'CHAT_RESPONSE_CACHE_ENABLED', True):
+        return False
+    return hospital is None or getattr(hospital, 'ai_response_cache_enabled', True)
+
+
+def replay_chunks(text):
+    """A cached answer as the chunks Ollama would have streamed"""
+    for token in _token.findall(text):
+        yield {'response': token}
+    yield {'response': '', 'done': True, 'cached': True}
+
+
+async def areplay_chunks(text):
+    for chunk in replay_chunks(text):
+        yield chunk
+
+
+class ResponseCache:
+    def __init__(self, max_entries=None, ttl=None, modelfile=None):
+        self.max_entries = max_entries or getattr(settings, 'CHAT_RESPONSE_CACHE_SIZE', 1024)
+        self.ttl = ttl or getattr(settings, 'CHAT_RESPONSE_CACHE_TTL', 21600)
+        self.modelfile = modelfile if modelfile is not None else modelfile_digest()
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._counters = {}  # hospital id (None overall) -> {'hits': .., 'misses': ..}
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, prompt, model):
+        raw = '\x00'.join([str(model), self.modelfile, normalize_prompt(prompt)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _count(self, hospital_id, outcome):
+        for scope in {None, hospital_id}:
+            counters = self._counters.setdefault(scope, {'hits': 0, 'misses': 0})
+            counters[outcome] += 1
+
+    def get(self, prompt, model, hospital_id=None):
+        """Cached answer for ``prompt``, or None"""
+        key = self.key(prompt, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._count(hospital_id, 'misses')
+                return None
+            self._entries.move_to_end(key)
+            self._count(hospital_id, 'hits')
+            return entry[1]
+
+    def set(self, prompt, model, text):
+        if not text:
+            return
+        key = self.key(prompt, model)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self, hospital_id=None):
+        """Hit/miss counters of this process, overall or for one hospital"""
+        with self._lock:
+            counters = dict(self._counters.get(hospital_id, {'hits': 0, 'misses': 0}))
+            entries, evictions = len(self._entries), self._evictions
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else 0
+        counters['entries'] = entries
+        counters['evictions'] = evictions
+        return counters
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,118 @@
+"""
+Retention for chat history.
+
+Two sweeps, both set-based and run in bounded batches so a large backlog
+never holds a long write lock or loads message bodies into Python:
+
+* ``trim_messages`` - keep only the newest ``ChatSession.max_messages``
+  messages of each session. Sessions over their cap are found with one
+  GROUP BY; their surplus messages are ranked in SQL with
+  ``ROW_NUMBER()`` and deleted by primary key, at most ``batch_size`` rows
+  per DELETE.
+* ``purge_expired_sessions`` - delete guest sessions past ``expires_at``
+  together with their messages (and WhatsApp links), ``batch_size``
+  sessions at a time. Messages go with a plain cascading DELETE.
+
+``expires_at`` is a sliding deadline: every write of new activity (chat
+turns in ``chatbot/transcripts.py``, flushed WhatsApp conversations) calls
+``extend_guest_expiry``, so a conversation still in use is never purged.
+
+Only primary keys are ever read into Python.
+
+``manage.py sweep_chat_retention`` runs both and reports rows per second.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSession
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepResult:
+    rows: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def surplus_messages(session_ids=None):
+    """Queryset of message ids beyond their session's ``max_messages`` (newest are kept)"""
+    messages = ChatMessage.objects.all()
+    if session_ids is not None:
+        messages = messages.filter(session_id__in=session_ids)
+    return messages.annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('session_id')],
+            order_by=[F('timestamp').desc(), F('id').desc()],
+        ),
+        cap=F('session__max_messages'),
+    ).filter(position__gt=F('cap')).values('id')
+
+
+def _delete_ids(ids):
+    # ChatMessage has no dependants or delete signals, so this is a single fast DELETE
+    return ChatMessage.objects.filter(id__in=ids).delete()[0]
+
+
+def trim_messages(batch_size=1000, session_chunk=500):
+    """Delete messages over each session's cap; returns a SweepResult"""
+    started = time.monotonic()
+    result = SweepResult()
+    over_cap = list(
+        ChatSession.objects.annotate(message_count=Count('messages'))
+        .filter(message_count__gt=F('max_messages'))
+        .values_list('id', flat=True)
+    )
+    for start in range(0, len(over_cap), session_chunk):
+        chunk = over_cap[start:start + session_chunk]
+        while True:
+            # Materialized as ids: MySQL rejects LIMIT inside an IN subquery
+            ids = list(surplus_messages(chunk).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                result.rows += _delete_ids(ids)
+            result.batches += 1
+    result.seconds = time.monotonic() - started
+    return result
+
+
+def extend_guest_expiry(session_ids, now=None):
+    """Move ``expires_at`` of the given guest sessions to ``context_days`` after ``now``"""
+    now = now or timezone.now()
+    guests = ChatSession.objects.filter(pk__in=session_ids, is_guest=True)
+    # One UPDATE per distinct retention period (normally just the default)
+    for days in guests.values_list('context_days', flat=True).distinct():
+        guests.filter(context_days=days).update(expires_at=now + timedelta(days=days))
+
+
+def purge_expired_sessions(batch_size=500, now=None):
+    """Delete expired guest sessions and everything attached to them; returns a SweepResult"""
+    started = time.monotonic()
+    now = now or timezone.now()
+    result = SweepResult()
+    expired = ChatSession.objects.filter(is_guest=True, expires_at__lt=now)
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            # Messages and WhatsApp links have no dependants or delete signals,
+            # so the collector removes them with DELETE ... WHERE session_id IN
+            result.rows += ChatSession.objects.filter(id__in=ids).only('id').delete()[0]
+        result.batches += 1
+    result.seconds = time.monotonic() - started
+    return result
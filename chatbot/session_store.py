@@ -0,0 +1,217 @@
+"""
+Session stores for WhatsApp conversation state.
+
+A WhatsApp conversation is a small dict (state, location, recent history,
+ids of the backing ChatSession/WhatsAppSession rows). Each inbound message
+does one ``load`` and one ``save``. Two backends are available, selected
+with ``WHATSAPP_SESSION_BACKEND``:
+
+* ``local`` - in-process LRU with idle TTL. Fine for a single worker.
+* ``cache`` - Django's cache (Redis/Memcached in production, locmem in
+  tests), so every worker sees the same conversation.
+
+Sessions idle for longer than ``WHATSAPP_SESSION_TTL`` are evicted and
+handed to an ``on_evict`` callback, which flushes them to
+``ChatSession.user_preferences``. Sweeps run at most once per
+``sweep_interval`` seconds, piggybacked on normal traffic.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class BaseSessionStore:
+    def __init__(self, ttl=1800, on_evict=None, sweep_interval=60):
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self._sweep_lock = threading.Lock()
+
+    def load(self, key):
+        """Return the session dict for ``key`` or None"""
+        raise NotImplementedError
+
+    def save(self, key, data):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def sweep(self, now=None):
+        """Evict idle sessions and return how many were evicted"""
+        raise NotImplementedError
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self.sweep_interval:
+            return 0
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_sweep = now
+            return self.sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def _evicted(self, key, data):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key, data)
+        except Exception as e:
+            logger.error(f"Error flushing evicted WhatsApp session {key}: {str(e)}")
+
+
+class LocalSessionStore(BaseSessionStore):
+    """
+    In-process LRU + idle-TTL store
+    """
+
+    def __init__(self, max_entries=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()  # key -> (last_seen, data)
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        self.maybe_sweep()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            last_seen, data = entry
+            if time.time() - last_seen <= self.ttl:
+                self._sessions.move_to_end(key)
+                return data
+            del self._sessions[key]
+        self._evicted(key, data)
+        return None
+
+    def save(self, key, data):
+        overflow = []
+        with self._lock:
+            self._sessions[key] = (time.time(), data)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_entries:
+                overflow.append(self._sessions.popitem(last=False))
+        for old_key, (_, old_data) in overflow:
+            self._evicted(old_key, old_data)
+
+    def delete(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def sweep(self, now=None):
+        now = now if now is not None else time.time()
+        expired = []
+        with self._lock:
+            # Least recently used first, so stop at the first live session
+            for key, (last_seen, data) in self._sessions.items():
+                if now - last_seen <= self.ttl:
+                    break
+                expired.append((key, data))
+            for key, _ in expired:
+                del self._sessions[key]
+        for key, data in expired:
+            self._evicted(key, data)
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class CacheSessionStore(BaseSessionStore):
+    """
+    Store backed by a Django cache alias, shared by every worker.
+
+    Entries are written with a timeout of twice the TTL so a sweep can
+    still read and flush a session after it went idle. Each process
+    remembers the keys it has written and sweeps those; since every
+    process sees the same cache entry, whichever sweeps first flushes it.
+    """
+
+    def __init__(self, alias='default', prefix='whatsapp:session:', **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[alias]
+        self.prefix = prefix
+        self._known_keys = set()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def load(self, key):
+        self.maybe_sweep()
+        entry = self.cache.get(self._cache_key(key))
+        if entry is None:
+            return None
+        last_seen, data = entry
+        if time.time() - last_seen <= self.ttl:
+            return data
+        self.cache.delete(self._cache_key(key))
+        self._evicted(key, data)
+        return None
+
+    def save(self, key, data):
+        self.cache.set(self._cache_key(key), (time.time(), data), timeout=self.ttl * 2)
+        with self._lock:
+            self._known_keys.add(key)
+
+    def delete(self, key):
+        self.cache.delete(self._cache_key(key))
+        with self._lock:
+            self._known_keys.discard(key)
+
+    def sweep(self, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            keys = list(self._known_keys)
+        if not keys:
+            return 0
+        entries = self.cache.get_many([self._cache_key(key) for key in keys])
+        evicted = 0
+        gone = []
+        for key in keys:
+            entry = entries.get(self._cache_key(key))
+            if entry is None:
+                # Already flushed by another worker or expired from the cache
+                gone.append(key)
+                continue
+            last_seen, data = entry
+            if now - last_seen > self.ttl:
+                self.cache.delete(self._cache_key(key))
+                gone.append(key)
+                self._evicted(key, data)
+                evicted += 1
+        with self._lock:
+            self._known_keys.difference_update(gone)
+        return evicted
+
+
+SESSION_STORE_BACKENDS = {
+    'local': LocalSessionStore,
+    'cache': CacheSessionStore,
+}
+
+
+def create_session_store(on_evict=None):
+    """Build the store configured by the WHATSAPP_SESSION_* settings"""
+    backend = getattr(settings, 'WHATSAPP_SESSION_BACKEND', 'local')
+    options = {
+        'ttl': getattr(settings, 'WHATSAPP_SESSION_TTL', 1800),
+        'on_evict': on_evict,
+    }
+    if backend == 'local':
+        options['max_entries'] = getattr(settings, 'WHATSAPP_SESSION_MAX_ENTRIES', 10000)
+    elif backend == 'cache':
+        options['alias'] = getattr(settings, 'WHATSAPP_SESSION_CACHE_ALIAS', 'default')
+    else:
+        raise ValueError(f"Unknown WhatsApp session backend '{backend}'. Choose from: {', '.join(SESSION_STORE_BACKENDS)}")
+    return SESSION_STORE_BACKENDS[backend](**options)
@@ -0,0 +1,38 @@
+"""
+Django signals for the chatbot app
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from adminapp.models import MedicalSpecialty, Category, Doctor, DoctorReview
+from tenants.models import Hospital
+from . import doctor_index, specialty_matcher
+
+
+@receiver(post_save, sender=MedicalSpecialty)
+@receiver(post_delete, sender=MedicalSpecialty)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_specialty_matcher(sender, **kwargs):
+    """
+    Recompile the specialty matcher when keywords or category mappings change
+    """
+    specialty_matcher.bump_version()
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=MedicalSpecialty)
+@receiver(post_delete, sender=MedicalSpecialty)
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+@receiver(post_save, sender=DoctorReview)
+@receiver(post_delete, sender=DoctorReview)
+def invalidate_doctor_index(sender, **kwargs):
+    """
+    Rebuild the doctor recommendation index when doctors, their categories
+    or their ratings change
+    """
+    doctor_index.bump_version()
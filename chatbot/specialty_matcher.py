@@ -0,0 +1,107 @@
+"""
+Specialty matcher compiled from the database.
+
+Keywords come from active ``MedicalSpecialty`` rows (their name plus the
+comma-separated ``keywords`` field), shared by every tenant, and from the
+hospital's own ``Category`` names mapped to a specialty. The built-in
+keyword map in ``keywords.py`` is kept as the lowest-priority fallback so
+the chatbot still works before any specialties are seeded.
+
+One engine is compiled per hospital (plus one without a category layer for
+the main site), held per process and tagged with a version token stored
+in the database (see ``tenants/versioning.py``). Saving or deleting a
+specialty or category bumps the version (see ``chatbot/signals.py``): the
+process that made the edit rebuilds on its next lookup, other processes
+within ``CACHE_VERSION_CHECK_INTERVAL`` seconds. Between those checks
+resolving a specialty never touches the database.
+"""
+import logging
+import threading
+
+from tenants import versioning
+
+from .keywords import KeywordEngine, SPECIALTY_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'chatbot:specialty_matcher:version'
+
+_engines = {}  # hospital id (None for the main site) -> KeywordEngine
+_engines_version = None
+_specialty_keywords = None  # shared MedicalSpecialty layer for _engines_version
+_lock = threading.Lock()
+
+
+def bump_version():
+    """Invalidate every process's compiled matchers"""
+    versioning.bump_version(VERSION_CACHE_KEY)
+
+
+def load_specialty_keywords():
+    """Ordered {keyword: specialty name} from active MedicalSpecialty rows"""
+    from adminapp.models import MedicalSpecialty
+
+    keywords = {}
+    for specialty in MedicalSpecialty.objects.filter(is_active=True):
+        keywords.setdefault(specialty.name.lower(), specialty.name)
+        for keyword in specialty.get_keywords_list():
+            keywords.setdefault(keyword.lower(), specialty.name)
+    return keywords
+
+
+def build_specialty_keywords(hospital_id=None, specialty_keywords=None):
+    """Ordered {keyword: specialty name}: DB specialties, then the hospital's categories, then built-ins"""
+    from adminapp.models import Category
+
+    if specialty_keywords is None:
+        specialty_keywords = load_specialty_keywords()
+    keywords = dict(specialty_keywords)
+
+    if hospital_id:
+        categories = Category.objects.filter(
+            hospital_id=hospital_id,
+            is_active=True,
+            specialty__isnull=False,
+            specialty__is_active=True,
+        ).values_list('name', 'specialty__name')
+        for category_name, specialty_name in categories:
+            keywords.setdefault(category_name.lower(), specialty_name)
+
+    for keyword, specialty_name in SPECIALTY_KEYWORDS.items():
+        keywords.setdefault(keyword, specialty_name)
+    return keywords
+
+
+def get_specialty_engine(hospital_id=None):
+    """Return the hospital's compiled matcher, rebuilding it if the version moved"""
+    global _engines, _engines_version, _specialty_keywords
+    key = str(hospital_id) if hospital_id else None
+    version = versioning.get_version(VERSION_CACHE_KEY)
+    if _engines_version == version:
+        engine = _engines.get(key)
+        if engine is not None:
+            return engine
+
+    with _lock:
+        if _engines_version != version:
+            _engines = {}
+            _engines_version = version
+            _specialty_keywords = None
+        engine = _engines.get(key)
+        if engine is not None:
+            return engine
+        try:
+            if _specialty_keywords is None:
+                _specialty_keywords = load_specialty_keywords()
+            vocabulary = build_specialty_keywords(key, _specialty_keywords)
+        except Exception as e:
+            # e.g. tables not migrated yet - use the built-in map and retry next time
+            logger.error(f"Error building specialty matcher: {str(e)}")
+            return KeywordEngine({'specialty': dict(SPECIALTY_KEYWORDS)})
+        engine = _engines[key] = KeywordEngine({'specialty': vocabulary})
+        logger.info(f"Specialty matcher rebuilt for hospital {key} (version {version}, {len(vocabulary)} keywords)")
+    return engine
+
+
+def match_specialty(text, default=None, hospital_id=None):
+    return get_specialty_engine(hospital_id).scan(text).first('specialty', default)
@@ -0,0 +1,46 @@
+"""
+Server-Sent Events helpers for the chat stream.
+"""
+import json
+import time
+
+from django.conf import settings
+
+
+def sse_frame(payload):
+    """Encode a payload as a single SSE ``data:`` frame"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class TokenCoalescer:
+    """
+    Batch model tokens into fewer SSE frames.
+
+    Tokens are buffered until either the time window since the last flush
+    has elapsed or the buffer reaches the byte budget, whichever comes
+    first. The window is checked as tokens arrive, so a frame never waits
+    on a timer and the worker is never idle while Ollama is producing.
+    """
+
+    def __init__(self, window=None, max_bytes=None):
+        self.window = window if window is not None else getattr(settings, 'CHAT_STREAM_COALESCE_WINDOW', 0.05)
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, 'CHAT_STREAM_COALESCE_BYTES', 256)
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def push(self, token):
+        """Add a token; return coalesced text when a frame should be sent"""
+        self._buffer.append(token)
+        self._size += len(token.encode('utf-8'))
+        if self._size >= self.max_bytes or time.monotonic() - self._last_flush >= self.window:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return and clear everything buffered so far"""
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        return text
@@ -1,3 +1,932 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from django.conf import settings
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.contrib.sessions.models import Session
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from django.utils import timezone
+
+from . import transcripts, views, whatsapp_views
+from .keywords import KeywordEngine, scan
+from .analytics import chat_summary, rollup_chat_analytics
+from .context_window import ContextWindow, estimate_tokens
+from .response_cache import ResponseCache, get_response_cache, normalize_prompt
+from .models import ChatAnalytics, ChatMessage, ChatSession, WhatsAppMessageReceipt, WhatsAppSession
+from .retention import purge_expired_sessions, trim_messages
+from .session_store import CacheSessionStore, LocalSessionStore
+from .whatsapp_worker import WhatsAppDispatcher
+from .specialty_matcher import get_specialty_engine
+from adminapp.models import MedicalSpecialty, Category
+from adminapp.testing import make_doctor
+from tenants.testing import make_hospital
+from tenants.context import tenant_context
+from .ollama_client import OllamaClient, OllamaResponseError
+from .streaming import TokenCoalescer
+from .transcripts import TranscriptBuffer
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, lines=None, body=None):
+        self.status_code = status_code
+        self.lines = lines or []
+        self.body = body or {}
+        self.text = json.dumps(self.body)
+        self.closed = False
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def json(self):
+        return self.body
+
+    def close(self):
+        self.closed = True
+
+
+class OllamaClientTest(SimpleTestCase):
+    def setUp(self):
+        self.client = OllamaClient(
+            base_url='http://ollama.test:11434/',
+            model='symptomwise',
+            pool_size=4,
+            max_retries=2,
+            retry_backoff=0,
+        )
+
+    def test_pooled_adapter_is_shared_across_calls(self):
+        adapter = self.client.session.get_adapter('http://ollama.test:11434/api/generate')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(self.client.generate_url, 'http://ollama.test:11434/api/generate')
+
+    def test_stream_yields_chunks_until_done(self):
+        lines = [
+            json.dumps({'response': 'Hel'}).encode(),
+            b'',
+            b'not json',
+            json.dumps({'response': 'lo', 'done': True}).encode(),
+            json.dumps({'response': 'ignored'}).encode(),
+        ]
+        response = FakeResponse(lines=lines)
+        with mock.patch.object(self.client.session, 'post', return_value=response) as post:
+            chunks = list(self.client.stream('hi'))
+
+        self.assertEqual([c['response'] for c in chunks], ['Hel', 'lo'])
+        self.assertTrue(response.closed)
+        _, kwargs = post.call_args
+        self.assertEqual(kwargs['timeout'], (self.client.connect_timeout, self.client.first_token_timeout))
+        self.assertEqual(json.loads(kwargs['data'])['model'], 'symptomwise')
+
+    def test_connection_reset_is_retried(self):
+        ok = FakeResponse(body={'response': 'fine'})
+        side_effect = [requests.exceptions.ConnectionError('reset'), ok]
+        with mock.patch.object(self.client.session, 'post', side_effect=side_effect) as post:
+            result = self.client.generate('hi')
+
+        self.assertEqual(result['response'], 'fine')
+        self.assertEqual(post.call_count, 2)
+
+    def test_retries_are_bounded(self):
+        error = requests.exceptions.ConnectionError('reset')
+        with mock.patch.object(self.client.session, 'post', side_effect=error) as post:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.generate('hi')
+        self.assertEqual(post.call_count, 3)
+
+    async def test_astream_reads_ndjson_over_httpx(self):
+        body = '\n'.join([
+            json.dumps({'response': 'Hi'}),
+            json.dumps({'response': '!', 'done': True}),
+        ])
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text=body))
+        loop = asyncio.get_running_loop()
+        self.client._async_clients[loop] = httpx.AsyncClient(transport=transport)
+
+        chunks = [chunk async for chunk in await self.client.astream('hi')]
+        self.assertEqual([c['response'] for c in chunks], ['Hi', '!'])
+
+    def test_non_200_raises_response_error(self):
+        with mock.patch.object(self.client.session, 'post', return_value=FakeResponse(status_code=503)):
+            with self.assertRaises(OllamaResponseError) as ctx:
+                self.client.stream('hi')
+        self.assertEqual(ctx.exception.status_code, 503)
+
+
+class TokenCoalescerTest(SimpleTestCase):
+    def test_flushes_on_byte_budget(self):
+        coalescer = TokenCoalescer(window=60, max_bytes=8)
+        self.assertIsNone(coalescer.push('abc'))
+        self.assertIsNone(coalescer.push('def'))
+        self.assertEqual(coalescer.push('gh'), 'abcdefgh')
+        self.assertEqual(coalescer.flush(), '')
+
+    def test_flushes_on_time_window(self):
+        coalescer = TokenCoalescer(window=0, max_bytes=1024)
+        self.assertEqual(coalescer.push('a'), 'a')
+
+
+class ChatStreamTest(SimpleTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    def stream(self, chunks):
+        fake = mock.Mock()
+        fake.stream.return_value = iter(chunks)
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a headache'}),
+            content_type='application/json',
+        )
+        request.session = SessionStore()
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'process_medical_response', return_value={'conversation_stage': 'remedies_shown'}):
+            response = views.chat_stream(request)
+            body = b''.join(response.streaming_content).decode()
+        frames = [json.loads(f[len('data: '):]) for f in body.split('\n\n') if f]
+        return frames, request
+
+    def test_tokens_are_coalesced_without_loss(self):
+        chunks = [{'response': f't{i} '} for i in range(50)] + [{'response': '', 'done': True}]
+        with self.settings(CHAT_STREAM_COALESCE_WINDOW=60, CHAT_STREAM_COALESCE_BYTES=40):
+            frames, request = self.stream(chunks)
+
+        token_frames = [f['token'] for f in frames if 'token' in f]
+        self.assertLess(len(token_frames), 50)
+        self.assertEqual(''.join(token_frames), ''.join(f't{i} ' for i in range(50)))
+        self.assertTrue(frames[-1]['done'])
+        self.assertEqual(request.session['conversation_stage'], 'remedies_shown')
+
+    def test_buffered_tokens_flushed_when_done_is_missing(self):
+        with self.settings(CHAT_STREAM_COALESCE_WINDOW=60, CHAT_STREAM_COALESCE_BYTES=1024):
+            frames, _ = self.stream([{'response': 'partial'}])
+        self.assertEqual(frames, [{'token': 'partial'}])
+
+
+class AsyncChatStreamTest(SimpleTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    async def test_async_stream_coalesces_and_persists_stage(self):
+        async def chunks():
+            for token in ['Rest ', 'and ', 'hydrate.']:
+                yield {'response': token}
+            yield {'response': '', 'done': True}
+
+        fake = mock.Mock()
+        fake.astream = mock.AsyncMock(return_value=chunks())
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a headache'}),
+            content_type='application/json',
+        )
+        request.session = SessionStore()
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'process_medical_response', return_value={'conversation_stage': 'remedies_shown'}), \
+                self.settings(CHAT_STREAM_COALESCE_WINDOW=60, CHAT_STREAM_COALESCE_BYTES=1024):
+            response = await views.chat_stream_async(request)
+            self.assertTrue(response.is_async)
+            body = ''
+            async for part in response.streaming_content:
+                body += part.decode()
+
+        frames = [json.loads(f[len('data: '):]) for f in body.split('\n\n') if f]
+        self.assertEqual(frames[0], {'token': 'Rest and hydrate.'})
+        self.assertTrue(frames[-1]['done'])
+        self.assertEqual(await request.session.aget('conversation_stage'), 'remedies_shown')
+
+    async def test_async_stream_falls_back_when_ollama_is_down(self):
+        fake = mock.Mock()
+        fake.astream = mock.AsyncMock(side_effect=httpx.ConnectError('refused'))
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a fever'}),
+            content_type='application/json',
+        )
+        request.session = SessionStore()
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'process_medical_response', return_value={}):
+            response = await views.chat_stream_async(request)
+            body = ''
+            async for part in response.streaming_content:
+                body += part.decode()
+
+        frames = [json.loads(f[len('data: '):]) for f in body.split('\n\n') if f]
+        self.assertTrue(frames[0]['fallback'])
+        self.assertTrue(frames[-1]['done'])
+
+
+class AsyncAuthenticatedChatStreamTest(TestCase):
+    def setUp(self):
+        get_response_cache().clear()
+        self.user = User.objects.create_user(username='patient', password='x')
+        self.client.force_login(self.user)
+        self.session_key = self.client.session.session_key
+
+    async def test_signed_in_user_is_resolved_without_sync_queries(self):
+        fake = mock.Mock()
+        fake.astream = mock.AsyncMock(side_effect=httpx.ConnectError('refused'))
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a fever', 'is_guest': False}),
+            content_type='application/json',
+        )
+        request.session = DatabaseSessionStore(self.session_key)
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'process_medical_response', return_value={}), \
+                mock.patch.object(views, 'save_turn') as save_turn:
+            response = await views.chat_stream_async(request)
+            self.assertEqual(response.status_code, 200)
+            async for _ in response.streaming_content:
+                pass
+
+        owner = save_turn.call_args.args[0]
+        self.assertEqual((owner['user_id'], owner['session_key']), (self.user.id, f'user_{self.user.id}'))
+
+
+class KeywordEngineTest(SimpleTestCase):
+    def test_reports_overlapping_keywords_across_categories(self):
+        matches = scan('I think I am having a heart attack')
+        self.assertTrue(matches.has('urgent'))
+        self.assertTrue(matches.has('emergency'))
+        self.assertEqual(matches.values('fallback_emergency'), ['heart attack'])
+
+    def test_whole_words_with_inflections(self):
+        self.assertEqual(scan('Terrible headaches and coughing').values('medical_term'), ['headache', 'cough'])
+        self.assertFalse(scan('a hearty meal').has('specialty'))
+
+    def test_first_uses_vocabulary_order_not_text_order(self):
+        engine = KeywordEngine({'topic': {'fever': 'a', 'cough': 'b'}})
+        self.assertEqual(engine.scan('cough then fever').first('topic'), 'a')
+        self.assertIsNone(engine.scan('nothing here').first('topic'))
+
+    def test_views_route_through_engine(self):
+        self.assertEqual(views.extract_triage_level('Persistent fever for days'), 'SEMI-URGENT')
+        self.assertEqual(views.extract_triage_level('I can’t breathe'), 'URGENT')
+        self.assertTrue(views.get_fallback_response('I feel dizzy').startswith("I'm sorry to hear that"))
+        self.assertEqual(whatsapp_views.extract_specialty_whatsapp('just tired'), 'General Practitioner')
+
+
+class SpecialtyMatcherTest(TestCase):
+    def setUp(self):
+        self.cardiology = MedicalSpecialty.objects.create(name='Cardiology', keywords='palpitations, heart')
+
+    def test_db_keywords_take_priority_over_built_ins(self):
+        self.assertEqual(views.extract_specialty('Palpitations at night'), 'Cardiology')
+        self.assertEqual(views.extract_specialty('Knee pain after running'), 'Orthopedic Surgeon')
+
+    def test_lookups_are_query_free_until_keywords_change(self):
+        get_specialty_engine()
+        with self.assertNumQueries(0):
+            views.extract_specialty('My heart is racing')
+
+        self.cardiology.keywords = 'racing pulse'
+        self.cardiology.save()
+        self.assertEqual(views.extract_specialty('I have a racing pulse'), 'Cardiology')
+
+        self.cardiology.delete()
+        self.assertEqual(views.extract_specialty('I have a racing pulse'), None)
+
+    def test_category_names_map_to_their_specialty(self):
+        hospital = make_hospital()
+        Category.objects.create(hospital=hospital, name='Heart Care Unit', specialty=self.cardiology)
+        self.assertEqual(views.extract_specialty('Should I visit the heart care unit?', hospital.id), 'Cardiology')
+
+    def test_category_mappings_are_per_tenant(self):
+        hospitals = [make_hospital('city'), make_hospital('town')]
+        neurology = MedicalSpecialty.objects.create(name='Neurology')
+        Category.objects.create(hospital=hospitals[0], name='Special Clinic', specialty=self.cardiology)
+        Category.objects.create(hospital=hospitals[1], name='Special Clinic', specialty=neurology)
+
+        text = 'Is the special clinic right for me?'
+        self.assertEqual(views.extract_specialty(text, hospitals[0].id), 'Cardiology')
+        self.assertEqual(views.extract_specialty(text, hospitals[1].id), 'Neurology')
+        self.assertIsNone(views.extract_specialty(text))
+
+
+class DoctorIndexTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital(city='Gorakhpur', state='UP', postal_code='273001')
+        cardiology = MedicalSpecialty.objects.create(name='Cardiology')
+        self.category = Category.objects.create(hospital=self.hospital, name='Heart Care', specialty=cardiology)
+
+    def add_doctor(self, last_name, **fields):
+        return make_doctor(self.hospital, last_name, category=self.category, **fields)
+
+    def test_ranked_lookup_is_query_free_and_follows_signals(self):
+        self.add_doctor('Junior', experience_years=2)
+        self.add_doctor('Senior', experience_years=20)
+        self.add_doctor('Star', experience_years=5, is_featured=True)
+        self.add_doctor('Away', experience_years=30, is_available=False)
+
+        names = [d['name'] for d in views.find_doctors_by_specialty('Cardiology', {})]
+        self.assertEqual(names, ['Dr. A Star', 'Dr. A Senior', 'Dr. A Junior'])
+        with self.assertNumQueries(0):
+            views.find_doctors_by_specialty('heart care', {})
+
+        self.add_doctor('Expert', bio='Interventional cardiologist', is_featured=True, experience_years=25)
+        names = [d['name'] for d in views.find_doctors_by_specialty('Cardiologist', {})]
+        self.assertEqual(names, ['Dr. A Expert'])
+
+    def test_whatsapp_lookup_filters_by_city(self):
+        self.add_doctor('Local')
+        doctors = whatsapp_views.find_doctors_by_specialty_whatsapp('cardiology', 'gorakhpur')
+        self.assertEqual(doctors[0]['phone'], '+919876543210')
+        self.assertEqual(whatsapp_views.find_doctors_by_specialty_whatsapp('cardiology', 'Pune'), [])
+
+    def test_lookups_stay_within_the_current_tenant(self):
+        self.add_doctor('Local')
+        other = make_hospital('town', city='Gorakhpur', state='UP', postal_code='273001')
+        make_doctor(other, 'Elsewhere', category=self.category, first_name='B')
+
+        names = [d['name'] for d in views.find_doctors_by_specialty('Cardiology', {}, self.hospital.id)]
+        self.assertEqual(names, ['Dr. A Local'])
+        recommendations = views.process_medical_response('', {}, 'I want to book an appointment for cardiology', hospital_id=other.id)
+        self.assertEqual([d['name'] for d in recommendations['doctors']], ['Dr. B Elsewhere'])
+        with tenant_context(other):
+            doctors = whatsapp_views.find_doctors_by_specialty_whatsapp('cardiology', None)
+        self.assertEqual([d['name'] for d in doctors], ['Dr. B Elsewhere'])
+
+
+class SessionStoreTest(SimpleTestCase):
+    def test_local_store_evicts_lru_and_idle_sessions(self):
+        evicted = []
+        store = LocalSessionStore(max_entries=2, ttl=60, on_evict=lambda key, data: evicted.append(key))
+        store.save('a', {'n': 1})
+        store.save('b', {'n': 2})
+        store.load('a')
+        store.save('c', {'n': 3})
+        self.assertEqual(evicted, ['b'])
+
+        self.assertEqual(store.sweep(now=time.time() + 120), 2)
+        self.assertEqual(evicted, ['b', 'a', 'c'])
+        self.assertEqual(len(store), 0)
+
+    def test_cache_store_is_shared_between_workers(self):
+        evicted = []
+        worker_1 = CacheSessionStore(ttl=60, prefix='test:session:', on_evict=lambda key, data: evicted.append(data))
+        worker_2 = CacheSessionStore(ttl=60, prefix='test:session:')
+        worker_1.save('+911234567890', {'state': 'chatting'})
+        self.assertEqual(worker_2.load('+911234567890'), {'state': 'chatting'})
+
+        self.assertEqual(worker_1.sweep(now=time.time() + 120), 1)
+        self.assertEqual(evicted, [{'state': 'chatting'}])
+        self.assertIsNone(worker_2.load('+911234567890'))
+
+
+class WhatsAppSessionTest(TestCase):
+    def setUp(self):
+        self.store = CacheSessionStore(ttl=60, prefix='test:wa:', on_evict=whatsapp_views.flush_whatsapp_session)
+        patcher = mock.patch.object(whatsapp_views, '_session_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_state_survives_across_workers_and_is_flushed_when_idle(self):
+        phone = 'whatsapp:+911234567890'
+        whatsapp_views.process_whatsapp_message(phone, 'hi')
+        whatsapp_views.process_whatsapp_message(phone, 'Pune')
+
+        # A second worker reads the same conversation with one cache read
+        other_worker = CacheSessionStore(ttl=60, prefix='test:wa:')
+        session = other_worker.load('+911234567890')
+        self.assertEqual(session['state'], 'chatting')
+        self.assertEqual(session['location'], 'Pune')
+
+        self.store.sweep(now=time.time() + 120)
+        chat_session = ChatSession.objects.get(id=session['chat_session_id'])
+        self.assertEqual(chat_session.user_preferences['location'], 'Pune')
+        self.assertEqual(chat_session.user_preferences['whatsapp']['state'], 'chatting')
+
+        # The next message after eviction resumes from the flushed state
+        session = whatsapp_views.get_or_create_whatsapp_session(phone)
+        self.assertEqual(session['state'], 'chatting')
+        self.assertEqual(session['question_count'], 0)
+
+
+class WhatsAppDispatcherTest(TestCase):
+    def test_messages_from_one_phone_keep_their_order(self):
+        handled = []
+
+        def handler(phone, body):
+            time.sleep(0.005 if body.endswith('0') else 0)
+            handled.append((phone, body))
+
+        dispatcher = WhatsAppDispatcher(handler, max_workers=4)
+        self.addCleanup(dispatcher.shutdown)
+        for i in range(10):
+            dispatcher.submit('+911', f'a{i}')
+            dispatcher.submit('+912', f'b{i}')
+        self.assertTrue(dispatcher.wait_idle(timeout=5))
+
+        self.assertEqual([b for p, b in handled if p == '+911'], [f'a{i}' for i in range(10)])
+        self.assertEqual([b for p, b in handled if p == '+912'], [f'b{i}' for i in range(10)])
+
+    def test_duplicate_message_sid_is_dropped(self):
+        handled = []
+        dispatcher = WhatsAppDispatcher(lambda phone, body: handled.append(body))
+        self.addCleanup(dispatcher.shutdown)
+        self.assertTrue(dispatcher.submit('+911', 'hello', 'SM-dedupe-test'))
+        self.assertFalse(dispatcher.submit('+911', 'hello', 'SM-dedupe-test'))
+        dispatcher.wait_idle(timeout=5)
+        self.assertEqual(handled, ['hello'])
+
+        # A restarted or different worker still recognizes the retry
+        other = WhatsAppDispatcher(lambda phone, body: handled.append(body))
+        self.addCleanup(other.shutdown)
+        self.assertFalse(other.submit('+911', 'hello', 'SM-dedupe-test'))
+
+    def test_expired_receipts_are_pruned(self):
+        WhatsAppMessageReceipt.objects.create(
+            message_sid='SM-old', received_at=timezone.now() - datetime.timedelta(hours=2),
+        )
+        dispatcher = WhatsAppDispatcher(lambda phone, body: None, dedupe_ttl=3600)
+        self.addCleanup(dispatcher.shutdown)
+        self.assertFalse(dispatcher.is_duplicate('SM-new'))
+        self.assertEqual(
+            list(WhatsAppMessageReceipt.objects.values_list('message_sid', flat=True)), ['SM-new']
+        )
+
+    def test_webhook_acknowledges_and_replies_in_background(self):
+        dispatcher = WhatsAppDispatcher(whatsapp_views.reply_to_whatsapp_message)
+        self.addCleanup(dispatcher.shutdown)
+        with mock.patch.object(whatsapp_views, 'get_dispatcher', return_value=dispatcher), \
+                mock.patch.object(whatsapp_views, 'process_whatsapp_message', return_value='Stay hydrated'), \
+                mock.patch.object(whatsapp_views, 'send_whatsapp_message') as send:
+            response = self.client.post('/chatbot/whatsapp/', {
+                'From': 'whatsapp:+911234567890', 'Body': 'I have a fever', 'MessageSid': 'SM-webhook-test',
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'<Message>', response.content)
+            dispatcher.wait_idle(timeout=5)
+
+        send.assert_called_once_with('+911234567890', 'Stay hydrated')
+
+
+class ContextWindowTest(SimpleTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    def turn(self, i):
+        return {'user': f'Symptom report {i}. ' + 'detail ' * 40, 'assistant': f'Advice {i}. ' + 'more ' * 40}
+
+    def test_old_turns_are_folded_into_a_bounded_summary(self):
+        window = ContextWindow(num_ctx=1200, system_tokens=200, response_tokens=300, summary_tokens=60)
+        history = [self.turn(i) for i in range(10)]
+        plan = window.plan('New pain in my knee', history)
+
+        self.assertLess(len(plan.history), 10)
+        self.assertEqual(plan.history[-1], history[-1])
+        self.assertLessEqual(plan.prompt_tokens, window.prompt_budget)
+        self.assertLessEqual(estimate_tokens(plan.summary), 60)
+        # Newest dropped turn survives in the summary, oldest ones are gone
+        self.assertIn(f'Symptom report {9 - len(plan.history)}.', plan.summary)
+        self.assertNotIn('Symptom report 0.', plan.summary)
+        self.assertTrue(plan.prompt.endswith('Patient: New pain in my knee\nSymptomWise:'))
+
+    def test_cached_context_is_reused_only_for_the_matching_turn(self):
+        window = ContextWindow(num_ctx=1000, system_tokens=100, response_tokens=200)
+        history = [self.turn(1)]
+        window.remember('conv', 1, [1, 2, 3])
+
+        plan = window.plan('And now a fever', history, key='conv', turn=1)
+        self.assertTrue(plan.reused_context)
+        self.assertEqual(plan.prompt, 'And now a fever')
+        self.assertEqual(plan.options, {'context': [1, 2, 3]})
+
+        # Another worker answered a turn in between: rebuild from the stored history
+        plan = window.plan('And now a fever', history, key='conv', turn=2)
+        self.assertFalse(plan.reused_context)
+        self.assertIn('Symptom report 1.', plan.prompt)
+        self.assertIsNone(window.cache.get('conv'))
+
+        # A context too long to extend is dropped as well
+        window.remember('conv', 1, list(range(900)))
+        self.assertFalse(window.plan('And now a fever', history, key='conv', turn=1).reused_context)
+
+    def test_chat_stream_sends_only_the_new_message_on_a_sticky_session(self):
+        fake = mock.Mock()
+        fake.model = 'symptomwise'
+        session = SessionStore()
+
+        def send(message, context):
+            fake.stream.return_value = iter([{'response': 'Noted.', 'done': True, 'context': context}])
+            request = RequestFactory().post(
+                '/chatbot/stream/', data=json.dumps({'message': message}), content_type='application/json',
+            )
+            request.session = session
+            b''.join(views.chat_stream(request).streaming_content)
+            return fake.stream.call_args
+
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'get_context_window', return_value=ContextWindow()), \
+                mock.patch.object(views, 'save_turn'), \
+                mock.patch.object(views, 'process_medical_response', return_value={}):
+            first = send('I have a headache', [7, 8, 9])
+            second = send('It started yesterday', [7, 8, 9, 10])
+
+        self.assertEqual(first, mock.call('I have a headache'))
+        self.assertEqual(second, mock.call('It started yesterday', context=[7, 8, 9]))
+        conversation = session[views.CHAT_CONTEXT_KEY]
+        self.assertEqual(conversation['turn'], 2)
+        self.assertEqual([t['user'] for t in conversation['history']], ['I have a headache', 'It started yesterday'])
+
+
+class ChatSessionCookieTest(TestCase):
+    def test_new_visitor_keeps_the_conversation_across_turns(self):
+        fake = mock.Mock()
+        fake.model = 'symptomwise'
+
+        def send(message):
+            fake.stream.return_value = iter([{'response': 'Noted.', 'done': True}])
+            response = self.client.post('/chatbot/stream/', data=json.dumps({'message': message}),
+                                        content_type='application/json')
+            b''.join(response.streaming_content)
+            return fake.stream.call_args
+
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'get_context_window', return_value=ContextWindow()), \
+                mock.patch.object(views, 'save_turn'), \
+                mock.patch.object(views, 'process_medical_response', return_value={}), \
+                self.settings(CHAT_RESPONSE_CACHE_ENABLED=False):
+            send('I have a headache')
+            self.assertIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+            second = send('it started yesterday')
+
+        self.assertIn('I have a headache', second.args[0])
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class ResponseCacheTest(SimpleTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    def test_near_identical_prompts_share_an_entry(self):
+        self.assertEqual(normalize_prompt('Hello doctor, I have a  Headache!'), normalize_prompt('i have headache'))
+        self.assertEqual(normalize_prompt('Fever for two days'), normalize_prompt('fever for 2 days'))
+        self.assertNotEqual(normalize_prompt('no fever'), normalize_prompt('fever'))
+
+        cache = ResponseCache(modelfile='abc')
+        cache.set('I have a headache', 'symptomwise', 'Rest and hydrate.')
+        self.assertEqual(cache.get('Hi, I have headache.', 'symptomwise', hospital_id=1), 'Rest and hydrate.')
+        self.assertIsNone(cache.get('headache', 'other-model', hospital_id=1))
+        self.assertIsNone(ResponseCache(modelfile='edited').get('headache', 'symptomwise'))
+        self.assertEqual(cache.stats(1), {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1, 'evictions': 0})
+
+    def test_triage_relevant_variants_do_not_collide(self):
+        variants = [
+            ('I had chest pain', 'I have chest pain'),
+            ('very severe headache', 'severe headache'),
+            ('really bad cough', 'bad cough'),
+            ('fever since 2 days', 'fever for 2 days'),
+            ('fever for a few days', 'fever for 3 days'),
+            ('my child has a fever', 'I have a fever'),
+        ]
+        for first, second in variants:
+            with self.subTest(first=first, second=second):
+                self.assertNotEqual(normalize_prompt(first), normalize_prompt(second))
+                self.assertNotEqual(
+                    ResponseCache(modelfile='').key(first, 'symptomwise'),
+                    ResponseCache(modelfile='').key(second, 'symptomwise'),
+                )
+
+    def test_lru_and_ttl_eviction(self):
+        cache = ResponseCache(max_entries=2, ttl=60, modelfile='')
+        cache.set('cough', 'm', 'a')
+        cache.set('fever', 'm', 'b')
+        cache.get('cough', 'm')
+        cache.set('rash', 'm', 'c')
+        self.assertIsNone(cache.get('fever', 'm'))
+        self.assertEqual(cache.get('cough', 'm'), 'a')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        with mock.patch('chatbot.response_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('cough', 'm'))
+
+    def stream(self, message, hospital=None):
+        fake = mock.Mock()
+        fake.model = 'symptomwise'
+        fake.stream.return_value = iter([{'response': 'Rest and '}, {'response': 'hydrate.', 'done': True}])
+        request = RequestFactory().post(
+            '/chatbot/stream/', data=json.dumps({'message': message}), content_type='application/json',
+        )
+        request.session = SessionStore()
+        request.hospital = hospital
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'save_turn'), \
+                mock.patch.object(views, 'process_medical_response', return_value={}):
+            body = b''.join(views.chat_stream(request).streaming_content).decode()
+        frames = [json.loads(f[len('data: '):]) for f in body.split('\n\n') if f]
+        return frames, fake.stream.called
+
+    def test_hit_replays_through_the_sse_stream(self):
+        frames, called = self.stream('I have a headache')
+        self.assertTrue(called)
+        frames, called = self.stream('Hi, I have headache!!')
+        self.assertFalse(called)
+        self.assertEqual(''.join(f.get('token', '') for f in frames), 'Rest and hydrate.')
+        self.assertTrue(frames[-1]['done'])
+
+    def test_hospital_can_opt_out(self):
+        hospital = mock.Mock(id=7, ai_response_cache_enabled=False)
+        self.stream('I have a headache', hospital)
+        frames, called = self.stream('I have a headache', hospital)
+        self.assertTrue(called)
+        self.assertEqual(get_response_cache().stats(7)['hits'], 0)
+
+    def test_whatsapp_answers_follow_the_tenant_setting(self):
+        fake = mock.Mock()
+        fake.model = 'symptomwise'
+        fake.generate.return_value = {'response': 'Rest and hydrate.'}
+        session = {'conversation_history': [], 'location': 'Pune'}
+
+        def ask(hospital):
+            with tenant_context(hospital), mock.patch.object(whatsapp_views, 'get_ollama_client', return_value=fake):
+                return whatsapp_views.get_ai_response('I have a headache', session)
+
+        opted_in = mock.Mock(id=8, ai_response_cache_enabled=True)
+        ask(opted_in)
+        self.assertEqual(ask(opted_in), 'Rest and hydrate.')
+        self.assertEqual(fake.generate.call_count, 1)
+        self.assertEqual(get_response_cache().stats(8), dict(get_response_cache().stats(8), hits=1, misses=1))
+
+        ask(mock.Mock(id=7, ai_response_cache_enabled=False))
+        self.assertEqual(fake.generate.call_count, 2)
+        self.assertEqual(get_response_cache().stats(7)['hits'], 0)
+
+
+class TranscriptBufferTest(TestCase):
+    def setUp(self):
+        get_response_cache().clear()
+        self.buffer = TranscriptBuffer(batch_size=10, background=False)
+        self.user = User.objects.create_user(username='patient', password='x')
+
+    def test_flush_writes_turns_in_bulk(self):
+        existing = ChatSession.objects.create(session_id='user_session', user=self.user, is_guest=False)
+        started = timezone.now() - datetime.timedelta(seconds=2)
+        self.buffer.record_turn('guest_1', 'I have a headache', 'Rest and hydrate.',
+                                {'triage': 'ROUTINE'}, started_at=started, model_used='symptomwise')
+        self.buffer.record_turn('guest_1', 'Chest pain', 'Call 108.', {'is_emergency': True})
+        self.buffer.record_turn(f'user_{self.user.id}', 'Book a doctor', 'Here are doctors.',
+                                {'doctors': [{'name': 'Dr A'}]}, user_id=self.user.id)
+        self.assertEqual(ChatMessage.objects.count(), 0)
+
+        # Guest and user session lookups, one bulk insert each for sessions and messages,
+        # activity and expiry updates, savepoint
+        with self.assertNumQueries(11):
+            self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+        guest = ChatSession.objects.get(session_id='guest_1')
+        self.assertTrue(guest.is_guest)
+        self.assertIsNotNone(guest.expires_at)
+        messages = list(guest.messages.order_by('timestamp', 'id'))
+        self.assertEqual([m.role for m in messages], ['user', 'assistant', 'user', 'assistant'])
+        self.assertEqual(messages[0].timestamp, started)
+        self.assertEqual(messages[1].message_type, 'symptom_analysis')
+        self.assertEqual(messages[1].model_used, 'symptomwise')
+        self.assertGreaterEqual(messages[1].processing_time, 2)
+        self.assertEqual(messages[3].message_type, 'emergency_triage')
+
+        # Signed-in users reuse their existing session
+        reply = existing.messages.get(role='assistant')
+        self.assertEqual(reply.structured_data['doctors'], [{'name': 'Dr A'}])
+        self.assertEqual(reply.message_type, 'doctor_recommendation')
+
+    def test_guests_cannot_write_into_a_signed_in_session(self):
+        existing = ChatSession.objects.create(session_id='private', user=self.user, is_guest=False)
+        self.buffer.record_turn('private', 'Hijack', 'Reply')
+        self.buffer.flush()
+        self.assertFalse(existing.messages.exists())
+        self.assertEqual(ChatSession.objects.count(), 1)
+
+        request = RequestFactory().post('/chatbot/stream/')
+        self.assertIsNone(views.transcript_owner(request, f'user_{self.user.id}', True))
+
+    def test_failed_flush_keeps_turns_for_retry(self):
+        self.buffer.record_turn('guest_1', 'Hello', 'Hi')
+        with mock.patch('chatbot.transcripts.write_turns', side_effect=RuntimeError('db down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending_count(), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+    def test_one_bad_turn_does_not_block_the_buffer(self):
+        real_write = transcripts.write_turns
+
+        def write_turns(turns):
+            if any(turn['session_key'] == 'guest_bad' for turn in turns):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return real_write(turns)
+
+        self.buffer.record_turn('guest_1', 'Hello', 'Hi')
+        self.buffer.record_turn('guest_bad', 'Hello', 'Hi')
+        self.buffer.record_turn('guest_2', 'Hello', 'Hi')
+        with mock.patch('chatbot.transcripts.write_turns', side_effect=write_turns):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending_count(), 0)
+        self.assertEqual(ChatMessage.objects.count(), 4)
+
+    def test_chat_stream_records_the_turn(self):
+        fake = mock.Mock()
+        fake.model = 'symptomwise'
+        fake.stream.return_value = iter([{'response': 'Rest '}, {'response': 'well.', 'done': True}])
+        request = RequestFactory().post(
+            '/chatbot/stream/',
+            data=json.dumps({'message': 'I have a headache', 'session_id': 'guest_42', 'is_guest': True}),
+            content_type='application/json',
+        )
+        request.session = SessionStore()
+        with mock.patch.object(views, 'get_ollama_client', return_value=fake), \
+                mock.patch.object(views, 'record_turn', self.buffer.record_turn), \
+                mock.patch.object(views, 'process_medical_response', return_value={'conversation_stage': 'remedies_shown'}):
+            response = views.chat_stream(request)
+            b''.join(response.streaming_content)
+        self.assertEqual(self.buffer.pending_count(), 1)
+        self.buffer.flush()
+        reply = ChatMessage.objects.get(session__session_id='guest_42', role='assistant')
+        self.assertEqual(reply.content, 'Rest well.')
+        self.assertEqual(reply.model_used, 'symptomwise')
+
+
+class TranscriptFlusherTest(SimpleTestCase):
+    def test_background_thread_flushes_on_batch_size_and_close(self):
+        with mock.patch('chatbot.transcripts.write_turns') as write_turns:
+            buffer = TranscriptBuffer(batch_size=2, flush_interval=60)
+            buffer.record_turn('guest_1', 'a', 'b')
+            buffer.record_turn('guest_1', 'c', 'd')
+            deadline = time.monotonic() + 5
+            while not write_turns.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(write_turns.call_args[0][0]), 2)
+
+            # Shutdown writes what is left without waiting for the interval
+            buffer.record_turn('guest_1', 'e', 'f')
+            buffer.close()
+            self.assertEqual(write_turns.call_count, 2)
+            self.assertEqual(buffer.pending_count(), 0)
+
+
+class ChatRetentionTest(TestCase):
+    def make_session(self, session_id, count, max_messages=3, **fields):
+        session = ChatSession.objects.create(session_id=session_id, max_messages=max_messages, **fields)
+        start = timezone.now() - datetime.timedelta(hours=1)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, role='user', content=f'{session_id} {i}',
+                        timestamp=start + datetime.timedelta(minutes=i // 2))
+            for i in range(count)
+        ])
+        return session
+
+    def contents(self, session):
+        return list(session.messages.order_by('id').values_list('content', flat=True))
+
+    def test_cleanup_old_messages_keeps_the_newest(self):
+        session = self.make_session('guest_a', 6)
+        with self.assertNumQueries(2):
+            self.assertEqual(session.cleanup_old_messages(), 3)
+        # Ties on timestamp are broken by id, like the retention sweep
+        self.assertEqual(self.contents(session), ['guest_a 3', 'guest_a 4', 'guest_a 5'])
+        self.assertEqual(session.cleanup_old_messages(), 0)
+
+    def test_trim_messages_in_bounded_batches(self):
+        over = self.make_session('guest_a', 8)
+        under = self.make_session('guest_b', 2)
+        big = self.make_session('guest_c', 7, max_messages=5)
+
+        result = trim_messages(batch_size=3)
+        self.assertEqual(result.rows, 7)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(self.contents(over), ['guest_a 5', 'guest_a 6', 'guest_a 7'])
+        self.assertEqual(len(self.contents(under)), 2)
+        self.assertEqual(len(self.contents(big)), 5)
+        self.assertEqual(trim_messages().rows, 0)
+
+    def test_purge_expired_guest_sessions(self):
+        past = timezone.now() - datetime.timedelta(days=1)
+        expired = self.make_session('guest_old', 4, expires_at=past)
+        WhatsAppSession.objects.create(phone_number='+911234567890', chat_session=expired)
+        kept = self.make_session('guest_new', 2)
+        user = User.objects.create_user(username='patient', password='x')
+        member = self.make_session('user_1', 2, is_guest=False, user=user, expires_at=past)
+
+        result = purge_expired_sessions(batch_size=1)
+        self.assertEqual(result.batches, 1)
+        self.assertEqual(result.rows, 6)  # session, 4 messages, WhatsApp link
+        self.assertFalse(ChatSession.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(ChatMessage.objects.filter(session__in=[kept, member]).count(), 4)
+
+    def test_activity_keeps_guest_sessions_alive(self):
+        past = timezone.now() - datetime.timedelta(days=1)
+        session = self.make_session('guest_busy', 2, expires_at=past)
+        buffer = TranscriptBuffer(batch_size=10, background=False)
+        buffer.record_turn('guest_busy', 'Still coughing', 'Rest and hydrate.')
+        buffer.flush()
+
+        self.assertEqual(purge_expired_sessions().rows, 0)
+        session.refresh_from_db()
+        self.assertGreater(session.expires_at, timezone.now() + datetime.timedelta(days=9))
+
+    def test_command_reports_throughput(self):
+        self.make_session('guest_a', 5)
+        out = io.StringIO()
+        call_command('sweep_chat_retention', batch_size=10, stdout=out)
+        self.assertIn('Messages over cap: 2 rows in 1 batches', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+
+class ChatAnalyticsRollupTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital()
+        self.now = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.yesterday = self.now - datetime.timedelta(days=1)
+        self.session = self.make_session('guest_a', self.yesterday, hospital=self.hospital)
+        WhatsAppSession.objects.create(phone_number='+911234567890', chat_session=self.session, hospital=self.hospital)
+        self.add_turn(self.session, self.yesterday, processing_time=2.0, is_helpful=True)
+        self.add_turn(self.session, self.yesterday, processing_time=4.0, message_type='doctor_recommendation')
+        self.add_turn(self.session, self.now, processing_time=1.0)
+        self.orphan = self.make_session('guest_b', self.now)
+        self.add_turn(self.orphan, self.now, processing_time=3.0)
+
+    def make_session(self, session_id, created_at, **fields):
+        session = ChatSession.objects.create(session_id=session_id, **fields)
+        ChatSession.objects.filter(pk=session.pk).update(created_at=created_at)
+        return session
+
+    def add_turn(self, session, at, processing_time, message_type='text', is_helpful=None):
+        ChatMessage.objects.create(session=session, role='user', content='q', timestamp=at)
+        return ChatMessage.objects.create(
+            session=session, role='assistant', content='a', timestamp=at, processing_time=processing_time,
+            message_type=message_type, is_helpful=is_helpful,
+        )
+
+    def row(self, day, hospital=None):
+        return ChatAnalytics.objects.get(hospital=hospital or self.hospital, date=day.date())
+
+    def test_rollup_aggregates_per_hospital_and_day(self):
+        result = rollup_chat_analytics()
+        self.assertEqual((result['days'], result['rows']), (2, 3))
+
+        row = self.row(self.yesterday)
+        self.assertEqual((row.total_sessions, row.guest_sessions, row.whatsapp_sessions), (1, 1, 1))
+        self.assertEqual((row.total_messages, row.user_messages, row.assistant_messages), (4, 2, 2))
+        self.assertEqual(row.avg_response_time, 3.0)
+        self.assertEqual((row.helpful_responses, row.doctor_recommendations), (1, 1))
+        today = self.row(self.now)
+        self.assertEqual((today.total_sessions, today.total_messages), (0, 2))
+        untenanted = ChatAnalytics.objects.get(hospital__isnull=True)
+        self.assertEqual((untenanted.total_sessions, untenanted.avg_response_time), (1, 3.0))
+
+    def test_reruns_are_incremental_and_idempotent(self):
+        rollup_chat_analytics()
+        self.assertEqual(rollup_chat_analytics()['days'], 0)
+
+        # Only the day that received new rows is recomputed
+        self.add_turn(self.session, self.now, processing_time=5.0)
+        self.add_turn(self.orphan, self.now, processing_time=1.0)
+        result = rollup_chat_analytics()
+        self.assertEqual((result['days'], result['rows']), (1, 2))
+        self.assertEqual(self.row(self.now).total_messages, 4)
+        self.assertEqual(self.row(self.now).avg_response_time, 3.0)
+        self.assertEqual(self.row(self.yesterday).total_messages, 4)
+        self.assertEqual(ChatAnalytics.objects.filter(hospital__isnull=True).get().total_messages, 4)
+
+        rollup_chat_analytics(full=True)
+        self.assertEqual(ChatAnalytics.objects.count(), 3)
+
+    def test_since_picks_up_feedback_edits(self):
+        rollup_chat_analytics()
+        ChatMessage.objects.filter(role='assistant', is_helpful__isnull=True).update(is_helpful=False)
+        self.assertEqual(rollup_chat_analytics()['days'], 0)
+        out = io.StringIO()
+        call_command('rollup_chat_analytics', since=self.yesterday.date().isoformat(), stdout=out)
+        self.assertIn('for 2 days', out.getvalue())
+        self.assertEqual(self.row(self.yesterday).unhelpful_responses, 1)
+
+    def test_backfill_never_lowers_trimmed_days(self):
+        rollup_chat_analytics()
+        # The retention sweep trims yesterday's messages and purges the orphan session
+        ChatMessage.objects.filter(session=self.session, timestamp=self.yesterday).delete()
+        self.orphan.delete()
+
+        rollup_chat_analytics(full=True)
+        self.assertEqual(self.row(self.yesterday).total_messages, 4)
+        self.assertEqual(ChatAnalytics.objects.filter(hospital__isnull=True).get().total_messages, 2)
+
+    def test_summary_reads_precomputed_rows(self):
+        rollup_chat_analytics()
+        with self.assertNumQueries(1):
+            summary = chat_summary(self.hospital.id)
+        self.assertEqual(summary['messages'], 6)
+        self.assertEqual(summary['whatsapp_sessions'], 1)
+        # Weighted by replies: (2 + 4 + 1) / 3
+        self.assertEqual(summary['avg_response_time'], 2.33)
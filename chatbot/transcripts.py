@@ -0,0 +1,296 @@
+"""
+Buffered persistence of web chat turns.
+
+``chat_stream`` hands every finished turn (user message, assistant reply,
+recommendations, timing) to ``record_turn``, which only appends it to an
+in-process buffer. A daemon thread writes the buffer to ChatSession /
+ChatMessage when it holds ``CHAT_TRANSCRIPT_BATCH_SIZE`` turns or every
+``CHAT_TRANSCRIPT_FLUSH_INTERVAL`` seconds, whichever comes first:
+
+* sessions are looked up with one query per flush and missing ones are
+  created with one ``bulk_create``,
+* all messages of the flush are inserted with one ``bulk_create``, and
+  the sessions' activity time and guest expiry are moved forward,
+* the sessions' rolling conversation summaries are saved with one
+  ``bulk_update``.
+
+The buffer is flushed once more at interpreter exit (``atexit``), so a
+graceful worker restart does not lose turns. A failed flush is put back
+and retried turn by turn: turns that still fail while others succeed are
+logged and dropped, and if none succeed (database down) the batch is kept
+for the next flush, up to ``CHAT_TRANSCRIPT_MAX_PENDING`` turns; older
+turns are dropped rather than letting the buffer grow without bound.
+"""
+import atexit
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def turn_message_type(recommendations):
+    """ChatMessage.message_type of an assistant reply, from its recommendations"""
+    recommendations = recommendations or {}
+    if recommendations.get('is_emergency') or recommendations.get('triage') == 'URGENT':
+        return 'emergency_triage'
+    if recommendations.get('conversation_stage') == 'appointment_options_shown':
+        return 'appointment_booking'
+    if recommendations.get('doctors'):
+        return 'doctor_recommendation'
+    if recommendations.get('triage'):
+        return 'symptom_analysis'
+    return 'text'
+
+
+def owner_key(turn):
+    """Whose session a turn goes to: guests by their session key, signed-in users by key and user"""
+    return turn['session_key'], turn['user_id']
+
+
+def _lookup_sessions(guest_keys, user_keys, user_ids):
+    """{owner_key: ChatSession id} of existing sessions; guest keys only ever match guest sessions"""
+    from .models import ChatSession
+
+    sessions = {}
+    if guest_keys:
+        sessions.update(
+            ((session_key, None), pk) for session_key, pk in ChatSession.objects.filter(
+                session_id__in=guest_keys, is_guest=True
+            ).values_list('session_id', 'id')
+        )
+    if user_keys:
+        sessions.update(
+            ((session_key, user_id), pk) for session_key, user_id, pk in ChatSession.objects.filter(
+                session_id__in=user_keys, user_id__in=user_ids, is_guest=False
+            ).values_list('session_id', 'user_id', 'id')
+        )
+    return sessions
+
+
+def _resolve_sessions(turns, now):
+    """{owner_key: ChatSession id} for the turns, creating missing sessions in one bulk insert"""
+    from .models import ChatSession
+
+    guest_keys = {turn['session_key'] for turn in turns if not turn['user_id']}
+    user_keys = {turn['session_key'] for turn in turns if turn['user_id']}
+    user_ids = {turn['user_id'] for turn in turns if turn['user_id']}
+    sessions = _lookup_sessions(guest_keys, user_keys, user_ids)
+
+    # Signed-in users keep the session get_user_location created for them
+    by_user = {}
+    if user_ids:
+        for user_id, session_pk in ChatSession.objects.filter(
+            user_id__in=user_ids, is_guest=False
+        ).order_by('-last_activity').values_list('user_id', 'id'):
+            by_user.setdefault(user_id, session_pk)
+    for turn in turns:
+        key = owner_key(turn)
+        if key not in sessions and turn['user_id'] in by_user:
+            sessions[key] = by_user[turn['user_id']]
+
+    missing = {}
+    for turn in turns:
+        key = owner_key(turn)
+        if key in sessions or key in missing:
+            continue
+        is_guest = not turn['user_id']
+        missing[key] = ChatSession(
+            session_id=turn['session_key'],
+            user_id=turn['user_id'],
+            is_guest=is_guest,
+            hospital_id=turn['hospital_id'],
+            guest_identifier=turn['guest_identifier'],
+            user_preferences={},
+            # bulk_create skips ChatSession.save(), which sets this for guests
+            expires_at=now + timedelta(days=10) if is_guest else None,
+        )
+    if missing:
+        ChatSession.objects.bulk_create(missing.values(), ignore_conflicts=True)
+        # A key already taken by someone else's session stays unresolved and its turns are dropped
+        created = _lookup_sessions(
+            {session_key for session_key, user_id in missing if not user_id},
+            {session_key for session_key, user_id in missing if user_id},
+            {user_id for _, user_id in missing if user_id},
+        )
+        sessions.update((key, pk) for key, pk in created.items() if key in missing)
+    return sessions
+
+
+def write_turns(turns):
+    """Insert buffered turns; returns the number of ChatMessage rows written"""
+    from .models import ChatMessage, ChatSession
+    from .retention import extend_guest_expiry
+
+    now = timezone.now()
+    with transaction.atomic():
+        sessions = _resolve_sessions(turns, now)
+        messages = []
+        for turn in turns:
+            session_pk = sessions.get(owner_key(turn))
+            if session_pk is None:
+                continue
+            messages.append(ChatMessage(
+                session_id=session_pk, role='user', content=turn['user_message'],
+                timestamp=turn['started_at'],
+            ))
+            messages.append(ChatMessage(
+                session_id=session_pk, role='assistant', content=turn['assistant_message'],
+                timestamp=turn['finished_at'],
+                message_type=turn['message_type'],
+                processing_time=turn['processing_time'],
+                model_used=turn['model_used'],
+                structured_data=turn['structured_data'],
+            ))
+        ChatMessage.objects.bulk_create(messages)
+        ChatSession.objects.filter(pk__in=set(sessions.values())).update(last_activity=now)
+        extend_guest_expiry(set(sessions.values()), now)
+        # Latest rolling summary per session (chatbot/context_window.py)
+        summaries = {
+            sessions[owner_key(turn)]: turn['context_summary']
+            for turn in turns
+            if turn['context_summary'] is not None and owner_key(turn) in sessions
+        }
+        if summaries:
+            ChatSession.objects.bulk_update(
+                [ChatSession(pk=pk, context_summary=summary) for pk, summary in summaries.items()],
+                ['context_summary'],
+            )
+    return len(messages)
+
+
+class TranscriptBuffer:
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None, background=True):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_TRANSCRIPT_BATCH_SIZE', 50)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_TRANSCRIPT_FLUSH_INTERVAL', 2.0)
+        self.max_pending = max_pending or getattr(settings, 'CHAT_TRANSCRIPT_MAX_PENDING', 5000)
+        self.background = background
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record_turn(self, session_key, user_message, assistant_message, recommendations=None,
+                    user_id=None, hospital_id=None, guest_identifier='', processing_time=None,
+                    model_used='', started_at=None, context_summary=None):
+        """Queue one user/assistant exchange; never touches the database"""
+        finished_at = timezone.now()
+        if processing_time is None and started_at is not None:
+            processing_time = (finished_at - started_at).total_seconds()
+        turn = {
+            'session_key': session_key,
+            'user_id': user_id,
+            'hospital_id': hospital_id,
+            'guest_identifier': guest_identifier[:100],
+            'user_message': user_message,
+            'assistant_message': assistant_message,
+            'message_type': turn_message_type(recommendations),
+            'structured_data': recommendations or {},
+            'processing_time': processing_time,
+            'model_used': str(model_used or '')[:50],
+            'started_at': started_at or finished_at,
+            'finished_at': finished_at,
+            'context_summary': context_summary,
+        }
+        with self._lock:
+            self._pending.append(turn)
+            full = len(self._pending) >= self.batch_size
+        if self.background:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _ensure_thread(self):
+        # A forked worker inherits the buffer but not the thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='chat-transcripts', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of turns written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                write_turns(batch)
+            except Exception as e:
+                logger.error(f"Error saving {len(batch)} chat turns: {str(e)}")
+                return self._write_one_by_one(batch)
+            return len(batch)
+
+    def _write_one_by_one(self, batch):
+        """
+        Retry a failed batch turn by turn so one bad row (e.g. an FK to a
+        deleted hospital) cannot block the rest. If no turn can be written
+        the database is likely down: keep everything for the next flush.
+        """
+        written, failed = 0, []
+        for turn in batch:
+            try:
+                write_turns([turn])
+            except Exception as e:
+                failed.append((turn, e))
+            else:
+                written += 1
+        if not written:
+            with self._lock:
+                self._pending = (batch + self._pending)[-self.max_pending:]
+            return 0
+        for turn, error in failed:
+            logger.error(f"Dropping chat turn for session {turn['session_key']}: {str(error)}")
+        return written
+
+    def close(self, timeout=5):
+        """Stop the flusher thread and write what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        return self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_transcript_buffer():
+    """Return the process-wide buffer, flushed at interpreter exit"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = TranscriptBuffer()
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def record_turn(*args, **kwargs):
+    get_transcript_buffer().record_turn(*args, **kwargs)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import whatsapp_views
@@ -6,7 +7,8 @@ app_name = 'chatbot'
 
 urlpatterns = [
     path('', views.chatbot_page, name='chat'),
-    path('stream/', views.chat_stream, name='stream'),
+    # Async streaming under ASGI so open chats don't pin a worker thread each
+    path('stream/', views.chat_stream_async if settings.CHAT_STREAM_ASYNC else views.chat_stream, name='stream'),
     path('location/', views.get_user_location, name='location'),
     path('hospitals/', views.get_all_hospitals, name='hospitals'),
     path('whatsapp/', whatsapp_views.whatsapp_webhook, name='whatsapp_webhook'),
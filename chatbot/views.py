@@ -3,59 +3,62 @@ from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
+import httpx
 import requests
 import re
 import time
-from adminapp.models import Doctor, Category
+import uuid
+from adminapp.models import Category
 from tenants.models import Hospital
-from geopy.distance import geodesic
-from geopy.geocoders import Nominatim
+from tenants.context import get_current_hospital
+from tenants.spatial import get_hospital_index
 import logging
 from .models import ChatSession
+from .ollama_client import get_ollama_client, OllamaResponseError
+from .streaming import sse_frame, TokenCoalescer
+from .keywords import scan
+from .specialty_matcher import match_specialty
+from .doctor_index import get_doctor_index
+from .transcripts import record_turn
+from .context_window import get_context_window
+from .response_cache import get_response_cache, response_cache_enabled, replay_chunks, areplay_chunks
 from django.contrib.auth.models import User
+from django.utils import timezone
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
-# Ollama API configuration
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "symptomwise"
-
 def get_fallback_response(user_message):
     """Provide structured fallback response when AI service is unavailable"""
     try:
-        user_lower = user_message.lower() if user_message else ""
-        
-        # Emergency keywords
-        emergency_keywords = [
-            'chest pain', 'heart attack', 'stroke', 'difficulty breathing', 
-            'severe pain', 'bleeding', 'unconscious', 'emergency'
-        ]
-        
-        if any(keyword in user_lower for keyword in emergency_keywords):
+        matches = scan(user_message or "")
+
+        if matches.has('fallback_emergency'):
             return "EMERGENCY DETECTED: Please call 108 immediately for emergency medical services. If you're experiencing severe symptoms, don't wait - seek immediate medical attention at the nearest hospital emergency room."
-        
+
         # Common symptoms with structured advice
-        if 'headache' in user_lower:
+        topic = matches.first('fallback_topic')
+        if topic == 'headache':
             return "I understand you're experiencing a headache. Here's what I can suggest:"
-        
-        elif 'fever' in user_lower:
+
+        elif topic == 'fever':
             return "I see you have a fever. Let me provide some guidance:"
-        
-        elif 'cough' in user_lower:
+
+        elif topic == 'cough':
             return "I understand you have a cough. Here are some recommendations:"
-        
-        elif 'dizzy' in user_lower or 'dizziness' in user_lower:
+
+        elif topic == 'dizzy':
             return "I'm sorry to hear that. It's possible you have low blood pressure or a problem with your inner ear. To help you better, could you please tell me what other symptoms you are feeling along with this?"
-        
-        elif any(word in user_lower for word in ['stomach', 'nausea', 'vomiting']):
+
+        elif topic == 'stomach':
             return "I understand you're having stomach issues. Here's what might help:"
-        
-        elif 'appointment' in user_lower or 'book' in user_lower:
+
+        elif topic == 'appointment':
             return "I can help you book an appointment with our healthcare professionals. Let me show you available options:"
-        
-        elif any(word in user_lower for word in ['better', 'fine', 'okay', 'good']):
+
+        elif topic == 'better':
             return "That's wonderful to hear! I'm glad you're feeling better."
-        
+
         else:
             return "I'm here to help with your health concerns. Please describe your symptoms and I'll provide appropriate guidance and recommendations."
     except Exception as e:
@@ -66,6 +69,68 @@ def chatbot_page(request):
     """Render the chatbot page"""
     return render(request, 'chatbot/chat.html')
 
+def transcript_owner(request, session_id, is_guest, user=None):
+    """
+    Keyword arguments identifying whose chat a turn belongs to, for
+    chatbot.transcripts.record_turn, or None if the turn cannot be attributed.
+    Async views pass ``user`` (from ``request.auser()``): touching the lazy
+    ``request.user`` there would load it synchronously.
+    """
+    if user is None:
+        user = getattr(request, 'user', None)
+    user_id = user.id if user is not None and user.is_authenticated and not is_guest else None
+    session_key = f'user_{user_id}' if user_id else session_id
+    # 'user_' keys belong to signed-in users; a guest cannot claim one
+    if not session_key or (not user_id and str(session_key).startswith('user_')):
+        return None
+    hospital = getattr(request, 'hospital', None) or get_current_hospital()
+    return {
+        'session_key': str(session_key)[:100],
+        'user_id': user_id,
+        'hospital_id': hospital.id if hospital else None,
+        'guest_identifier': request.META.get('REMOTE_ADDR', '') if not user_id else '',
+        'started_at': timezone.now(),
+    }
+
+def save_turn(owner, user_message, reply, recommendations, model_used, context_summary=None):
+    """Buffer a finished turn; the database write happens off the request path"""
+    if owner:
+        record_turn(
+            user_message=user_message, assistant_message=reply,
+            recommendations=recommendations, model_used=model_used,
+            context_summary=context_summary, **owner
+        )
+
+# request.session key holding the conversation the next prompt is built from
+CHAT_CONTEXT_KEY = 'chat_context'
+
+def load_conversation(stored):
+    """The stored conversation state, or a fresh one"""
+    if stored and stored.get('id'):
+        return stored
+    return {'id': uuid.uuid4().hex, 'turn': 0, 'summary': '', 'history': []}
+
+def plan_prompt(conversation, user_message):
+    """PromptPlan for the next message: recent turns and summary within num_ctx, or the cached Ollama context"""
+    return get_context_window().plan(
+        user_message,
+        history=conversation['history'],
+        summary=conversation['summary'],
+        key=conversation['id'],
+        turn=conversation['turn'],
+    )
+
+def advance_conversation(conversation, plan, user_message, reply, context=None):
+    """Conversation state after a finished turn; ``context`` is the array from Ollama's done chunk"""
+    turn = conversation['turn'] + 1
+    get_context_window().remember(conversation['id'], turn, context)
+    return {
+        'id': conversation['id'],
+        'turn': turn,
+        'summary': plan.summary,
+        'history': plan.history + [{'user': user_message, 'assistant': reply}],
+    }
+
 @csrf_exempt
 def chat_stream(request):
     """Handle streaming chat responses with improved session management"""
@@ -96,75 +161,103 @@ def chat_stream(request):
             else:
                 user_location = request.session.get('user_location', {})
         
+        owner = transcript_owner(request, session_id, is_guest)
+        conversation = load_conversation(request.session.get(CHAT_CONTEXT_KEY))
+        plan = plan_prompt(conversation, user_message)
+        # Captured now: the tenant ContextVar is reset before the stream is consumed
+        hospital = getattr(request, 'hospital', None) or get_current_hospital()
+        hospital_id = hospital.id if hospital else None
+        # Prompts continuing a cached Ollama context depend on more than their text
+        cacheable = not plan.options and response_cache_enabled(hospital)
+        
+        # The turn is saved from inside the stream, after SessionMiddleware has
+        # sent the headers: store the conversation now so a new visitor gets
+        # their session cookie with this response
+        request.session[CHAT_CONTEXT_KEY] = conversation
+        
+        def finish_turn(reply, recommendations, model_used, context=None):
+            """Store the new stage and conversation and buffer the turn for the database"""
+            state = advance_conversation(conversation, plan, user_message, reply, context)
+            request.session['conversation_stage'] = recommendations.get('conversation_stage', 'initial')
+            request.session[CHAT_CONTEXT_KEY] = state
+            # The session middleware has already run by the time the stream is consumed
+            request.session.save()
+            save_turn(owner, user_message, reply, recommendations, model_used, state['summary'])
+        
         # Generate streaming response
         def generate_response():
             try:
-                # Call Ollama API
-                payload = {
-                    "model": MODEL_NAME,
-                    "prompt": user_message,
-                    "stream": True
-                }
-                
-                # Try to connect to Ollama API with timeout
+                # Try to connect to Ollama API through the shared pooled client
                 try:
-                    response = requests.post(OLLAMA_API_URL, json=payload, stream=True, timeout=10)
+                    client = get_ollama_client()
+                    cached = get_response_cache().get(plan.prompt, client.model, hospital_id) if cacheable else None
+                    if cached is not None:
+                        chunks = replay_chunks(cached)
+                    else:
+                        chunks = client.stream(plan.prompt, **plan.options)
                     
-                    if response.status_code != 200:
-                        logger.warning(f"Ollama API returned status {response.status_code}")
-                        yield f"data: {json.dumps({'error': 'AI service temporarily unavailable', 'fallback_response': get_fallback_response(user_message)})}\\n\\n"
-                        return
+                except OllamaResponseError as e:
+                    logger.warning(f"Ollama API returned status {e.status_code}")
+                    yield sse_frame({'error': 'AI service temporarily unavailable', 'fallback_response': get_fallback_response(user_message)})
+                    return
                         
                 except requests.exceptions.RequestException as e:
                     logger.error(f"Ollama API connection failed: {str(e)}")
                     # Provide fallback response when Ollama is not available
                     fallback_response = get_fallback_response(user_message)
-                    yield f"data: {json.dumps({'token': fallback_response, 'fallback': True})}\\n\\n"
+                    yield sse_frame({'token': fallback_response, 'fallback': True})
                     
                     # Process fallback response for recommendations
                     conversation_stage = request.session.get('conversation_stage', 'initial')
-                    recommendations = process_medical_response(fallback_response, user_location, user_message, conversation_stage)
-                    request.session['conversation_stage'] = recommendations.get('conversation_stage', 'initial')
-                    yield f"data: {json.dumps({'recommendations': recommendations, 'done': True})}\\n\\n"
+                    recommendations = process_medical_response(fallback_response, user_location, user_message, conversation_stage, hospital_id)
+                    finish_turn(fallback_response, recommendations, 'fallback')
+                    yield sse_frame({'recommendations': recommendations, 'done': True})
                     return
                 
                 full_response = ""
                 
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            chunk = json.loads(line.decode('utf-8'))
-                            if 'response' in chunk:
-                                token = chunk['response']
-                                full_response += token
-                                
-                                # Send token to frontend
-                                yield f"data: {json.dumps({'token': token})}\\n\\n"
-                                
-                                # Add small delay for animation effect
-                                time.sleep(0.02)
-                                
-                            if chunk.get('done', False):
-                                # Get conversation stage from session
-                                conversation_stage = request.session.get('conversation_stage', 'initial')
-                                
-                                # Process the complete response for medical recommendations
-                                recommendations = process_medical_response(full_response, user_location, user_message, conversation_stage)
-                                
-                                # Update conversation stage in session
-                                request.session['conversation_stage'] = recommendations.get('conversation_stage', 'initial')
-                                
-                                yield f"data: {json.dumps({'recommendations': recommendations, 'done': True})}\\n\\n"
-                                break
-                                
-                        except json.JSONDecodeError:
-                            continue
-                            
+                coalescer = TokenCoalescer()
+                
+                for chunk in chunks:
+                    if 'response' in chunk:
+                        token = chunk['response']
+                        full_response += token
+                        
+                        # Send tokens to frontend as soon as a frame's worth is ready;
+                        # the typing animation is done client-side
+                        text = coalescer.push(token)
+                        if text:
+                            yield sse_frame({'token': text})
+                        
+                    if chunk.get('done', False):
+                        text = coalescer.flush()
+                        if text:
+                            yield sse_frame({'token': text})
+                        
+                        # Get conversation stage from session
+                        conversation_stage = request.session.get('conversation_stage', 'initial')
+                        
+                        # Process the complete response for medical recommendations
+                        recommendations = process_medical_response(full_response, user_location, user_message, conversation_stage, hospital_id)
+                        
+                        # Update conversation stage and history in session
+                        finish_turn(full_response, recommendations, client.model, chunk.get('context'))
+                        if cacheable and not chunk.get('cached'):
+                            get_response_cache().set(plan.prompt, client.model, full_response)
+                        
+                        yield sse_frame({'recommendations': recommendations, 'done': True})
+                        break
+
+                # Stream ended without a done chunk - don't drop buffered tokens
+                text = coalescer.flush()
+                if text:
+                    yield sse_frame({'token': text})
+
             except Exception as e:
                 logger.error(f"Error in chat stream: {str(e)}")
                 # Provide fallback response on any error
                 fallback_response = get_fallback_response(user_message)
-                yield f"data: {json.dumps({'error': 'Service temporarily unavailable', 'fallback_response': fallback_response})}\\n\\n"
+                yield sse_frame({'error': 'Service temporarily unavailable', 'fallback_response': fallback_response})
         
         return StreamingHttpResponse(
             generate_response(),
@@ -175,6 +268,131 @@ def chat_stream(request):
         logger.error(f"Error in chat_stream: {str(e)}")
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
+@csrf_exempt
+async def chat_stream_async(request):
+    """
+    Async twin of chat_stream for ASGI deployments.
+
+    Tokens are read from Ollama with httpx inside an async generator, so an
+    open chat holds no worker thread while the model is generating. Session
+    access uses the async session API and the ORM-heavy recommendation step
+    runs through sync_to_async.
+    """
+    if request.method == 'GET':
+        return JsonResponse({
+            'error': 'This endpoint only accepts POST requests for chat messages'
+        }, status=405)
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        user_message = data.get('message', '').strip()
+        user_location = data.get('location', {})
+        session_id = data.get('session_id')
+        is_guest = data.get('is_guest', True)
+
+        if not user_message:
+            return JsonResponse({'error': 'Message is required'}, status=400)
+
+        # Get stored location if not provided
+        if not user_location and session_id:
+            if is_guest:
+                user_location = await request.session.aget(f'guest_location_{session_id}', {})
+            else:
+                user_location = await request.session.aget('user_location', {})
+
+        user = await request.auser() if hasattr(request, 'auser') else None
+        owner = transcript_owner(request, session_id, is_guest, user)
+        conversation = load_conversation(await request.session.aget(CHAT_CONTEXT_KEY))
+        plan = plan_prompt(conversation, user_message)
+        # Captured now: the tenant ContextVar is reset before the stream is consumed
+        hospital = getattr(request, 'hospital', None) or get_current_hospital()
+        hospital_id = hospital.id if hospital else None
+        # Prompts continuing a cached Ollama context depend on more than their text
+        cacheable = not plan.options and response_cache_enabled(hospital)
+
+        # The turn is saved from inside the stream, after SessionMiddleware has
+        # sent the headers: store the conversation now so a new visitor gets
+        # their session cookie with this response
+        await request.session.aset(CHAT_CONTEXT_KEY, conversation)
+
+        async def recommendations_frame(response_text, model_used, context=None):
+            """Run the (sync, ORM-backed) recommendation step and persist the new stage and conversation"""
+            conversation_stage = await request.session.aget('conversation_stage', 'initial')
+            recommendations = await sync_to_async(process_medical_response)(
+                response_text, user_location, user_message, conversation_stage, hospital_id
+            )
+            state = advance_conversation(conversation, plan, user_message, response_text, context)
+            await request.session.aset('conversation_stage', recommendations.get('conversation_stage', 'initial'))
+            await request.session.aset(CHAT_CONTEXT_KEY, state)
+            # The session middleware has already run by the time the stream is consumed
+            await request.session.asave()
+            save_turn(owner, user_message, response_text, recommendations, model_used, state['summary'])
+            return sse_frame({'recommendations': recommendations, 'done': True})
+
+        async def generate_response():
+            try:
+                try:
+                    client = get_ollama_client()
+                    cached = get_response_cache().get(plan.prompt, client.model, hospital_id) if cacheable else None
+                    if cached is not None:
+                        chunks = areplay_chunks(cached)
+                    else:
+                        chunks = await client.astream(plan.prompt, **plan.options)
+
+                except OllamaResponseError as e:
+                    logger.warning(f"Ollama API returned status {e.status_code}")
+                    yield sse_frame({'error': 'AI service temporarily unavailable', 'fallback_response': get_fallback_response(user_message)})
+                    return
+
+                except httpx.HTTPError as e:
+                    logger.error(f"Ollama API connection failed: {str(e)}")
+                    fallback_response = get_fallback_response(user_message)
+                    yield sse_frame({'token': fallback_response, 'fallback': True})
+                    yield await recommendations_frame(fallback_response, 'fallback')
+                    return
+
+                full_response = ""
+                coalescer = TokenCoalescer()
+
+                async for chunk in chunks:
+                    if 'response' in chunk:
+                        token = chunk['response']
+                        full_response += token
+                        text = coalescer.push(token)
+                        if text:
+                            yield sse_frame({'token': text})
+
+                    if chunk.get('done', False):
+                        text = coalescer.flush()
+                        if text:
+                            yield sse_frame({'token': text})
+                        if cacheable and not chunk.get('cached'):
+                            get_response_cache().set(plan.prompt, client.model, full_response)
+                        yield await recommendations_frame(full_response, client.model, chunk.get('context'))
+                        break
+
+                # Stream ended without a done chunk - don't drop buffered tokens
+                text = coalescer.flush()
+                if text:
+                    yield sse_frame({'token': text})
+
+            except Exception as e:
+                logger.error(f"Error in async chat stream: {str(e)}")
+                fallback_response = get_fallback_response(user_message)
+                yield sse_frame({'error': 'Service temporarily unavailable', 'fallback_response': fallback_response})
+
+        return StreamingHttpResponse(
+            generate_response(),
+            content_type='text/event-stream'
+        )
+
+    except Exception as e:
+        logger.error(f"Error in chat_stream_async: {str(e)}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def get_user_location(request):
@@ -257,18 +475,11 @@ def get_user_location(request):
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 # Copy all the other functions from the original views.py
-def process_medical_response(response_text, user_location, user_message="", conversation_stage="initial"):
+def process_medical_response(response_text, user_location, user_message="", conversation_stage="initial", hospital_id=None):
     """Process the AI response and extract medical recommendations with structured output"""
     # Check if user is feeling better first - this should reset the conversation
-    feeling_better_keywords = [
-    'feel better', 'feeling better', 'i\'m better', 'better now', 'i feel better',
-    'feeling fine', 'i\'m fine', 'fine now', 'okay now', 'i am okay',
-    'resolved', 'no longer', 'not anymore', 'symptoms gone', 'much better',
-    'all good', 'recovered', 'back to normal', 'no more symptoms'
-]
-    
-    user_lower = user_message.lower()
-    is_feeling_better = any(keyword in user_lower for keyword in feeling_better_keywords)
+    user_matches = scan(user_message)
+    is_feeling_better = user_matches.has('feeling_better')
     
     # If user is feeling better, reset conversation and provide fresh greeting
     if is_feeling_better:
@@ -289,14 +500,7 @@ def process_medical_response(response_text, user_location, user_message="", conv
         }
     
     # Check for emergency keywords
-    emergency_keywords = [
-        'bleeding', 'blood', 'chest pain', 'heart attack', 'stroke', 'unconscious',
-        'difficulty breathing', 'severe pain', 'accident', 'injury', 'broken bone',
-        'head injury', 'poisoning', 'overdose', 'suicide', 'emergency', 'urgent',
-        'severe', 'critical', 'dying', 'death', 'ambulance', 'hospital now'
-    ]
-    
-    is_emergency = any(keyword in user_message.lower() for keyword in emergency_keywords)
+    is_emergency = user_matches.has('emergency')
     
     recommendations = {
         'specialty': None,
@@ -327,8 +531,7 @@ def process_medical_response(response_text, user_location, user_message="", conv
             return recommendations
         
         # Check if user wants to book appointment
-        appointment_keywords = ['book appointment', 'schedule appointment', 'see doctor', 'visit doctor', 'appointment', 'yes book', 'yes schedule']
-        wants_appointment = any(keyword in user_message.lower() for keyword in appointment_keywords)
+        wants_appointment = user_matches.has('appointment')
         
         if conversation_stage == "initial" and not wants_appointment:
             # Check urgency level first
@@ -353,10 +556,10 @@ def process_medical_response(response_text, user_location, user_message="", conv
                 recommendations['urgent_action'] = 'See a doctor within 24-48 hours'
                 
                 # Show doctors and hospitals
-                specialty = extract_specialty(response_text + " " + user_message)
+                specialty = extract_specialty(response_text + " " + user_message, hospital_id)
                 if specialty:
                     recommendations['specialty'] = specialty
-                    doctors = find_doctors_by_specialty(specialty, user_location)
+                    doctors = find_doctors_by_specialty(specialty, user_location, hospital_id)
                     recommendations['doctors'] = doctors
                 
                 hospitals = find_nearby_hospitals(user_location)
@@ -385,14 +588,14 @@ def process_medical_response(response_text, user_location, user_message="", conv
             
         elif wants_appointment or conversation_stage == "appointment_requested":
             # User wants appointment - show doctors and hospitals
-            specialty = extract_specialty(response_text + " " + user_message)
+            specialty = extract_specialty(response_text + " " + user_message, hospital_id)
             if specialty:
                 recommendations['specialty'] = specialty
-                doctors = find_doctors_by_specialty(specialty, user_location)
+                doctors = find_doctors_by_specialty(specialty, user_location, hospital_id)
                 recommendations['doctors'] = doctors
             else:
                 # If no specific specialty, show general practitioners
-                doctors = find_doctors_by_specialty('General Practitioner', user_location)
+                doctors = find_doctors_by_specialty('General Practitioner', user_location, hospital_id)
                 recommendations['doctors'] = doctors
             
             # Extract triage level
@@ -461,11 +664,9 @@ def extract_remedies(response_text, user_message):
     }
     
     # Check user message for symptoms
-    user_lower = user_message.lower()
-    for symptom, remedy_list in remedy_keywords.items():
-        if symptom in user_lower:
-            remedies.extend(remedy_list)
-            break
+    symptom = scan(user_message).first('remedy')
+    if symptom:
+        remedies.extend(remedy_keywords[symptom])
     
     # If no specific remedies found, provide general wellness tips
     if not remedies:
@@ -478,205 +679,67 @@ def extract_remedies(response_text, user_message):
     
     return remedies[:4]  # Return max 4 remedies
 
-def extract_specialty(text):
+def extract_specialty(text, hospital_id=None):
     """Extract recommended medical specialty from AI response"""
-    specialties_map = {
-        'cardiologist': 'Cardiologist',
-        'cardiology': 'Cardiologist', 
-        'heart': 'Cardiologist',
-        'cardiac': 'Cardiologist',
-        'chest pain': 'Cardiologist',
-        'neurologist': 'Neurologist',
-        'neurology': 'Neurologist',
-        'brain': 'Neurologist',
-        'nervous': 'Neurologist',
-        'headache': 'Neurologist',
-        'migraine': 'Neurologist',
-        'dizziness': 'Neurologist',
-        'seizure': 'Neurologist',
-        'orthopedic': 'Orthopedic Surgeon',
-        'orthopedist': 'Orthopedic Surgeon',
-        'bone': 'Orthopedic Surgeon',
-        'joint': 'Orthopedic Surgeon',
-        'fracture': 'Orthopedic Surgeon',
-        'back pain': 'Orthopedic Surgeon',
-        'knee pain': 'Orthopedic Surgeon',
-        'dermatologist': 'Dermatologist',
-        'dermatology': 'Dermatologist',
-        'skin': 'Dermatologist',
-        'rash': 'Dermatologist',
-        'acne': 'Dermatologist',
-        'eczema': 'Dermatologist',
-        'psychiatrist': 'Psychiatrist',
-        'psychiatry': 'Psychiatrist',
-        'mental': 'Psychiatrist',
-        'depression': 'Psychiatrist',
-        'anxiety': 'Psychiatrist',
-        'stress': 'Psychiatrist',
-        'ophthalmologist': 'Ophthalmologist',
-        'ophthalmology': 'Ophthalmologist',
-        'eye': 'Ophthalmologist',
-        'vision': 'Ophthalmologist',
-        'blurred vision': 'Ophthalmologist',
-        'general practitioner': 'General Practitioner',
-        'gp': 'General Practitioner',
-        'family doctor': 'General Practitioner',
-        'fever': 'General Practitioner',
-        'cold': 'General Practitioner',
-        'flu': 'General Practitioner',
-        'cough': 'General Practitioner'
-    }
-    
-    text_lower = text.lower()
-    for keyword, specialty in specialties_map.items():
-        if keyword in text_lower:
-            return specialty
-    
-    return None
+    return match_specialty(text, hospital_id=hospital_id)
 
 def extract_triage_level(text):
     """Enhanced triage level extraction with comprehensive symptom analysis"""
-    text_lower = text.lower()
-    
-    # URGENT/EMERGENCY symptoms - Require immediate medical attention
-    urgent_keywords = [
-        # Cardiovascular emergencies
-        'chest pain', 'heart attack', 'cardiac arrest', 'severe chest pressure',
-        'crushing chest pain', 'radiating arm pain', 'jaw pain with chest',
-        
-        # Respiratory emergencies
-        'difficulty breathing', 'can\'t breathe', 'choking', 'gasping for air',
-        'severe shortness of breath', 'blue lips', 'blue fingernails',
-        
-        # Neurological emergencies
-        'stroke', 'sudden weakness', 'facial drooping', 'slurred speech',
-        'severe headache', 'worst headache ever', 'sudden confusion',
-        'loss of consciousness', 'unconscious', 'seizure', 'convulsions',
-        
-        # Trauma and bleeding
-        'severe bleeding', 'heavy bleeding', 'bleeding heavily', 'hemorrhage',
-        'head injury', 'broken bone', 'compound fracture', 'severe trauma',
-        
-        # Poisoning and overdose
-        'poisoning', 'overdose', 'toxic', 'swallowed poison',
-        
-        # Severe pain
-        'severe pain', 'excruciating pain', 'unbearable pain', '10/10 pain',
-        'severe abdominal pain', 'appendicitis symptoms',
-        
-        # Other emergencies
-        'suicide', 'suicidal thoughts', 'want to die', 'emergency',
-        'critical', 'dying', 'life threatening', 'ambulance needed',
-        'vomiting blood', 'coughing blood', 'blood in stool',
-        'severe allergic reaction', 'anaphylaxis', 'swollen throat'
-    ]
-    
-    # SEMI-URGENT symptoms - Need medical attention within 24-48 hours
-    semi_urgent_keywords = [
-        # Persistent symptoms
-        'persistent fever', 'fever for days', 'high fever', 'fever above 102',
-        'persistent vomiting', 'vomiting for hours', 'severe nausea',
-        'persistent diarrhea', 'severe diarrhea', 'dehydration',
-        
-        # Respiratory issues
-        'severe cough', 'coughing for weeks', 'shortness of breath',
-        'wheezing', 'chest tightness',
-        
-        # Pain and discomfort
-        'moderate pain', 'persistent headache', 'severe headache',
-        'migraine', 'back pain severe', 'joint pain severe',
-        
-        # Infections and inflammation
-        'infection', 'infected wound', 'rash spreading', 'severe rash',
-        'swelling', 'inflammation', 'red streaks', 'pus',
-        
-        # Digestive issues
-        'severe stomach pain', 'abdominal pain', 'difficulty swallowing',
-        'blood in urine', 'painful urination',
-        
-        # Mental health urgent
-        'severe depression', 'panic attacks', 'severe anxiety',
-        
-        # Other semi-urgent
-        'dizziness severe', 'fainting', 'irregular heartbeat',
-        'vision problems', 'sudden vision loss', 'eye injury',
-        'worsening', 'getting worse', 'not improving',
-        'need to see doctor', 'should see doctor', '24-48 hours'
-    ]
-    
+    matches = scan(text)
+
     # Check for urgent symptoms first
-    if any(keyword in text_lower for keyword in urgent_keywords):
+    if matches.has('urgent'):
         return 'URGENT'
-    elif any(keyword in text_lower for keyword in semi_urgent_keywords):
+    elif matches.has('semi_urgent'):
         return 'SEMI-URGENT'
     else:
         return 'ROUTINE'
 
-def find_doctors_by_specialty(specialty, user_location):
+def find_doctors_by_specialty(specialty, user_location, hospital_id=None):
     """Find doctors matching the specialty with safe JSON serialization"""
     try:
-        # Find doctors with matching bio or category
-        doctors = Doctor.objects.filter(
-            bio__icontains=specialty,
-            is_available=True
-        ).select_related('category', 'hospital')[:5]
-        
-        if not doctors:
-            # Try to find by category name
-            doctors = Doctor.objects.filter(
-                category__name__icontains=specialty,
-                is_available=True
-            ).select_related('category', 'hospital')[:5]
-        
-        doctor_list = []
-        for doctor in doctors:
-            try:
-                # Safe field access with proper type conversion
-                doctor_data = {
-                    'id': doctor.id,
-                    'name': doctor.full_name,
-                    'specialty': doctor.bio or (doctor.category.name if doctor.category else 'General Medicine'),
-                    'experience': f"{doctor.experience_years} Years" if hasattr(doctor, 'experience_years') and doctor.experience_years else 'Experienced',
-                    'hospital': doctor.hospital.name if doctor.hospital else 'Unknown Hospital',
-                    'consultation_fee': float(doctor.consultation_fee) if doctor.consultation_fee else 500.0,
-                    'image': doctor.profile_image.url if doctor.profile_image else None
-                }
-                doctor_list.append(doctor_data)
-            except Exception as doctor_error:
-                logger.error(f"Error processing doctor {doctor.id}: {str(doctor_error)}")
-                # Skip this doctor and continue with others
-                continue
-        
-        return doctor_list
+        # Ranked doctors whose bio, category or specialty matches, from the in-memory index;
+        # on a hospital's subdomain only that hospital's doctors are recommended
+        return get_doctor_index().find(specialty, limit=5, hospital_id=hospital_id)
         
     except Exception as e:
         logger.error(f"Error finding doctors: {str(e)}")
         return []
 
+def get_user_coordinates(user_location):
+    """Return (latitude, longitude) from a browser location dict, or None"""
+    if not isinstance(user_location, dict):
+        return None
+    try:
+        latitude = float(user_location['latitude'])
+        longitude = float(user_location['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+def get_hospitals_by_distance(user_location, limit):
+    """Closest active hospitals first (with distance in km), then ones without coordinates"""
+    index = get_hospital_index()
+    coordinates = get_user_coordinates(user_location)
+    if not coordinates:
+        return [dict(entry, distance=None) for entry in index.hospitals[:limit]]
+
+    hospital_list = [
+        dict(entry, distance=round(distance, 2))
+        for distance, entry in index.nearest(coordinates[0], coordinates[1], limit)
+    ]
+    for entry in index.unlocated[:limit - len(hospital_list)]:
+        hospital_list.append(dict(entry, distance=None))
+    return hospital_list
+
 def get_emergency_hospitals(user_location):
     """Get hospitals with emergency contact info"""
     try:
-        hospitals = Hospital.objects.filter(is_active=True)[:3]  # Top 3 for emergency
-        
-        hospital_list = []
-        for hospital in hospitals:
-            try:
-                # Safe field access with proper type conversion
-                hospital_data = {
-                    'id': str(hospital.id),
-                    'name': hospital.name,
-                    'address': hospital.address,
-                    'city': hospital.city,
-                    'state': hospital.state,
-                    'phone': str(hospital.phone) if hospital.phone else 'Contact hospital directly',
-                    'website': hospital.website if hospital.website else '',
-                    'emergency': True
-                }
-                hospital_list.append(hospital_data)
-            except Exception as hospital_error:
-                logger.error(f"Error processing hospital {hospital.id}: {str(hospital_error)}")
-                continue
-        
+        hospital_list = get_hospitals_by_distance(user_location, 3)  # Top 3 for emergency
+        for hospital_data in hospital_list:
+            hospital_data['emergency'] = True
         return hospital_list
         
     except Exception as e:
@@ -686,41 +749,7 @@ def get_emergency_hospitals(user_location):
 def find_nearby_hospitals(user_location):
     """Find hospitals near user location"""
     try:
-        hospitals = Hospital.objects.filter(is_active=True)
-        
-        hospital_list = []
-        for hospital in hospitals:
-            try:
-                # Safe field access with proper type conversion
-                hospital_data = {
-                    'id': str(hospital.id),
-                    'name': hospital.name,
-                    'address': hospital.address,
-                    'city': hospital.city,
-                    'state': hospital.state,
-                    'phone': str(hospital.phone) if hospital.phone else 'Contact hospital directly',
-                    'website': hospital.website if hospital.website else '',
-                    'distance': 0  # Default distance
-                }
-                
-                # Simple location-based sorting (prioritize hospitals with 'JP' in name if user location available)
-                if user_location and 'latitude' in user_location:
-                    # Prioritize JP Hospital if it exists
-                    if 'jp' in hospital.name.lower() or 'jp hospital' in hospital.name.lower():
-                        hospital_data['distance'] = -1  # Negative to sort first
-                    else:
-                        hospital_data['distance'] = 1
-                
-                hospital_list.append(hospital_data)
-            except Exception as hospital_error:
-                logger.error(f"Error processing hospital {hospital.id}: {str(hospital_error)}")
-                continue
-        
-        # Sort by distance (JP hospitals first if location enabled)
-        if user_location and 'latitude' in user_location:
-            hospital_list.sort(key=lambda x: x['distance'])
-        
-        return hospital_list[:5]  # Return top 5
+        return get_hospitals_by_distance(user_location, 5)  # Return top 5
         
     except Exception as e:
         logger.error(f"Error finding hospitals: {str(e)}")
@@ -758,21 +787,7 @@ def search_youtube_videos(text):
 
 def extract_medical_keywords(text):
     """Extract medical keywords from text"""
-    # Simple keyword extraction - in production, use NLP
-    medical_terms = [
-        'headache', 'fever', 'cough', 'chest pain', 'back pain',
-        'diabetes', 'hypertension', 'asthma', 'arthritis', 'depression',
-        'anxiety', 'migraine', 'allergies', 'infection', 'inflammation'
-    ]
-    
-    found_keywords = []
-    text_lower = text.lower()
-    
-    for term in medical_terms:
-        if term in text_lower:
-            found_keywords.append(term)
-    
-    return found_keywords
+    return scan(text).values('medical_term')
 
 @require_http_methods(["GET"])
 def get_all_hospitals(request):
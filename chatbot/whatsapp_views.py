@@ -2,12 +2,24 @@ from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
+from django.utils import timezone
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
 import json
 import requests
 import logging
+import threading
 import time
+from datetime import timedelta
+
+from .ollama_client import get_ollama_client, OllamaResponseError
+from .keywords import scan
+from .doctor_index import get_doctor_index
+from .session_store import create_session_store
+from .whatsapp_worker import get_dispatcher
+from .context_window import get_context_window, pair_entries, format_turn
+from .response_cache import get_response_cache, response_cache_enabled
+from tenants.context import get_current_hospital
 
 try:
     from adminapp.models import Doctor, Category
@@ -73,74 +85,119 @@ except Exception as e:
             return type('MockMessage', (object,), {'sid': 'SM_MOCK'})()
     client = MockTwilioClient()
 
-user_sessions = {}
+# Conversation entries kept in the session; older ones are folded into session['summary']
+MAX_SESSION_HISTORY = 20
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Return the process-wide WhatsApp session store"""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = create_session_store(on_evict=flush_whatsapp_session)
+    return _session_store
+
+def flush_whatsapp_session(session_key, session):
+    """Persist an idle conversation to ChatSession.user_preferences when it is evicted"""
+    if not (ChatSession and session.get('chat_session_id')):
+        return
+    chat_session = ChatSession.objects.filter(id=session['chat_session_id']).first()
+    if not chat_session:
+        return
+    preferences = chat_session.user_preferences or {}
+    preferences['location'] = session.get('location')
+    preferences['whatsapp'] = {
+        'state': session.get('state'),
+        'question_count': session.get('question_count', 0),
+        'conversation_history': session.get('conversation_history', [])[-MAX_SESSION_HISTORY:],
+        'summary': session.get('summary', ''),
+    }
+    chat_session.user_preferences = preferences
+    if chat_session.is_guest:
+        # Still in use: keep it clear of the retention sweep (chatbot/retention.py)
+        chat_session.expires_at = timezone.now() + timedelta(days=chat_session.context_days)
+    chat_session.save(update_fields=['user_preferences', 'last_activity', 'expires_at'])
+    logger.info(f"Flushed idle WhatsApp session for {session_key}")
 
 def get_or_create_whatsapp_session(phone_number):
     session_key = phone_number.replace('whatsapp:', '')
+
+    session_data = get_session_store().load(session_key)
+    if session_data is not None:
+        return session_data
     
     if WhatsAppSession and ChatSession:
         try:
-            whatsapp_session = WhatsAppSession.objects.filter(phone_number=session_key).first()
+            whatsapp_session = WhatsAppSession.objects.filter(phone_number=session_key).select_related('chat_session').first()
             if whatsapp_session:
                 chat_session = whatsapp_session.chat_session
+                flushed = chat_session.user_preferences.get('whatsapp', {})
                 session_data = {
-                    'state': 'welcome',
+                    'state': flushed.get('state') or 'welcome',
+                    'question_count': flushed.get('question_count', 0),
                     'location': chat_session.user_preferences.get('location'),
-                    'conversation_history': [],
+                    'conversation_history': flushed.get('conversation_history', []),
+                    'summary': flushed.get('summary', ''),
                     'whatsapp_session_id': whatsapp_session.id,
                     'chat_session_id': chat_session.id
                 }
-                user_sessions[session_key] = session_data
                 logger.info(f"Loaded existing WhatsApp session for {session_key} with location: {session_data.get('location')}")
                 return session_data
         except Exception as e:
             logger.warning(f"Could not load WhatsApp session from database: {str(e)}")
     
-    if session_key not in user_sessions:
-        session_data = {
-            'state': 'welcome',
-            'location': None,
-            'conversation_history': [],
-            'whatsapp_session_id': None,
-            'chat_session_id': None
-        }
-        
-        if WhatsAppSession and ChatSession:
-            try:
-                chat_session = ChatSession.objects.create(
-                    session_id=f'whatsapp_{session_key}_{int(time.time())}',
-                    is_guest=True,
-                    guest_identifier=session_key,
-                    user_preferences={'location': None}
-                )
-                
-                whatsapp_session = WhatsAppSession.objects.create(
-                    phone_number=session_key,
-                    chat_session=chat_session
-                )
-                
-                session_data['whatsapp_session_id'] = whatsapp_session.id
-                session_data['chat_session_id'] = chat_session.id
-                
-                logger.info(f"Created new WhatsApp session for {session_key}")
-            except Exception as e:
-                logger.warning(f"Could could not create WhatsApp session in database: {str(e)}")
-        
-        user_sessions[session_key] = session_data
+    session_data = {
+        'state': 'welcome',
+        'location': None,
+        'conversation_history': [],
+        'whatsapp_session_id': None,
+        'chat_session_id': None
+    }
     
-    return user_sessions[session_key]
+    if WhatsAppSession and ChatSession:
+        try:
+            chat_session = ChatSession.objects.create(
+                session_id=f'whatsapp_{session_key}_{int(time.time())}',
+                is_guest=True,
+                guest_identifier=session_key,
+                user_preferences={'location': None}
+            )
+            
+            whatsapp_session = WhatsAppSession.objects.create(
+                phone_number=session_key,
+                chat_session=chat_session
+            )
+            
+            session_data['whatsapp_session_id'] = whatsapp_session.id
+            session_data['chat_session_id'] = chat_session.id
+            
+            logger.info(f"Created new WhatsApp session for {session_key}")
+        except Exception as e:
+            logger.warning(f"Could could not create WhatsApp session in database: {str(e)}")
+    
+    return session_data
 
-def save_location_to_session(phone_number, location):
+def save_whatsapp_session(phone_number, session):
+    session_key = phone_number.replace('whatsapp:', '')
+    history = session.get('conversation_history')
+    if history and len(history) > MAX_SESSION_HISTORY:
+        session['summary'] = get_context_window().fold_summary(
+            session.get('summary', ''), pair_entries(history[:-MAX_SESSION_HISTORY])
+        )
+        session['conversation_history'] = history[-MAX_SESSION_HISTORY:]
+    get_session_store().save(session_key, session)
+
+def save_location_to_session(phone_number, location, session):
     session_key = phone_number.replace('whatsapp:', '')
-    session = user_sessions.get(session_key, {})
-    
     session['location'] = location
-    user_sessions[session_key] = session
     
     if WhatsAppSession and ChatSession and session.get('chat_session_id'):
         try:
             chat_session = ChatSession.objects.get(id=session['chat_session_id'])
-            chat_session.user_preferences = {'location': location}
+            chat_session.user_preferences = {**chat_session.user_preferences, 'location': location}
             chat_session.save()
             logger.info(f"Saved location to database for {session_key}: {location}")
         except Exception as e:
@@ -152,12 +209,16 @@ def whatsapp_webhook(request):
     try:
         from_number = request.POST.get('From', '')
         message_body = request.POST.get('Body', '').strip()
+        message_sid = request.POST.get('MessageSid', '')
         
         response = MessagingResponse()
         
-        reply_text = process_whatsapp_message(from_number, message_body)
-        
-        response.message(reply_text)
+        if getattr(settings, 'WHATSAPP_WEBHOOK_ASYNC', True):
+            # Acknowledge Twilio now; the reply is sent by the background worker
+            get_dispatcher(reply_to_whatsapp_message).submit(from_number, message_body, message_sid)
+        else:
+            reply_text = process_whatsapp_message(from_number, message_body)
+            response.message(reply_text)
         
         return HttpResponse(str(response), content_type='text/xml')
         
@@ -167,7 +228,13 @@ def whatsapp_webhook(request):
         response.message("❌ Sorry, a critical error occurred. Please try again later.")
         return HttpResponse(str(response), content_type='text/xml')
 
+def reply_to_whatsapp_message(from_number, message_body):
+    """Background worker entry point: run the conversation and send the reply"""
+    reply_text = process_whatsapp_message(from_number, message_body)
+    send_whatsapp_message(from_number.replace('whatsapp:', ''), reply_text)
+
 def process_whatsapp_message(from_number, message_body):
+    session = None
     try:
         session = get_or_create_whatsapp_session(from_number)
         session_key = from_number.replace('whatsapp:', '')
@@ -177,7 +244,8 @@ def process_whatsapp_message(from_number, message_body):
             session.update({
                 'state': 'welcome',
                 'location': location_memory,
-                'conversation_history': []
+                'conversation_history': [],
+                'summary': ''
             })
             return "Session reset. " + handle_welcome_state(session_key, 'hi', session)
         
@@ -186,6 +254,7 @@ def process_whatsapp_message(from_number, message_body):
             session.update({
                 'state': 'welcome' if not location_memory else 'chatting',
                 'conversation_history': [],
+                'summary': '',
                 'question_count': 0
             })
             
@@ -212,6 +281,9 @@ def process_whatsapp_message(from_number, message_body):
     except Exception as e:
         logger.error(f"Error processing WhatsApp message for {from_number}: {str(e)}")
         return "Sorry, I encountered an internal error. Please try again later."
+    finally:
+        if session is not None:
+            save_whatsapp_session(from_number, session)
 
 def handle_welcome_state(from_number, message_body, session):
     greetings = ['hi', 'hello', 'hey', 'start', 'hola']
@@ -233,7 +305,7 @@ def handle_welcome_state(from_number, message_body, session):
         session['state'] = 'chatting'
         if not session.get('location'):
             session['location'] = 'Gorakhpur'
-            save_location_to_session(from_number, 'Gorakhpur')
+            save_location_to_session(from_number, 'Gorakhpur', session)
         session['question_count'] = 0
         return handle_chat_state(from_number, message_body, session)
 
@@ -243,7 +315,7 @@ def handle_location_state(from_number, message_body, session):
     else:
         session['location'] = message_body.strip().title()
     
-    save_location_to_session(from_number, session['location'])
+    save_location_to_session(from_number, session['location'], session)
     
     session['state'] = 'chatting'
     session['question_count'] = 0
@@ -254,18 +326,7 @@ def handle_location_state(from_number, message_body, session):
 
 def handle_chat_state(from_number, message_body, session):
     try:
-        emergency_keywords = [
-            'bleeding', 'blood', 'chest pain', 'heart attack', 'stroke', 'unconscious',
-            'difficulty breathing', 'severe pain', 'accident', 'injury', 'broken bone',
-            'head injury', 'poisoning', 'overdose', 'suicide', 'emergency', 'urgent',
-            'severe', 'critical', 'dying', 'death', 'ambulance', 'hospital now',
-            'can\'t breathe', 'choking', 'seizure', 'convulsion', 'paralysis',
-            'severe bleeding', 'heavy bleeding', 'vomiting blood', 'coughing blood',
-            'severe headache', 'worst headache', 'sudden headache', 'blurred vision',
-            'loss of consciousness', 'fainting', 'collapsed', 'not responding'
-        ]
-        
-        is_emergency = any(keyword in message_body.lower() for keyword in emergency_keywords)
+        is_emergency = scan(message_body).has('whatsapp_emergency')
         
         if is_emergency:
             return handle_emergency(session)
@@ -437,37 +498,41 @@ def get_ai_response(message, session):
         # Improved Prompt Engineering (sending conversation history as context)
         conversation_history = session.get('conversation_history', [])
         
-        # Limit history to prevent excessive tokens
-        history_summary = " ".join([entry.get('user', '') for entry in conversation_history[-3:]])
+        instructions = (
+            f"User's symptoms: {message}. "
+            f"Analyze and provide ONLY: 1. Brief, cautious summary (max 3 sentences). 2. Triage (URGENT/SEMI-URGENT/ROUTINE). 3. Suggested medical specialty."
+        )
+        
+        # Recent turns that fit num_ctx next to the instructions, plus the rolling summary of older ones
+        history, summary = get_context_window().fit(
+            pair_entries(conversation_history), session.get('summary', ''), instructions
+        )
+        history_summary = "\n".join([summary] + [format_turn(turn) for turn in history]).strip()
 
         full_prompt = (
             f"Role: SymptomWise AI (concise, non-diagnostic). Location: {session.get('location', 'Not set')}. "
             f"Prior Context: {history_summary}. "
-            f"User's symptoms: {message}. "
-            f"Analyze and provide ONLY: 1. Brief, cautious summary (max 3 sentences). 2. Triage (URGENT/SEMI-URGENT/ROUTINE). 3. Suggested medical specialty."
+            f"{instructions}"
         )
 
-        payload = {
-            "model": "symptomwise",
-            "prompt": full_prompt,
-            "stream": False
-        }
-        
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get('response', 'I apologize, but I cannot process your request right now.')
-        else:
-            logger.error(f"Ollama API error: Status {response.status_code}, Response: {response.text}")
-            return "I'm having trouble connecting to my medical knowledge base. Please try again."
+        client = get_ollama_client()
+        # The worker runs under the tenant the message arrived on (see whatsapp_worker.py)
+        hospital = get_current_hospital()
+        cache = get_response_cache() if response_cache_enabled(hospital) else None
+        cached = cache.get(full_prompt, client.model, hospital.id if hospital else None) if cache else None
+        if cached is not None:
+            return cached
+
+        result = client.generate(full_prompt)
+        if cache and result.get('response'):
+            cache.set(full_prompt, client.model, result['response'])
+        return result.get('response', 'I apologize, but I cannot process your request right now.')
             
+    except OllamaResponseError as e:
+        logger.error(f"Ollama API error: Status {e.status_code}, Response: {e.text}")
+        return "I'm having trouble connecting to my medical knowledge base. Please try again."
     except requests.exceptions.ConnectionError:
-        logger.error("Ollama connection error: Is http://localhost:11434/api/generate running?")
+        logger.error(f"Ollama connection error: Is {get_ollama_client().generate_url} running?")
         return "I'm experiencing technical difficulties. My AI core is offline. Please try again later."
     except Exception as e:
         logger.error(f"Error getting AI response: {str(e)}")
@@ -533,11 +598,9 @@ def extract_remedies_whatsapp(user_message):
         ]
     }
     
-    user_lower = user_message.lower()
-    for symptom, remedy_list in remedy_keywords.items():
-        if symptom in user_lower:
-            remedies.extend(remedy_list)
-            break
+    symptom = scan(user_message).first('whatsapp_remedy')
+    if symptom:
+        remedies.extend(remedy_keywords[symptom])
     
     if not remedies:
         remedies = [
@@ -550,97 +613,38 @@ def extract_remedies_whatsapp(user_message):
     return remedies[:3]
 
 def extract_triage_level_whatsapp(text):
-    text_lower = text.lower()
-    
-    urgent_keywords = [
-        'chest pain', 'heart attack', 'severe chest pressure', 'difficulty breathing', 'can\'t breathe', 'choking',
-        'stroke', 'sudden weakness', 'facial drooping', 'slurred speech', 'severe headache', 'loss of consciousness', 
-        'unconscious', 'seizure', 'severe bleeding', 'heavy bleeding', 'broken bone', 'poisoning', 'overdose', 
-        'suicide', 'critical', 'dying', 'ambulance needed', 'vomiting blood', 'coughing blood', 'severe allergic reaction'
-    ]
-    
-    semi_urgent_keywords = [
-        'persistent fever', 'fever for days', 'high fever', 'severe cough', 'wheezing', 'chest tightness', 
-        'persistent vomiting', 'severe diarrhea', 'dehydration', 'moderate pain', 'persistent headache', 
-        'migraine', 'infection', 'rash spreading', 'swelling', 'dizziness severe', 'fainting', 'irregular heartbeat',
-        'vision problems', 'worsening', 'not improving', 'should see doctor', '24-48 hours'
-    ]
-    
-    if any(keyword in text_lower for keyword in urgent_keywords):
+    matches = scan(text)
+
+    if matches.has('whatsapp_urgent'):
         return 'URGENT'
-    elif any(keyword in text_lower for keyword in semi_urgent_keywords):
+    elif matches.has('whatsapp_semi_urgent'):
         return 'SEMI-URGENT'
     else:
         return 'ROUTINE'
 
 def extract_specialty_whatsapp(text):
-    text_lower = text.lower()
-    
-    specialties_map = {
-        'cardiologist': 'Cardiologist', 'heart': 'Cardiologist', 
-        'neurologist': 'Neurologist', 'brain': 'Neurologist', 'stroke': 'Neurologist',
-        'orthopedic': 'Orthopedic Surgeon', 'bone': 'Orthopedic Surgeon', 
-        'dermatologist': 'Dermatologist', 'skin': 'Dermatologist', 
-        'psychiatrist': 'Psychiatrist', 'mental': 'Psychiatrist', 
-        'ophthalmologist': 'Ophthalmologist', 'eye': 'Ophthalmologist', 
-        'gastroenterologist': 'Gastroenterologist', 'stomach': 'Gastroenterologist', 
-        'dentist': 'Dentist', 
-        'general practitioner': 'General Practitioner', 'fever': 'General Practitioner', 'cold': 'General Practitioner'
-    }
-    
-    for keyword, specialty in specialties_map.items():
-        if keyword in text_lower:
-            return specialty
-        
-    return 'General Practitioner'
+    return scan(text).first('whatsapp_specialty', 'General Practitioner')
 
 def find_doctors_by_specialty_whatsapp(specialty, user_location):
     try:
-        if not specialty or not hasattr(Doctor, 'objects'):
+        if not specialty:
             return []
-            
-        doctor_list = []
-        
-        try:
-            if hasattr(Category, 'objects'):
-                category_obj = Category.objects.get(name__iexact=specialty)
-                filters = {'category': category_obj, 'is_available': True}
-                
-                if user_location and user_location.lower() not in ['skip', 'unknown']:
-                    filters['hospital__city__iexact'] = user_location
 
-                doctors = Doctor.objects.filter(**filters).select_related('category', 'hospital').order_by('-experience_years')[:3]
-            else:
-                doctors = []
-        except (Category.DoesNotExist, AttributeError):
-            try:
-                filters = {'bio__icontains': specialty, 'is_available': True}
-                if user_location and user_location.lower() not in ['skip', 'unknown']:
-                    filters['hospital__city__iexact'] = user_location
-                    
-                doctors = Doctor.objects.filter(**filters).select_related('category', 'hospital').order_by('-experience_years')[:3]
-            except Exception:
-                doctors = []
-        
-        for doctor in doctors:
-            try:
-                name = getattr(doctor, 'full_name', 'Unknown Doctor')
-                bio = getattr(doctor, 'bio', '')
-                category = getattr(doctor, 'category', None)
-                hospital = getattr(doctor, 'hospital', None)
-                experience = getattr(doctor, 'experience_years', 0)
-                
-                doctor_data = {
-                    'name': name,
-                    'specialty': bio or (category.name if category else specialty), 
-                    'experience': f"{experience} Years" if experience else 'Experienced',
-                    'hospital': hospital.name if hospital else 'Unknown Hospital',
-                    'phone': str(hospital.phone) if hospital and hasattr(hospital, 'phone') and hospital.phone else 'N/A'
-                }
-                doctor_list.append(doctor_data)
-            except Exception as doctor_error:
-                logger.error(f"Error processing doctor: {str(doctor_error)}")
-                continue
+        city = None
+        if user_location and user_location.lower() not in ['skip', 'unknown']:
+            city = user_location
+
+        # The worker restores the tenant the message arrived on (see whatsapp_worker.py)
+        hospital = get_current_hospital()
+        doctor_list = []
+        for doctor in get_doctor_index().find(specialty, limit=3, hospital_id=hospital.id if hospital else None, city=city):
+            doctor_list.append({
+                'name': doctor['name'],
+                'specialty': doctor['specialty'],
+                'experience': doctor['experience'],
+                'hospital': doctor['hospital'],
+                'phone': doctor['hospital_phone']
+            })
         
         return doctor_list
         
@@ -0,0 +1,129 @@
+"""
+Background processing of inbound WhatsApp messages.
+
+The webhook hands each message to a ``WhatsAppDispatcher`` and acknowledges
+Twilio straight away; a thread pool runs the conversation state machine and
+the Ollama call, then sends the reply through the Twilio REST API.
+
+* Ordering: messages from one phone number are processed one at a time in
+  arrival order (per worker process); different numbers run in parallel.
+* Dedupe: Twilio retries a webhook it considers failed. Each MessageSid is
+  claimed by inserting a ``WhatsAppMessageReceipt`` row; its unique
+  constraint makes a retry fail to insert, whichever worker receives it,
+  and the retry is dropped. Receipts older than ``dedupe_ttl`` seconds are
+  pruned at most once a minute per process.
+* Tenant: the hospital current when a message is submitted is restored
+  around its handler in the worker thread (see ``tenants/context.py``).
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from tenants.context import get_current_hospital, tenant_context
+
+logger = logging.getLogger(__name__)
+
+# Seconds between deletions of expired MessageSid receipts
+PRUNE_INTERVAL = 60
+
+
+class WhatsAppDispatcher:
+    def __init__(self, handler, max_workers=4, dedupe_ttl=3600):
+        self.handler = handler
+        self.dedupe_ttl = dedupe_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='whatsapp')
+        self._queues = {}  # phone -> deque of pending (body, hospital); present while a drain task runs
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pruned_at = None
+
+    def is_duplicate(self, message_sid):
+        if not message_sid:
+            return False
+        from .models import WhatsAppMessageReceipt
+
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                WhatsAppMessageReceipt.objects.create(message_sid=message_sid, received_at=now)
+        except IntegrityError:
+            return True
+        self._prune_receipts(now)
+        return False
+
+    def _prune_receipts(self, now):
+        from .models import WhatsAppMessageReceipt
+
+        if self._pruned_at is not None and time.monotonic() - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = time.monotonic()
+        WhatsAppMessageReceipt.objects.filter(
+            received_at__lt=now - datetime.timedelta(seconds=self.dedupe_ttl)
+        ).delete()
+
+    def submit(self, from_number, message_body, message_sid=None):
+        """Queue a message; returns False if it was a duplicate delivery"""
+        if self.is_duplicate(message_sid):
+            logger.info(f"Ignoring duplicate WhatsApp message {message_sid} from {from_number}")
+            return False
+
+        message = (message_body, get_current_hospital())
+        with self._lock:
+            queue = self._queues.get(from_number)
+            if queue is not None:
+                # A drain task for this phone is running and will pick it up in order
+                queue.append(message)
+                return True
+            self._queues[from_number] = deque([message])
+        self.executor.submit(self._drain, from_number)
+        return True
+
+    def _drain(self, from_number):
+        while True:
+            with self._lock:
+                queue = self._queues[from_number]
+                if not queue:
+                    del self._queues[from_number]
+                    self._idle.notify_all()
+                    return
+                message_body, hospital = queue.popleft()
+            try:
+                with tenant_context(hospital):
+                    self.handler(from_number, message_body)
+            except Exception as e:
+                logger.error(f"Error handling WhatsApp message from {from_number}: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued message has been handled (used by tests and shutdown)"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._queues, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(handler):
+    """Return the process-wide dispatcher, creating it with ``handler`` on first use"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = WhatsAppDispatcher(
+                    handler,
+                    max_workers=getattr(settings, 'WHATSAPP_WORKERS', 4),
+                    dedupe_ttl=getattr(settings, 'WHATSAPP_DEDUPE_TTL', 3600),
+                )
+    return _dispatcher
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HospitalsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hospitals'
+
+    def ready(self):
+        # Keeps HospitalRatingSummary rows current from DoctorReview writes
+        from . import ratings  # noqa: F401
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from adminapp.models import DoctorReview
+from hospitals.models import HospitalRatingSummary
+from hospitals.ratings import RATING_TOTALS
+
+
+class Command(BaseCommand):
+    help = 'Recompute hospital rating summaries from published doctor reviews'
+
+    def handle(self, *args, **options):
+        # One GROUP BY over the published reviews
+        totals = (
+            DoctorReview.objects
+            .filter(is_published=True, hospital__isnull=False)
+            .order_by()
+            .values('hospital_id')
+            .annotate(
+                review_count=Count('pk'),
+                **{column: Sum(field) for field, column in RATING_TOTALS.items()}
+            )
+        )
+        now = timezone.now()
+        summaries = [HospitalRatingSummary(updated_at=now, **row) for row in totals]
+        reviews = sum(summary.review_count for summary in summaries)
+
+        with transaction.atomic():
+            stale, _ = HospitalRatingSummary.objects.exclude(
+                hospital_id__in=[summary.hospital_id for summary in summaries]
+            ).delete()
+            HospitalRatingSummary.objects.bulk_create(
+                summaries,
+                update_conflicts=True,
+                unique_fields=['hospital'],
+                update_fields=['review_count', *RATING_TOTALS.values(), 'updated_at'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rating summaries for {len(summaries)} hospitals from {reviews} published reviews '
+            f'({stale} stale summaries removed)'
+        ))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-16 20:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospitals', '0003_alter_hospitalinsurance_unique_together_and_more'),
+        ('tenants', '0003_hospital_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HospitalRatingSummary',
+            fields=[
+                ('hospital', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='tenants.hospital')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+                ('communication_total', models.PositiveIntegerField(default=0)),
+                ('treatment_total', models.PositiveIntegerField(default=0)),
+                ('facility_total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Hospital Rating Summaries',
+            },
+        ),
+    ]
@@ -82,3 +82,53 @@ class HospitalService(TenantAwareModel):
     
     def __str__(self):
         return f"{self.name} - {self.hospital.name if self.hospital else 'No Hospital'}"
+
+
+class HospitalRatingSummary(models.Model):
+    """
+    Running totals of a hospital's published patient reviews.
+
+    One row per hospital, kept current from DoctorReview writes with
+    F-expression updates (see ``hospitals/ratings.py``), so averages are a
+    primary-key read. ``manage.py rebuild_hospital_ratings`` recomputes
+    every row from the reviews.
+    """
+    hospital = models.OneToOneField(
+        'tenants.Hospital',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rating_summary'
+    )
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+    communication_total = models.PositiveIntegerField(default=0)
+    treatment_total = models.PositiveIntegerField(default=0)
+    facility_total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name_plural = "Hospital Rating Summaries"
+    
+    def _average(self, total):
+        if not self.review_count:
+            return None
+        return round(total / self.review_count, 1)
+    
+    @property
+    def average_rating(self):
+        return self._average(self.rating_total)
+    
+    @property
+    def average_communication(self):
+        return self._average(self.communication_total)
+    
+    @property
+    def average_treatment(self):
+        return self._average(self.treatment_total)
+    
+    @property
+    def average_facility(self):
+        return self._average(self.facility_total)
+    
+    def __str__(self):
+        return f"{self.hospital_id} - {self.average_rating or 'No'} rating ({self.review_count} reviews)"
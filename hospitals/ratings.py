@@ -0,0 +1,101 @@
+"""
+Maintenance of ``HospitalRatingSummary`` rows.
+
+Every published DoctorReview of a hospital adds one to the hospital's
+review count and its scores to the running totals. Review writes apply
+their difference to the summary row with a single F-expression UPDATE, so
+concurrent reviews never overwrite each other's totals and nothing
+re-reads the hospital's reviews:
+
+* created (published)         -> +1 and its scores
+* published / unpublished     -> +1 / -1 and its scores
+* scores or hospital changed  -> old contribution out, new one in
+* deleted (published)         -> -1 and its scores
+
+The handlers run inside the review's own transaction (``DoctorReview``
+wraps ``save`` and ``delete`` in ``atomic``) and let errors propagate, so
+a review is never committed without its summary change.
+``manage.py rebuild_hospital_ratings`` recomputes the rows for backfill or
+after bulk updates that bypass signals.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from adminapp.models import DoctorReview
+from .models import HospitalRatingSummary
+
+# DoctorReview score field -> HospitalRatingSummary total column
+RATING_TOTALS = {
+    'rating': 'rating_total',
+    'communication_rating': 'communication_total',
+    'treatment_rating': 'treatment_total',
+    'facility_rating': 'facility_total',
+}
+
+
+def review_contribution(hospital_id, is_published, scores):
+    """(hospital_id, scores) a review adds to the summaries, or None if it does not count"""
+    if not hospital_id or not is_published:
+        return None
+    return hospital_id, tuple(scores)
+
+
+def contribution_of(review):
+    return review_contribution(
+        review.hospital_id, review.is_published, (getattr(review, field) for field in RATING_TOTALS)
+    )
+
+
+def apply_rating_delta(hospital_id, count, scores):
+    """Add ``count`` reviews with summed ``scores`` to a hospital's summary row"""
+    HospitalRatingSummary.objects.get_or_create(hospital_id=hospital_id)
+    changes = {
+        column: F(column) + score
+        for column, score in zip(RATING_TOTALS.values(), scores)
+    }
+    HospitalRatingSummary.objects.filter(hospital_id=hospital_id).update(
+        review_count=F('review_count') + count,
+        updated_at=timezone.now(),
+        **changes
+    )
+
+
+def move_contribution(old, new):
+    """Replace a review's old contribution with its new one"""
+    if old == new:
+        return
+    with transaction.atomic():
+        if old and new and old[0] == new[0]:
+            # Same hospital: one UPDATE with the score differences
+            apply_rating_delta(new[0], 0, [n - o for o, n in zip(old[1], new[1])])
+            return
+        if old:
+            apply_rating_delta(old[0], -1, [-score for score in old[1]])
+        if new:
+            apply_rating_delta(new[0], 1, new[1])
+
+
+@receiver(pre_save, sender=DoctorReview)
+def remember_review_contribution(sender, instance, **kwargs):
+    """Capture what the stored row contributes before it is overwritten"""
+    instance._rating_contribution = None
+    if instance._state.adding or instance.pk is None:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values('hospital_id', 'is_published', *RATING_TOTALS).first()
+    if stored:
+        instance._rating_contribution = review_contribution(
+            stored['hospital_id'], stored['is_published'], (stored[field] for field in RATING_TOTALS)
+        )
+
+
+@receiver(post_save, sender=DoctorReview)
+def update_hospital_rating(sender, instance, **kwargs):
+    move_contribution(getattr(instance, '_rating_contribution', None), contribution_of(instance))
+
+
+@receiver(post_delete, sender=DoctorReview)
+def remove_hospital_rating(sender, instance, **kwargs):
+    move_contribution(contribution_of(instance), None)
@@ -6,7 +6,7 @@ from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .models import HospitalRegistration, HospitalRating
+from .models import HospitalRegistration
 from tenants.models import Hospital, HospitalUser
 
 
@@ -50,38 +50,6 @@ def handle_hospital_registration(sender, instance, created, **kwargs):
             print(f"Error creating hospital: {e}")
 
 
-@receiver(post_save, sender=HospitalRating)
-def update_hospital_rating(sender, instance, created, **kwargs):
-    """
-    Update hospital average rating when a new rating is added
-    """
-    if created and instance.is_published:
-        hospital = instance.hospital
-        
-        # Calculate new average rating
-        ratings = HospitalRating.objects.filter(
-            hospital=hospital,
-            is_published=True
-        )
-        
-        if ratings.exists():
-            total_ratings = ratings.count()
-            avg_overall = sum(r.overall_rating for r in ratings) / total_ratings
-            avg_cleanliness = sum(r.cleanliness_rating for r in ratings) / total_ratings
-            avg_staff = sum(r.staff_rating for r in ratings) / total_ratings
-            avg_facilities = sum(r.facilities_rating for r in ratings) / total_ratings
-            avg_value = sum(r.value_rating for r in ratings) / total_ratings
-            
-            # You can store these averages in a separate model or cache
-            # For now, we'll just print them
-            print(f"Updated ratings for {hospital.name}:")
-            print(f"  Overall: {avg_overall:.1f}")
-            print(f"  Cleanliness: {avg_cleanliness:.1f}")
-            print(f"  Staff: {avg_staff:.1f}")
-            print(f"  Facilities: {avg_facilities:.1f}")
-            print(f"  Value: {avg_value:.1f}")
-
-
 @receiver(pre_delete, sender=Hospital)
 def cleanup_hospital_data(sender, instance, **kwargs):
     """
@@ -95,6 +63,8 @@ def cleanup_hospital_data(sender, instance, **kwargs):
     )
 
 
+# Hospital rating summaries are maintained in hospitals/ratings.py
+
 # Additional signals can be added here for:
 # - Doctor profile updates
 # - Appointment notifications
@@ -0,0 +1,77 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase
+
+from adminapp.models import DoctorReview
+from adminapp.testing import make_doctor
+from tenants.testing import make_hospital
+from .models import HospitalRatingSummary
+
+
+class HospitalRatingSummaryTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital('city')
+        self.other = make_hospital('lake')
+        self.doctor = make_doctor(self.hospital)
+
+    def review(self, rating, **fields):
+        fields.setdefault('hospital', self.hospital)
+        return DoctorReview.objects.create(doctor=self.doctor, patient_name='P', rating=rating, **fields)
+
+    def summary(self, hospital=None):
+        return HospitalRatingSummary.objects.get(hospital=hospital or self.hospital)
+
+    def test_writes_keep_running_totals(self):
+        first = self.review(5, treatment_rating=3)
+        second = self.review(2)
+        self.review(1, is_published=False)
+        summary = self.summary()
+        self.assertEqual(summary.review_count, 2)
+        self.assertEqual(summary.average_rating, 3.5)
+        self.assertEqual(summary.average_treatment, 4.0)
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.summary().average_rating, 4.5)
+
+        first.is_published = False
+        first.save()
+        self.assertEqual(self.summary().review_count, 1)
+
+        second.hospital = self.other
+        second.save()
+        self.assertEqual(self.summary().review_count, 0)
+        self.assertIsNone(self.summary().average_rating)
+        self.assertEqual(self.summary(self.other).average_rating, 4.0)
+
+        second.delete()
+        self.assertEqual(self.summary(self.other).review_count, 0)
+
+    def test_failed_summary_update_rolls_back_the_review(self):
+        with mock.patch('hospitals.ratings.move_contribution', side_effect=OperationalError('database table is locked')):
+            with self.assertRaises(OperationalError):
+                self.review(5)
+        self.assertFalse(DoctorReview.objects.exists())
+
+        review = self.review(4)
+        with mock.patch('hospitals.ratings.move_contribution', side_effect=OperationalError('database table is locked')):
+            with self.assertRaises(OperationalError):
+                review.delete()
+        self.assertTrue(DoctorReview.objects.filter(pk=review.pk).exists())
+        self.assertEqual(self.summary().review_count, 1)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.review(4)
+        self.review(2)
+        HospitalRatingSummary.objects.filter(hospital=self.hospital).update(review_count=9, rating_total=1)
+        HospitalRatingSummary.objects.create(hospital=self.other, review_count=3, rating_total=15)
+
+        out = StringIO()
+        call_command('rebuild_hospital_ratings', stdout=out)
+        self.assertIn('1 hospitals from 2 published reviews', out.getvalue())
+        self.assertEqual(self.summary().review_count, 2)
+        self.assertEqual(self.summary().average_rating, 3.0)
+        self.assertFalse(HospitalRatingSummary.objects.filter(hospital=self.other).exists())
@@ -11,7 +11,9 @@ from django.utils.encoding import force_bytes, force_str
 from django.template.loader import render_to_string
 from django.conf import settings
 from tenants.models import Hospital
+from tenants.stats import get_hospital_stats
 from adminapp.models import Doctor, Category, Appointment, MedicalSpecialty
+from .models import HospitalRatingSummary
 from django.core.exceptions import PermissionDenied
 from django.db import connection 
 from django.shortcuts import render
@@ -218,12 +220,11 @@ def hospital_dashboard(request):
     hospital = request.hospital
     
     # Get hospital statistics
+    stats = get_hospital_stats(hospital)
     doctors = Doctor.objects.filter(hospital=hospital)
-    appointments = Appointment.objects.filter(hospital=hospital)
-    categories = Category.objects.filter(hospital=hospital)
     
     # Recent appointments
-    recent_appointments = appointments.order_by('-created_at')[:5]
+    recent_appointments = Appointment.objects.filter(hospital=hospital).order_by('-created_at')[:5]
     
     # Generate subdomain URL
     domain = request.get_host()
@@ -239,9 +240,9 @@ def hospital_dashboard(request):
     
     context = {
         'hospital': hospital,
-        'doctors_count': doctors.count(),
-        'appointments_count': appointments.count(),
-        'categories_count': categories.count(),
+        'doctors_count': stats['doctors'],
+        'appointments_count': stats['appointments'],
+        'categories_count': stats['categories'],
         'recent_appointments': recent_appointments,
         'doctors': doctors[:5],  # Show first 5 doctors
         'subdomain_url': subdomain_url,
@@ -380,6 +381,9 @@ def hospital_detail(request, hospital_id):
         except:
             recent_appointments = 0
         
+        # Averages are kept in a summary row (see hospitals/ratings.py)
+        rating_summary = HospitalRatingSummary.objects.filter(hospital=hospital).first()
+        
         context = {
             'hospital': hospital,
             'doctors': doctors[:6],  # Show first 6 doctors
@@ -387,6 +391,7 @@ def hospital_detail(request, hospital_id):
             'specialties': list(specialties),
             'specialties_count': len(specialties),
             'recent_appointments': recent_appointments,
+            'rating_summary': rating_summary,
             'has_emergency': True,  # All hospitals have emergency services
             'services': [
                 'Emergency Services',
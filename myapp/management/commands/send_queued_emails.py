@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp.outbox import send_batch
+from tenants.mail import mail_router
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbox emails in batches over one mail connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50))
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new emails instead of exiting')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        totals = {'sent': 0, 'retrying': 0, 'failed': 0}
+        try:
+            while True:
+                stats = send_batch(batch_size)
+                for key, value in stats.items():
+                    totals[key] += value
+                if sum(stats.values()) >= batch_size:
+                    # Outbox may hold more due emails; keep draining
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            mail_router.close_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['sent']} sent, {totals['retrying']} retrying, {totals['failed']} failed"
+        ))
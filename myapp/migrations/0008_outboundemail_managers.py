@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:55
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='outboundemail',
+            options={'default_manager_name': 'objects'},
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from tenants.models import TenantAwareModel
 
 # Create your models here.
@@ -35,4 +37,52 @@ class UserInfo(TenantAwareModel):
     created_at=models.DateTimeField(auto_now_add=True)
 
     def __str__(self):#object ki id show krta h
-        return f"{self.name}-{self.email} ({self.hospital.name if self.hospital else 'No Hospital'})"    
\ No newline at end of file
+        return f"{self.name}-{self.email} ({self.hospital.name if self.hospital else 'No Hospital'})"    
+
+class OutboundEmail(TenantAwareModel):
+    """
+    Email outbox: request handlers enqueue rows, ``manage.py send_queued_emails``
+    delivers them in batches (see ``myapp/outbox.py``)
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # Enqueuing the same key twice (retried request, double submit) sends once
+    idempotency_key = models.CharField(max_length=200, unique=True)
+    to = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list, blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    subject = models.CharField(max_length=300)
+    body = models.TextField(blank=True)
+    # Rendered by the worker, so the request path never renders templates
+    html_template = models.CharField(max_length=200, blank=True)
+    context = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    # Never tenant-scoped: idempotency keys are unique across all hospitals
+    all_objects = models.Manager()
+
+    class Meta:
+        default_manager_name = 'objects'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
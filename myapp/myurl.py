@@ -27,6 +27,7 @@ urlpatterns = [
     path('appointments/cancel/<str:appointment_id>/', views.cancel_appointment, name='cancel_appointment'),
     path('appointments/cancel-page/<str:appointment_id>/', views.cancel_appointment_page, name='cancel_appointment_page'),
     path("get-available-slots/", views.get_available_slots, name="get_available_slots"),
+    path("hold-slot/", views.hold_appointment_slot, name="hold_appointment_slot"),
     path('get-doctors-by-hospital/', views.get_doctors_by_hospital, name='get_doctors_by_hospital'),
     path('get-hospital-info/', views.get_hospital_info, name='get_hospital_info'),
     path('system-status/', views.system_status, name='system_status'),
@@ -0,0 +1,226 @@
+"""
+Email outbox.
+
+Request handlers call ``enqueue_email`` which only inserts an
+``OutboundEmail`` row; ``manage.py send_queued_emails`` (a separate worker
+process) delivers due rows in batches:
+
+* Claiming: a batch is claimed by stamping a random token on due rows in
+  one UPDATE, so several workers never send the same row. Rows stuck in
+  ``sending`` longer than ``EMAIL_OUTBOX_CLAIM_TIMEOUT`` (a crashed
+  worker) become due again. Claiming counts an attempt, so an email that
+  keeps crashing the worker is marked ``failed`` once it reaches
+  ``EMAIL_OUTBOX_MAX_ATTEMPTS`` instead of being retried forever.
+* Delivery: emails of hospitals with their own ``smtp_*`` settings go
+  over that hospital's pooled connections (``tenants/mail.py``); the rest
+  of the batch shares one connection from ``get_connection()`` (a single
+  SMTP session and TLS handshake).
+* Retry: failures are rescheduled with exponential backoff
+  (``EMAIL_OUTBOX_RETRY_BASE`` doubling up to ``EMAIL_OUTBOX_RETRY_MAX``)
+  and marked ``failed`` after ``EMAIL_OUTBOX_MAX_ATTEMPTS``.
+* Idempotency: each row has a unique ``idempotency_key``; enqueuing the
+  same key again, under any tenant, returns the existing row instead of
+  sending twice.
+"""
+import logging
+import uuid
+from smtplib import SMTPServerDisconnected
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from tenants.mail import hospital_smtp_configs, mail_router
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(to, subject, body='', html_template='', context=None, from_email='',
+                  reply_to=None, idempotency_key=None, hospital_id=None):
+    """Queue an email for the outbox worker and return its OutboundEmail row"""
+    if isinstance(to, str):
+        to = [to]
+    defaults = {
+        'to': list(to),
+        'subject': subject,
+        'body': body,
+        'html_template': html_template,
+        'context': context or {},
+        'from_email': from_email or '',
+        'reply_to': list(reply_to or []),
+    }
+    if hospital_id:
+        defaults['hospital_id'] = hospital_id
+    # The lookup must see rows of every tenant, or a key queued under another
+    # hospital would fall through to an INSERT that hits the unique constraint
+    with transaction.atomic():
+        outbound, created = OutboundEmail.all_objects.get_or_create(
+            idempotency_key=idempotency_key or uuid.uuid4().hex,
+            defaults=defaults,
+        )
+    if not created:
+        logger.info(f"Email {outbound.idempotency_key} already queued ({outbound.status}); not enqueuing again")
+    return outbound
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt ``attempts + 1``"""
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE', 60)
+    ceiling = getattr(settings, 'EMAIL_OUTBOX_RETRY_MAX', 3600)
+    return min(base * 2 ** max(attempts - 1, 0), ceiling)
+
+
+def due_filter(now):
+    stale = now - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_CLAIM_TIMEOUT', 600))
+    return (
+        Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=OutboundEmail.STATUS_SENDING, claimed_at__lt=stale)
+    )
+
+
+def claim_batch(batch_size, now=None):
+    """Claim up to ``batch_size`` due emails for this worker"""
+    now = now or timezone.now()
+    due = due_filter(now)
+    # Stale claims that already used up their attempts never reached an outcome
+    OutboundEmail.objects.filter(
+        due, status=OutboundEmail.STATUS_SENDING, attempts__gte=getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5),
+    ).update(status=OutboundEmail.STATUS_FAILED, last_error='Worker stopped while sending; giving up')
+    ids = list(
+        OutboundEmail.objects.filter(due).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Re-checking ``due`` in the UPDATE drops rows another worker claimed meanwhile
+    OutboundEmail.objects.filter(due, pk__in=ids).update(
+        status=OutboundEmail.STATUS_SENDING, claim_token=token, claimed_at=now, attempts=F('attempts') + 1,
+    )
+    return list(OutboundEmail.objects.filter(claim_token=token, status=OutboundEmail.STATUS_SENDING))
+
+
+def build_message(outbound, connection=None, default_from=None):
+    html = render_to_string(outbound.html_template, outbound.context) if outbound.html_template else ''
+    email = EmailMultiAlternatives(
+        subject=outbound.subject,
+        body=outbound.body or strip_tags(html),
+        from_email=outbound.from_email or default_from or settings.DEFAULT_FROM_EMAIL,
+        to=outbound.to,
+        reply_to=outbound.reply_to or None,
+        connection=connection,
+    )
+    if html:
+        email.attach_alternative(html, "text/html")
+    return email
+
+
+def _mark_sent(outbound):
+    OutboundEmail.objects.filter(pk=outbound.pk, claim_token=outbound.claim_token).update(
+        status=OutboundEmail.STATUS_SENT, sent_at=timezone.now(), last_error='',
+    )
+
+
+def _mark_failed(outbound, error):
+    # ``attempts`` was counted when the row was claimed
+    attempts = outbound.attempts
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    if attempts >= max_attempts:
+        status, next_attempt_at = OutboundEmail.STATUS_FAILED, outbound.next_attempt_at
+    else:
+        status, next_attempt_at = OutboundEmail.STATUS_PENDING, timezone.now() + timedelta(seconds=retry_delay(attempts))
+    OutboundEmail.objects.filter(pk=outbound.pk, claim_token=outbound.claim_token).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=str(error)[:2000],
+    )
+    return status
+
+
+def _count(stats, status):
+    stats['failed' if status == OutboundEmail.STATUS_FAILED else 'retrying'] += 1
+
+
+def _reconnect(connection):
+    connection.close()
+    try:
+        connection.open()
+    except Exception as e:
+        # Later sends fail too and are rescheduled like any other failure
+        logger.error(f"Error reopening email connection: {str(e)}")
+
+
+def _send_group(messages, connection, stats, default_from=None):
+    """Send ``messages`` over one open connection"""
+    for outbound in messages:
+        try:
+            build_message(outbound, connection, default_from).send()
+        except Exception as e:
+            logger.error(f"Error sending email {outbound.idempotency_key}: {str(e)}")
+            _count(stats, _mark_failed(outbound, e))
+            if isinstance(e, (SMTPServerDisconnected, ConnectionError)):
+                _reconnect(connection)
+        else:
+            _mark_sent(outbound)
+            stats['sent'] += 1
+
+
+def send_batch(batch_size=None, connection=None, router=None):
+    """
+    Send one batch of due emails. Emails of hospitals with their own SMTP
+    server go over a pooled connection of that hospital (``tenants/mail.py``),
+    the rest over a single connection of the global backend.
+    Returns counts: {'sent': .., 'retrying': .., 'failed': ..}
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    router = router or mail_router
+    stats = {'sent': 0, 'retrying': 0, 'failed': 0}
+    router.close_idle()
+    batch = claim_batch(batch_size)
+    if not batch:
+        return stats
+
+    groups = {}
+    for outbound in batch:
+        groups.setdefault(outbound.hospital_id, []).append(outbound)
+    configs = hospital_smtp_configs(groups)
+
+    default_group = []
+    for hospital_id, messages in groups.items():
+        config = configs.get(hospital_id)
+        if config is None:
+            default_group.extend(messages)
+            continue
+        router.track(hospital_id, config)
+        try:
+            pooled = router.acquire(config)
+        except Exception as e:
+            logger.error(f"Error opening SMTP connection for hospital {hospital_id}: {str(e)}")
+            for outbound in messages:
+                _count(stats, _mark_failed(outbound, e))
+            continue
+        try:
+            _send_group(messages, pooled, stats, default_from=config.from_email)
+        finally:
+            router.release(config, pooled)
+
+    if default_group:
+        connection = connection or get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Error opening email connection: {str(e)}")
+            for outbound in default_group:
+                _count(stats, _mark_failed(outbound, e))
+        else:
+            try:
+                _send_group(default_group, connection, stats)
+            finally:
+                connection.close()
+
+    logger.info(f"Email outbox batch: {stats['sent']} sent, {stats['retrying']} retrying, {stats['failed']} failed")
+    return stats
@@ -1,3 +1,186 @@
-from django.test import TestCase
+import datetime
+import io
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from adminapp.models import DoctorAvailability
+from adminapp.testing import make_doctor
+from tenants.context import tenant_context
+from tenants.mail import TenantMailRouter, smtp_config
+from tenants.models import Hospital
+from tenants.testing import make_hospital
+
+from .email_utils import send_appointment_confirmation_email
+from .models import OutboundEmail
+from .outbox import claim_batch, enqueue_email, send_batch
+
+
+class AvailableSlotsViewTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital()
+        self.doctor = make_doctor(self.hospital)
+        DoctorAvailability.objects.create(
+            hospital=self.hospital, doctor=self.doctor, day_of_week=0,
+            start_time=datetime.time(9), end_time=datetime.time(10),
+        )
+
+    def test_doctor_slots(self):
+        response = self.client.get('/get-available-slots/', {'doctor_id': self.doctor.id, 'date': '2030-01-07'})
+        self.assertEqual(response.json()['available_slots'], ['09:00', '09:30'])
+
+        response = self.client.get('/get-available-slots/', {'doctor_id': self.doctor.id, 'date': '2030-01-07', 'days': 2})
+        self.assertEqual(response.json()['dates'], {'2030-01-07': ['09:00', '09:30'], '2030-01-08': []})
+
+    def test_hospital_batch_slots(self):
+        response = self.client.post('/get-available-slots/', {'hospital_id': str(self.hospital.id), 'date': '2030-01-07'})
+        self.assertEqual(response.json()['doctors'], {str(self.doctor.id): {'2030-01-07': ['09:00', '09:30']}})
+
+    def test_invalid_request(self):
+        self.assertEqual(self.client.get('/get-available-slots/', {'date': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get('/get-available-slots/', {'date': '2030-01-07'}).status_code, 400)
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """locmem backend that counts connections and fails the first ``failures`` sends"""
+    opened = 0
+    failures = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise ConnectionError('SMTP unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opened = 0
+        FlakyEmailBackend.failures = 0
+
+    def test_confirmation_is_queued_not_sent(self):
+        data = {'appointment_id': 'APT1', 'email': 'p@example.com', 'first_name': 'Pat', 'last_name': 'Lee'}
+        self.assertTrue(send_appointment_confirmation_email(data))
+        # A retried request reuses the idempotency key
+        self.assertTrue(send_appointment_confirmation_email(data))
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.idempotency_key, 'appointment-confirmation:APT1')
+        self.assertEqual(queued.status, OutboundEmail.STATUS_PENDING)
+
+        self.assertEqual(send_batch()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('APT1', mail.outbox[0].subject)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_SENT)
+        self.assertEqual(send_batch()['sent'], 0)
+
+    def test_contact_view_only_enqueues(self):
+        response = self.client.post('/contact/', {
+            'first_name': 'Pat', 'last_name': 'Lee', 'email': 'p@example.com',
+            'subject': 'Hello', 'message': 'Hi there',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING).count(), 2)
+
+        call_command('send_queued_emails', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].reply_to, ['p@example.com'])
+
+    @override_settings(EMAIL_BACKEND='myapp.tests.FlakyEmailBackend', EMAIL_OUTBOX_RETRY_BASE=60)
+    def test_batch_reuses_connection_and_retries_with_backoff(self):
+        for i in range(3):
+            enqueue_email(['p@example.com'], f'Message {i}', body='Body', idempotency_key=f'test:{i}')
+        FlakyEmailBackend.failures = 1
+
+        stats = send_batch()
+        self.assertEqual(stats, {'sent': 2, 'retrying': 1, 'failed': 0})
+        # One session for the batch, reopened once after the dropped connection
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+        failed = OutboundEmail.objects.get(status=OutboundEmail.STATUS_PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('SMTP unavailable', failed.last_error)
+        self.assertGreater(failed.next_attempt_at, timezone.now() + datetime.timedelta(seconds=50))
+
+        # Not due yet
+        self.assertEqual(send_batch()['sent'], 0)
+        OutboundEmail.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_batch()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_BACKEND='myapp.tests.FlakyEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        queued = enqueue_email('p@example.com', 'Subject', body='Body')
+        FlakyEmailBackend.failures = 2
+        self.assertEqual(send_batch()['retrying'], 1)
+        OutboundEmail.objects.filter(pk=queued.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_batch()['failed'], 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (OutboundEmail.STATUS_FAILED, 2))
+
+    def test_stale_claims_are_reclaimed(self):
+        queued = enqueue_email('p@example.com', 'Subject', body='Body')
+        self.assertEqual(len(claim_batch(10)), 1)
+        # Claimed rows are invisible to other workers...
+        self.assertEqual(claim_batch(10), [])
+        # ...until the claim times out (the worker crashed mid-batch)
+        OutboundEmail.objects.filter(pk=queued.pk).update(
+            claimed_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.assertEqual(send_batch()['sent'], 1)
+        queued.refresh_from_db()
+        self.assertEqual(queued.attempts, 2)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_email_that_keeps_crashing_the_worker_gives_up(self):
+        queued = enqueue_email('p@example.com', 'Subject', body='Body')
+        stale = timezone.now() - datetime.timedelta(hours=1)
+        for _ in range(2):
+            self.assertEqual(len(claim_batch(10)), 1)
+            OutboundEmail.objects.filter(pk=queued.pk).update(claimed_at=stale)
+        self.assertEqual(claim_batch(10), [])
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (OutboundEmail.STATUS_FAILED, 2))
+
+    def test_idempotency_keys_are_shared_across_tenants(self):
+        city, lake = make_hospital('city'), make_hospital('lake')
+        with tenant_context(city):
+            first = enqueue_email('p@example.com', 'Subject', body='Body', idempotency_key='shared:1')
+        with tenant_context(lake):
+            again = enqueue_email('p@example.com', 'Subject', body='Body', idempotency_key='shared:1')
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(again.hospital_id, city.id)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_tenant_emails_use_the_hospital_smtp_pool(self):
+        hospital = make_hospital(
+            smtp_host='smtp.city.test', smtp_username='mail@city.test', smtp_password='secret',
+        )
+        router = TenantMailRouter(backend='django.core.mail.backends.locmem.EmailBackend')
+        enqueue_email('p@example.com', 'Tenant', body='Body', hospital_id=hospital.id)
+        enqueue_email('q@example.com', 'Global', body='Body')
+
+        self.assertEqual(send_batch(router=router)['sent'], 2)
+        senders = {message.subject: message.from_email for message in mail.outbox}
+        self.assertEqual(senders, {'Tenant': 'mail@city.test', 'Global': settings.DEFAULT_FROM_EMAIL})
+        config = smtp_config(hospital)
+        self.assertEqual(router.idle_count(config), 1)
+
+        # New credentials: the next batch drops the old pool and connects with them
+        Hospital.objects.filter(pk=hospital.pk).update(smtp_password='rotated')
+        enqueue_email('p@example.com', 'Tenant again', body='Body', hospital_id=hospital.id)
+        self.assertEqual(send_batch(router=router)['sent'], 1)
+        self.assertEqual(router.idle_count(config), 0)
+        self.assertEqual(router.idle_count(), 1)
+        router.close_all()
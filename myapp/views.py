@@ -12,25 +12,29 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.conf import settings
 from tenants.models import Hospital
+from tenants.stats import get_hospital_stats
 from adminapp.models import Doctor, DoctorAvailability
 import json
 
+# Longest date range get_available_slots computes in one request
+MAX_SLOT_DAYS = 14
+
 def index(request):
     """Completely fixed home page - no problematic field access"""
     try:
         # Get hospitals safely
-        hospitals = Hospital.objects.filter(is_active=True)[:5]
+        hospitals = list(Hospital.objects.filter(is_active=True)[:5])
         
         # Get doctors with minimal field access to avoid errors
-        doctors = Doctor.objects.filter(is_available=True)[:8]
+        doctors = list(Doctor.objects.filter(is_available=True)[:8])
         
         # Build safe context
         context = {
             'hospitals': hospitals,
             'doctors': doctors,
-            'hospital_count': hospitals.count(),
-            'doctor_count': doctors.count(),
-            'total_doctors': Doctor.objects.filter(is_available=True).count(),
+            'hospital_count': len(hospitals),
+            'doctor_count': len(doctors),
+            'total_doctors': get_hospital_stats()['available_doctors'],
         }
         
         return render(request, 'index.html', context)
@@ -56,9 +60,6 @@ def contact(request):
     """Contact page with email functionality"""
     if request.method == 'POST':
         try:
-            from django.core.mail import send_mail
-            from django.conf import settings
-            
             # Get form data
             first_name = request.POST.get('first_name', '').strip()
             last_name = request.POST.get('last_name', '').strip()
@@ -88,17 +89,15 @@ Message:
 This message was sent from the SymptomWise contact form.
 """
             
-            # Send email using EmailMessage for better control
-            from django.core.mail import EmailMessage
+            # Queue the notification; the outbox worker delivers it
+            from .outbox import enqueue_email
             
-            email_msg = EmailMessage(
-                email_subject,
-                email_message,
-                settings.DEFAULT_FROM_EMAIL,
-                ['symptomwiseprivatelimited@gmail.com'],
+            enqueue_email(
+                to=['symptomwiseprivatelimited@gmail.com'],
+                subject=email_subject,
+                body=email_message,
                 reply_to=[email],
             )
-            email_msg.send()
             
             # Send confirmation email to user
             confirmation_subject = 'Thank you for contacting SymptomWise'
@@ -116,12 +115,10 @@ Best regards,
 SymptomWise Team
 """
             
-            send_mail(
-                confirmation_subject,
-                confirmation_message,
-                settings.DEFAULT_FROM_EMAIL,
-                [email],
-                fail_silently=True,  # Don't fail if confirmation email fails
+            enqueue_email(
+                to=[email],
+                subject=confirmation_subject,
+                body=confirmation_message,
             )
             
             messages.success(request, f'Thank you {first_name}! Your message has been sent successfully. We will get back to you soon.')
@@ -367,14 +364,53 @@ def appointment(request):
     }
     return render(request, 'appointment.html', context)
 
+def slot_holder_id(request):
+    """Identify the browser holding a slot: its session key"""
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+
+def hold_appointment_slot(request):
+    """Hold a slot while the patient fills in the booking form (AJAX endpoint)"""
+    import datetime
+    from adminapp.booking import BookingConflict, hold_slot, normalize_time, release_slot
+    from adminapp.slots import free_slots
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=405)
+    try:
+        doctor_id = int(request.POST.get('doctor_id', ''))
+        date = datetime.date.fromisoformat(request.POST.get('date', ''))
+        time = normalize_time(request.POST.get('time', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    holder = slot_holder_id(request)
+    if request.POST.get('release'):
+        release_slot(doctor_id, date, time, holder)
+        return JsonResponse({'held': False})
+    
+    # Only real free slots of an existing doctor can be held
+    doctor = Doctor.objects.filter(id=doctor_id, is_available=True).first()
+    if doctor is None:
+        return JsonResponse({'error': 'Doctor not found'}, status=404)
+    if time not in free_slots(doctor, date):
+        return JsonResponse({'held': False, 'error': BookingConflict('slot_taken', doctor.id, date, time).to_dict()}, status=409)
+    try:
+        ttl = hold_slot(doctor.id, date, time, holder)
+    except BookingConflict as conflict:
+        return JsonResponse({'held': False, 'error': conflict.to_dict()}, status=409)
+    return JsonResponse({'held': True, 'expires_in': ttl})
+
+
 def bookappointment(request):
     """Book appointment with all required fields and send confirmation email"""
     if request.method == 'POST':
         try:
-            from adminapp.models import Appointment
+            from adminapp.booking import BookingConflict, book_slot
             from tenants.models import Hospital
             from .email_utils import send_appointment_confirmation_email
-            import uuid
             
             # Get form data
             hospital_id = request.POST.get('hospital')
@@ -405,27 +441,30 @@ def bookappointment(request):
             # Get consultation fee
             consultation_fee = doctor.consultation_fee if hasattr(doctor, 'consultation_fee') else 500.00
             
-            # Create appointment using Django ORM (more reliable than raw SQL)
-            appointment = Appointment.objects.create(
-                doctor=doctor,
-                hospital=hospital,
-                patient_user=request.user if request.user.is_authenticated else None,
-                first_name=first_name,
-                last_name=last_name,
-                phone=phone,
-                email=email,
-                date_of_birth=date_of_birth,
-                gender=gender,
-                address=address,
-                zipcode=zipcode,
-                appointment_date=date,
-                appointment_time=time,
-                reason=reason,
-                consultation_fee=consultation_fee,
-                status='scheduled',
-                duration=30,
-                is_paid=False
-            )
+            # Insert under the slot hold; a double booking raises BookingConflict
+            try:
+                appointment = book_slot(
+                    doctor, hospital, date, time, slot_holder_id(request),
+                    patient_user=request.user if request.user.is_authenticated else None,
+                    first_name=first_name,
+                    last_name=last_name,
+                    phone=phone,
+                    email=email,
+                    date_of_birth=date_of_birth,
+                    gender=gender,
+                    address=address,
+                    zipcode=zipcode,
+                    reason=reason,
+                    consultation_fee=consultation_fee,
+                    status='scheduled',
+                    duration=doctor.consultation_duration or 30,
+                    is_paid=False
+                )
+            except BookingConflict as conflict:
+                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                    return JsonResponse({'error': conflict.to_dict()}, status=409)
+                messages.error(request, conflict.message)
+                return redirect('appointment')
             
             # Prepare email data
             email_data = {
@@ -437,10 +476,11 @@ def bookappointment(request):
                 'hospital_name': hospital.name,
                 'appointment_date': date,
                 'appointment_time': time,
-                'consultation_fee': consultation_fee
+                'consultation_fee': consultation_fee,
+                'hospital_id': hospital.id,
             }
             
-            # Send confirmation email
+            # Queue confirmation email (sent by the outbox worker)
             try:
                 email_sent = send_appointment_confirmation_email(email_data)
             except Exception as email_error:
@@ -661,22 +701,50 @@ def appointment_confirmation(request, appointment_id):
     return render(request, 'appointment_confirmation.html', context)
 
 def get_available_slots(request):
-    """Get available appointment slots (AJAX endpoint)"""
-    from django.http import JsonResponse
+    """
+    Get available appointment slots (AJAX endpoint)
     
-    if request.method == 'POST':
-        doctor_id = request.POST.get('doctor_id')
-        date = request.POST.get('date')
-        
-        # Mock available slots - replace with actual logic
-        slots = [
-            '09:00', '09:30', '10:00', '10:30', '11:00', '11:30',
-            '14:00', '14:30', '15:00', '15:30', '16:00', '16:30'
-        ]
-        
-        return JsonResponse({'slots': slots})
+    ``doctor_id`` + ``date``: free slots of one doctor.
+    ``hospital_id`` + ``date``: free slots of every doctor of the hospital.
+    ``days`` (max 14) extends either mode to a date range starting at ``date``.
+    """
+    import datetime
+    import uuid
+    from adminapp.slots import free_slots, doctors_free_slots, hospital_free_slots
     
-    return JsonResponse({'error': 'Invalid request'})
+    params = request.POST if request.method == 'POST' else request.GET
+    try:
+        doctor_id = int(params['doctor_id']) if params.get('doctor_id') else None
+        hospital_id = uuid.UUID(params['hospital_id']) if params.get('hospital_id') else None
+        start = datetime.date.fromisoformat(params.get('date', ''))
+        days = max(1, min(int(params.get('days') or 1), MAX_SLOT_DAYS))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    dates = [start + datetime.timedelta(days=offset) for offset in range(days)]
+    
+    if hospital_id:
+        hospital = get_object_or_404(Hospital, id=hospital_id, is_active=True)
+        availability = hospital_free_slots(hospital, dates)
+        return JsonResponse({
+            'hospital_id': str(hospital.id),
+            'dates': [day.isoformat() for day in dates],
+            'doctors': {
+                str(doctor_id): {day.isoformat(): slots for day, slots in by_day.items()}
+                for doctor_id, by_day in availability.items()
+            },
+        })
+    
+    if not doctor_id:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    doctor = get_object_or_404(Doctor, id=doctor_id)
+    if days == 1:
+        slots = free_slots(doctor, start)
+        # 'slots' for existing callers, 'available_slots' for the booking form
+        return JsonResponse({'slots': slots, 'available_slots': slots})
+    by_day = doctors_free_slots([doctor], dates).get(doctor.id, {})
+    return JsonResponse({
+        'dates': {day.isoformat(): slots for day, slots in sorted(by_day.items())},
+    })
 
 def system_status(request):
     """System status dashboard"""
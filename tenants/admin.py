@@ -26,7 +26,7 @@ class HospitalAdmin(admin.ModelAdmin):
             'fields': ('subscription_plan', 'max_doctors', 'max_appointments_per_month', 'trial_ends_at')
         }),
         ('Features', {
-            'fields': ('ai_enabled', 'whatsapp_enabled', 'whatsapp_number', 'payment_gateway_enabled')
+            'fields': ('ai_enabled', 'ai_response_cache_enabled', 'whatsapp_enabled', 'whatsapp_number', 'payment_gateway_enabled')
         }),
         ('Status', {
             'fields': ('is_active', 'is_verified', 'owner', 'created_at', 'updated_at')
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class TenantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tenants'
-    verbose_name = 'Hospital Tenants'
\ No newline at end of file
+    verbose_name = 'Hospital Tenants'
+
+    def ready(self):
+        from . import signals  # noqa: F401
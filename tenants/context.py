@@ -0,0 +1,76 @@
+"""
+Current-tenant context.
+
+The current hospital lives in a ``contextvars.ContextVar`` rather than a
+thread-local, so it follows async tasks under ASGI and never leaks from
+one request into the next request served by the same thread.
+
+Work handed to an executor does not inherit context automatically; wrap
+the callable with ``with_tenant_context`` when submitting it::
+
+    executor.submit(with_tenant_context(send_reminder), appointment_id)
+
+The wrapper captures the tenant at wrap time and is picklable (for module
+level callables), so it works for both thread and process pools.
+"""
+import contextvars
+import functools
+from contextlib import contextmanager
+
+_current_hospital = contextvars.ContextVar('current_hospital', default=None)
+
+
+def get_current_hospital():
+    """Get the hospital of the current request or task"""
+    return _current_hospital.get()
+
+
+def set_current_hospital(hospital):
+    """Set the current hospital; returns a token for ``reset_current_hospital``"""
+    return _current_hospital.set(hospital)
+
+
+def reset_current_hospital(token):
+    """Restore the tenant that was current before the matching ``set_current_hospital``"""
+    _current_hospital.reset(token)
+
+
+@contextmanager
+def tenant_context(hospital):
+    """Run a block with ``hospital`` as the current tenant, restoring the previous one afterwards"""
+    token = set_current_hospital(hospital)
+    try:
+        yield hospital
+    finally:
+        reset_current_hospital(token)
+
+
+def _call_in_tenant(hospital, func, *args, **kwargs):
+    with tenant_context(hospital):
+        return func(*args, **kwargs)
+
+
+def with_tenant_context(func, hospital=None):
+    """
+    Bind ``func`` to the current tenant (or ``hospital``) so it runs with
+    that tenant inside a thread or process pool worker
+    """
+    if hospital is None:
+        hospital = get_current_hospital()
+    # functools.partial of a module-level function pickles cleanly for ProcessPoolExecutor
+    return functools.partial(_call_in_tenant, hospital, func)
+
+
+def tenant_scoped(func):
+    """
+    Decorator: accept a ``tenant`` keyword and run ``func`` with that
+    hospital as the current tenant (the caller's tenant when omitted).
+    Handy for functions that are always run in a pool::
+
+        executor.submit(send_reminder, appointment_id, tenant=get_current_hospital())
+    """
+    @functools.wraps(func)
+    def wrapper(*args, tenant=None, **kwargs):
+        hospital = tenant if tenant is not None else get_current_hospital()
+        return _call_in_tenant(hospital, func, *args, **kwargs)
+    return wrapper
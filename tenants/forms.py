@@ -128,7 +128,7 @@ class HospitalConfigForm(forms.ModelForm):
         fields = [
             'name', 'email', 'phone', 'address', 'city', 'state', 'country', 'postal_code',
             'website', 'logo', 'primary_color', 'secondary_color', 'timezone', 'language', 'currency',
-            'working_hours', 'ai_enabled', 'whatsapp_enabled', 'whatsapp_number',
+            'working_hours', 'ai_enabled', 'ai_response_cache_enabled', 'whatsapp_enabled', 'whatsapp_number',
             'payment_gateway_enabled', 'smtp_host', 'smtp_port', 'smtp_username', 'smtp_use_tls'
         ]
         widgets = {
@@ -149,6 +149,7 @@ class HospitalConfigForm(forms.ModelForm):
             'currency': forms.Select(attrs={'class': 'form-select'}),
             'working_hours': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'JSON format: {"monday": {"start": "09:00", "end": "17:00"}, ...}'}),
             'ai_enabled': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'ai_response_cache_enabled': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'whatsapp_enabled': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'whatsapp_number': forms.TextInput(attrs={'class': 'form-control', 'placeholder': '+91 9876543210'}),
             'payment_gateway_enabled': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
@@ -0,0 +1,148 @@
+"""
+Offline geocoding of hospital addresses.
+
+Used by the ``geocode_hospitals`` management command so the chat request
+path never calls a network geocoder. Backends are pluggable:
+
+* ``nominatim`` - OpenStreetMap Nominatim through geopy, throttled to its
+  one-request-per-second usage policy
+* ``csv`` - a local gazetteer file (address/postal code/city rows with
+  latitude and longitude), handy for tests and air-gapped installs
+
+Results are stored in a JSON file keyed by normalized address, together
+with the address key each hospital was last geocoded from, so re-runs only
+touch new or changed hospitals.
+"""
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_address(*parts):
+    """Lowercase, strip punctuation and collapse whitespace: 'MG Road,  Pune' -> 'mg road, pune'"""
+    cleaned = []
+    for part in parts:
+        part = re.sub(r'[^\w\s]', ' ', str(part or '').lower())
+        part = ' '.join(part.split())
+        if part:
+            cleaned.append(part)
+    return ', '.join(cleaned)
+
+
+def hospital_address_key(hospital):
+    return normalize_address(hospital.address, hospital.city, hospital.state, hospital.postal_code, hospital.country)
+
+
+class NominatimGeocoder:
+    """Geocode through OpenStreetMap Nominatim"""
+
+    def __init__(self, user_agent=None, min_delay=1.0, timeout=10, **options):
+        from geopy.geocoders import Nominatim
+
+        self.client = Nominatim(user_agent=user_agent or 'symptomwise-geocoder', timeout=timeout)
+        self.min_delay = min_delay
+        self._last_request = 0.0
+
+    def geocode(self, hospital):
+        wait = self.min_delay - (time.monotonic() - self._last_request)
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.monotonic()
+
+        query = ', '.join(
+            part for part in (hospital.address, hospital.city, hospital.state, hospital.postal_code, hospital.country)
+            if part
+        )
+        location = self.client.geocode(query)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class CSVGazetteerGeocoder:
+    """
+    Geocode from a local CSV with ``latitude`` and ``longitude`` columns plus
+    any of ``address``, ``postal_code``, ``city`` and ``state``.
+
+    Lookup order: full normalized address, postal code, then city + state.
+    """
+
+    def __init__(self, path=None, **options):
+        path = path or getattr(settings, 'GEOCODER_GAZETTEER', None)
+        if not path:
+            raise ValueError("The csv geocoder needs a gazetteer path (--gazetteer or GEOCODER_GAZETTEER)")
+        self.by_address = {}
+        self.by_postal_code = {}
+        self.by_city = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    point = (float(row['latitude']), float(row['longitude']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if row.get('address'):
+                    key = normalize_address(
+                        row['address'], row.get('city'), row.get('state'), row.get('postal_code'), row.get('country')
+                    )
+                    self.by_address.setdefault(key, point)
+                if row.get('postal_code'):
+                    self.by_postal_code.setdefault(normalize_address(row['postal_code']), point)
+                if row.get('city'):
+                    self.by_city.setdefault(normalize_address(row['city'], row.get('state')), point)
+
+    def geocode(self, hospital):
+        return (
+            self.by_address.get(hospital_address_key(hospital))
+            or self.by_postal_code.get(normalize_address(hospital.postal_code))
+            or self.by_city.get(normalize_address(hospital.city, hospital.state))
+        )
+
+
+GEOCODER_BACKENDS = {
+    'nominatim': NominatimGeocoder,
+    'csv': CSVGazetteerGeocoder,
+}
+
+
+def get_geocoder(name=None, **options):
+    name = name or getattr(settings, 'GEOCODER_BACKEND', 'nominatim')
+    try:
+        backend = GEOCODER_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown geocoder backend '{name}'. Choose from: {', '.join(GEOCODER_BACKENDS)}")
+    return backend(**options)
+
+
+class GeocodeCache:
+    """
+    JSON file holding ``{"addresses": {key: [lat, lon] | null},
+    "hospitals": {hospital_id: key}}``. A null entry records an address the
+    backend could not resolve, so it is not retried on every run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.addresses = {}
+        self.hospitals = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.addresses = data.get('addresses', {})
+            self.hospitals = data.get('hospitals', {})
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write-then-rename so an interrupted run never leaves a truncated cache
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'addresses': self.addresses, 'hospitals': self.hospitals}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
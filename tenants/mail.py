@@ -0,0 +1,191 @@
+"""
+Per-tenant SMTP connections.
+
+Hospitals with ``smtp_host`` set send their email through their own SMTP
+server instead of the global ``EMAIL_BACKEND``. The router keeps a small
+pool of open, authenticated connections per SMTP configuration so a busy
+tenant reuses its sessions instead of paying a TCP + TLS handshake + AUTH
+per message:
+
+* Pools are keyed by a hash of host/port/username/password/use_tls, so
+  hospitals sharing a mail account share connections and the password
+  never appears in a key.
+* At most ``TENANT_SMTP_POOL_SIZE`` idle connections are kept per config;
+  connections idle longer than ``TENANT_SMTP_IDLE_TIMEOUT`` seconds are
+  closed (SMTP servers drop idle sessions anyway).
+* When a hospital's settings change, its next lookup produces a new key
+  and the connections of the old config are closed. The outbox worker
+  re-reads the configs for every batch, so edits made in the web process
+  take effect without restarting it.
+* Every connection is opened with a socket timeout
+  (``TENANT_SMTP_TIMEOUT`` seconds) so one tenant's unreachable SMTP host
+  cannot stall the outbox worker, and with it every other tenant's mail.
+
+The router is process-local (``mail_router``) and thread-safe; the SMTP
+handshake happens outside the lock.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+SMTP_FIELDS = ('smtp_host', 'smtp_port', 'smtp_username', 'smtp_password', 'smtp_use_tls')
+
+
+class SMTPConfig(namedtuple('SMTPConfig', 'host port username password use_tls from_email')):
+    @property
+    def key(self):
+        raw = '\x00'.join(str(value) for value in (self.host, self.port, self.username, self.password, self.use_tls))
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def smtp_config(hospital):
+    """SMTPConfig of a hospital (model instance or values() dict), or None to use the global backend"""
+    values = hospital if isinstance(hospital, dict) else {
+        field: getattr(hospital, field) for field in SMTP_FIELDS + ('email',)
+    }
+    if not values.get('smtp_host'):
+        return None
+    username = values.get('smtp_username') or ''
+    return SMTPConfig(
+        host=values['smtp_host'],
+        port=values.get('smtp_port') or 587,
+        username=username,
+        password=values.get('smtp_password') or '',
+        use_tls=bool(values.get('smtp_use_tls')),
+        # Most providers only relay for the authenticated mailbox
+        from_email=username if '@' in username else (values.get('email') or ''),
+    )
+
+
+def hospital_smtp_configs(hospital_ids):
+    """{hospital_id: SMTPConfig} for the given hospitals that have their own SMTP server, in one query"""
+    from .models import Hospital
+
+    hospital_ids = [hospital_id for hospital_id in set(hospital_ids) if hospital_id]
+    if not hospital_ids:
+        return {}
+    configs = {}
+    for row in Hospital.objects.filter(pk__in=hospital_ids).exclude(smtp_host='').values('id', 'email', *SMTP_FIELDS):
+        configs[row['id']] = smtp_config(row)
+    return configs
+
+
+class TenantMailRouter:
+    def __init__(self, pool_size=None, idle_timeout=None, backend=None, timeout=None):
+        self.pool_size = pool_size if pool_size is not None else getattr(settings, 'TENANT_SMTP_POOL_SIZE', 2)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else getattr(settings, 'TENANT_SMTP_IDLE_TIMEOUT', 60)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'TENANT_SMTP_TIMEOUT', 10)
+        self.backend = backend or 'django.core.mail.backends.smtp.EmailBackend'
+        self._idle = {}  # config key -> [(last_used, connection)], most recently used last
+        self._hospital_keys = {}  # hospital id -> config key it used last
+        self._lock = threading.Lock()
+
+    def _close(self, connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.error(f"Error closing SMTP connection: {str(e)}")
+
+    def _open(self, config):
+        connection = get_connection(
+            self.backend,
+            fail_silently=False,
+            host=config.host,
+            port=config.port,
+            username=config.username,
+            password=config.password,
+            use_tls=config.use_tls,
+            timeout=self.timeout,
+        )
+        connection.open()
+        return connection
+
+    def track(self, hospital_id, config):
+        """Remember which config a hospital uses; drop the old pool when it changed"""
+        stale = []
+        with self._lock:
+            old_key = self._hospital_keys.get(hospital_id)
+            self._hospital_keys[hospital_id] = config.key
+            if old_key and old_key != config.key and old_key not in self._hospital_keys.values():
+                stale = [connection for _, connection in self._idle.pop(old_key, [])]
+        if stale:
+            logger.info(f"SMTP settings of hospital {hospital_id} changed; closing {len(stale)} old connection(s)")
+        self._close(stale)
+
+    def acquire(self, config):
+        """An open connection for ``config``, reused from the pool when a fresh one is idle"""
+        now = time.monotonic()
+        expired = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(config.key, [])
+            while idle:
+                last_used, candidate = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    connection = candidate
+                    break
+                expired.append(candidate)
+        self._close(expired)
+        return connection or self._open(config)
+
+    def release(self, config, connection, discard=False):
+        """Return a connection to the pool, or close it if broken or the pool is full"""
+        if not discard:
+            with self._lock:
+                idle = self._idle.setdefault(config.key, [])
+                if len(idle) < self.pool_size:
+                    idle.append((time.monotonic(), connection))
+                    return
+        self._close([connection])
+
+    @contextmanager
+    def connection(self, config):
+        connection = self.acquire(config)
+        discard = False
+        try:
+            yield connection
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.release(config, connection, discard=discard)
+
+    def close_idle(self):
+        """Close connections idle for longer than ``idle_timeout``"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, idle in list(self._idle.items()):
+                fresh = [(last_used, connection) for last_used, connection in idle if now - last_used <= self.idle_timeout]
+                expired.extend(connection for last_used, connection in idle if now - last_used > self.idle_timeout)
+                if fresh:
+                    self._idle[key] = fresh
+                else:
+                    del self._idle[key]
+        self._close(expired)
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for _, connection in idle]
+            self._idle = {}
+            self._hospital_keys = {}
+        self._close(connections)
+
+    def idle_count(self, config=None):
+        with self._lock:
+            if config is not None:
+                return len(self._idle.get(config.key, []))
+            return sum(len(idle) for idle in self._idle.values())
+
+
+mail_router = TenantMailRouter()
@@ -0,0 +1,82 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tenants.geocoding import GEOCODER_BACKENDS, GeocodeCache, get_geocoder, hospital_address_key
+from tenants.models import Hospital
+from tenants.spatial import bump_version
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Batch-geocode hospital addresses into latitude/longitude (only new or changed hospitals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=sorted(GEOCODER_BACKENDS),
+                            help='Geocoder backend (default: GEOCODER_BACKEND setting)')
+        parser.add_argument('--gazetteer', help='CSV gazetteer path for the csv backend')
+        parser.add_argument('--cache', help='Geocode cache file (default: GEOCODE_CACHE_PATH setting)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-geocode every hospital, including manually entered coordinates')
+        parser.add_argument('--include-inactive', action='store_true', help='Also geocode inactive hospitals')
+
+    def handle(self, *args, **options):
+        backend_options = {}
+        if options['gazetteer']:
+            backend_options['path'] = options['gazetteer']
+        try:
+            geocoder = get_geocoder(options['backend'], **backend_options)
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+        cache = GeocodeCache(options['cache'] or settings.GEOCODE_CACHE_PATH)
+        hospitals = Hospital.objects.all() if options['include_inactive'] else Hospital.objects.filter(is_active=True)
+
+        updated = skipped = cache_hits = lookups = unresolved = failed = 0
+        for hospital in hospitals.order_by('name'):
+            hospital_id = str(hospital.id)
+            key = hospital_address_key(hospital)
+            has_coordinates = hospital.latitude is not None and hospital.longitude is not None
+
+            if has_coordinates and not options['force']:
+                previous_key = cache.hospitals.get(hospital_id)
+                # Unchanged since the last run, or coordinates entered by hand
+                if previous_key == key or previous_key is None:
+                    skipped += 1
+                    continue
+
+            if key in cache.addresses:
+                point = cache.addresses[key]
+                cache_hits += 1
+            else:
+                try:
+                    point = geocoder.geocode(hospital)
+                except Exception as e:
+                    logger.error(f"Error geocoding hospital {hospital.name}: {str(e)}")
+                    failed += 1
+                    continue
+                lookups += 1
+                cache.addresses[key] = list(point) if point else None
+                if lookups % 50 == 0:
+                    cache.save()
+
+            if not point:
+                self.stdout.write(self.style.WARNING(f'Could not geocode {hospital.name}: {key}'))
+                unresolved += 1
+                continue
+
+            # update() skips the per-row post_save; the index is invalidated once below
+            Hospital.objects.filter(pk=hospital.pk).update(latitude=point[0], longitude=point[1])
+            cache.hospitals[hospital_id] = key
+            updated += 1
+
+        cache.save()
+        if updated:
+            bump_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Geocoded {updated} hospitals ({lookups} backend lookups, {cache_hits} from cache); '
+            f'{skipped} unchanged, {unresolved} unresolved, {failed} failed'
+        ))
@@ -1,73 +1,98 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.http import Http404
 from django.shortcuts import get_object_or_404
-from .models import Hospital
-import threading
+from .registry import registry
+# The current hospital is kept in a ContextVar (see tenants/context.py);
+# re-exported here because existing code imports it from the middleware
+from .context import get_current_hospital, reset_current_hospital, set_current_hospital
+import re
+from functools import lru_cache
 
-# Thread-local storage for current hospital
-_thread_locals = threading.local()
 
+# "<subdomain>.<domain>[:port]"; IPv4 literals and www/localhost never name a tenant
+SUBDOMAIN_RE = re.compile(r'^([a-z0-9-]+)\.[a-z0-9.-]+(?::\d+)?$')
+IPV4_HOST_RE = re.compile(r'^\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?$')
+NON_TENANT_SUBDOMAINS = frozenset(['www', 'localhost'])
 
-def get_current_hospital():
-    """Get the current hospital from thread-local storage"""
-    return getattr(_thread_locals, 'hospital', None)
 
-
-def set_current_hospital(hospital):
-    """Set the current hospital in thread-local storage"""
-    _thread_locals.hospital = hospital
+@lru_cache(maxsize=1024)
+def parse_subdomain(host):
+    """Return the tenant subdomain for a host header, or None"""
+    host = host.lower()
+    if IPV4_HOST_RE.match(host):
+        return None
+    match = SUBDOMAIN_RE.match(host)
+    if not match or match.group(1) in NON_TENANT_SUBDOMAINS:
+        return None
+    return match.group(1)
 
 
 class TenantMiddleware:
     """
     Middleware to detect and set the current tenant (hospital)
     Supports both subdomain and URL parameter detection
+    
+    The tenant is scoped to the request: it is set in the current context
+    before the view runs and the previous value is restored afterwards,
+    under both WSGI and ASGI.
     """
     
+    sync_capable = True
+    async_capable = True
+    
+    # Static files, uploads and the Django admin never need a tenant
+    SKIP_PATHS = ('/static/', '/media/', '/admin/')
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
-        # Clear any existing hospital
-        set_current_hospital(None)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        request.hospital = self.resolve_hospital(request)
+        token = set_current_hospital(request.hospital)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_hospital(token)
+    
+    async def __acall__(self, request):
+        # Resolution may query the database, so it runs in the sync thread
+        request.hospital = await sync_to_async(self.resolve_hospital)(request)
+        token = set_current_hospital(request.hospital)
+        try:
+            return await self.get_response(request)
+        finally:
+            reset_current_hospital(token)
+    
+    def resolve_hospital(self, request):
+        """Return the hospital a request belongs to, or None"""
+        if request.path.startswith(self.SKIP_PATHS):
+            return None
         
         hospital = None
         
         # Method 1: Detect by subdomain
-        host = request.get_host().lower()
-        if '.' in host:
-            subdomain = host.split('.')[0]
-            if subdomain != 'www' and subdomain != 'localhost':
-                try:
-                    hospital = Hospital.objects.get(subdomain=subdomain, is_active=True)
-                except Hospital.DoesNotExist:
-                    pass
+        subdomain = parse_subdomain(request.get_host())
+        if subdomain:
+            hospital = registry.by_subdomain(subdomain)
         
         # Method 2: Detect by URL parameter (for development/testing)
         if not hospital:
             hospital_slug = request.GET.get('hospital') or request.session.get('hospital_slug')
             if hospital_slug:
-                try:
-                    hospital = Hospital.objects.get(slug=hospital_slug, is_active=True)
+                hospital = registry.by_slug(hospital_slug)
+                if hospital and request.session.get('hospital_slug') != hospital_slug:
                     request.session['hospital_slug'] = hospital_slug
-                except Hospital.DoesNotExist:
-                    pass
         
         # Method 3: Use default hospital for development
-        if not hospital and not request.path.startswith('/admin/'):
-            try:
-                hospital = Hospital.objects.filter(is_active=True).first()
-            except:
-                pass
-        
-        # Set the current hospital
-        if hospital:
-            set_current_hospital(hospital)
-            request.hospital = hospital
-        else:
-            request.hospital = None
+        if not hospital:
+            hospital = registry.default()
         
-        response = self.get_response(request)
-        return response
+        return hospital
 
 
 class RequireTenantMiddleware:
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-16 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0002_alter_hospital_phone_alter_hospital_whatsapp_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hospital',
+            name='latitude',
+            field=models.FloatField(blank=True, help_text='Decimal degrees, used for nearby-hospital search', null=True),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='longitude',
+            field=models.FloatField(blank=True, help_text='Decimal degrees, used for nearby-hospital search', null=True),
+        ),
+    ]
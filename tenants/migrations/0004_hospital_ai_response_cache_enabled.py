@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0003_hospital_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hospital',
+            name='ai_response_cache_enabled',
+            field=models.BooleanField(default=True, help_text='Reuse earlier AI answers for repeated, near-identical chat messages'),
+        ),
+    ]
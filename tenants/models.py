@@ -30,6 +30,8 @@ class Hospital(models.Model):
     state = models.CharField(max_length=100)
     country = models.CharField(max_length=100, default="India")
     postal_code = models.CharField(max_length=20)
+    latitude = models.FloatField(null=True, blank=True, help_text="Decimal degrees, used for nearby-hospital search")
+    longitude = models.FloatField(null=True, blank=True, help_text="Decimal degrees, used for nearby-hospital search")
     
     # Branding & Customization
     logo = models.ImageField(upload_to='hospital_logos/', blank=True, null=True)
@@ -64,6 +66,9 @@ class Hospital(models.Model):
     
     # AI & Chatbot Settings
     ai_enabled = models.BooleanField(default=True)
+    ai_response_cache_enabled = models.BooleanField(
+        default=True, help_text="Reuse earlier AI answers for repeated, near-identical chat messages"
+    )
     whatsapp_enabled = models.BooleanField(default=False)
     whatsapp_number = PhoneNumberField(region="IN", blank=True)
     
@@ -159,7 +164,7 @@ class TenantAwareManager(models.Manager):
     """
     
     def get_queryset(self):
-        from .middleware import get_current_hospital
+        from .context import get_current_hospital
         hospital = get_current_hospital()
         if hospital:
             return super().get_queryset().filter(hospital=hospital)
@@ -188,8 +193,20 @@ class TenantAwareModel(models.Model):
     def save(self, *args, **kwargs):
         # Auto-assign current hospital if not set
         if not self.hospital_id:
-            from .middleware import get_current_hospital
+            from .context import get_current_hospital
             hospital = get_current_hospital()
             if hospital:
                 self.hospital = hospital
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class CacheVersion(models.Model):
+    """
+    Shared version token of a process-local cache (see tenants/versioning.py)
+    """
+
+    key = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} @ {self.version}"
@@ -0,0 +1,119 @@
+"""
+In-process tenant registry used by TenantMiddleware.
+
+Resolving a tenant by subdomain, slug or the development default used to
+cost up to three Hospital queries per request. The registry remembers each
+resolved hospital for ``TENANT_REGISTRY_TTL`` seconds and is cleared
+whenever a Hospital is saved or deleted: the signal handlers in
+``tenants/signals.py`` bump its version in the database (see
+``tenants/versioning.py``), which the saving process sees at once and the
+others within ``CACHE_VERSION_CHECK_INTERVAL`` seconds. The steady state
+costs at most that one version query per interval.
+
+Lookups that find nothing (bots, typo subdomains, stale session slugs)
+are remembered too, in a bounded LRU with a shorter TTL
+(``TENANT_REGISTRY_NEGATIVE_TTL``/``TENANT_REGISTRY_NEGATIVE_SIZE``), so
+repeated misses do not hit the database either.
+
+The registry keeps its own master copy of each hospital and hands every
+caller a shallow copy, so a view that mutates ``request.hospital`` cannot
+leak the change into other requests. Copies are real ``Hospital``
+instances and still work as foreign-key values and in templates.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import versioning
+
+VERSION_CACHE_KEY = 'tenants:registry:version'
+
+
+class TenantRegistry:
+    def __init__(self, ttl=None, negative_ttl=None, negative_size=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'TENANT_REGISTRY_TTL', 300)
+        self.negative_ttl = negative_ttl if negative_ttl is not None else getattr(settings, 'TENANT_REGISTRY_NEGATIVE_TTL', 60)
+        self.negative_size = negative_size if negative_size is not None else getattr(settings, 'TENANT_REGISTRY_NEGATIVE_SIZE', 1024)
+        self._entries = {}  # (kind, value) -> (expires_at, hospital)
+        self._misses = OrderedDict()  # (kind, value) -> expires_at, least recently used first
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _sync_version(self):
+        version = versioning.get_version(VERSION_CACHE_KEY)
+        if version != self._version:
+            with self._lock:
+                self._entries = {}
+                self._misses = OrderedDict()
+                self._version = version
+
+    def _is_known_miss(self, key, now):
+        with self._lock:
+            expires_at = self._misses.get(key)
+            if expires_at is None:
+                return False
+            if expires_at > now:
+                self._misses.move_to_end(key)
+                return True
+            del self._misses[key]
+            return False
+
+    def _remember_miss(self, key, now):
+        with self._lock:
+            self._misses[key] = now + self.negative_ttl
+            self._misses.move_to_end(key)
+            while len(self._misses) > self.negative_size:
+                self._misses.popitem(last=False)
+
+    def _lookup(self, kind, value, loader):
+        self._sync_version()
+        key = (kind, value)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return copy.copy(entry[1])
+        if self._is_known_miss(key, now):
+            return None
+
+        hospital = loader()
+        if hospital is None:
+            self._remember_miss(key, now)
+            return None
+        with self._lock:
+            self._entries[key] = (now + self.ttl, hospital)
+        return copy.copy(hospital)
+
+    def by_subdomain(self, subdomain):
+        from .models import Hospital
+        return self._lookup(
+            'subdomain', subdomain,
+            lambda: Hospital.objects.filter(subdomain=subdomain, is_active=True).first(),
+        )
+
+    def by_slug(self, slug):
+        from .models import Hospital
+        return self._lookup(
+            'slug', slug,
+            lambda: Hospital.objects.filter(slug=slug, is_active=True).first(),
+        )
+
+    def default(self):
+        """First active hospital, used as the development fallback tenant"""
+        from .models import Hospital
+        return self._lookup('default', None, lambda: Hospital.objects.filter(is_active=True).first())
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._misses = OrderedDict()
+
+
+registry = TenantRegistry()
+
+
+def bump_version():
+    """Invalidate every process's tenant registry"""
+    versioning.bump_version(VERSION_CACHE_KEY)
@@ -0,0 +1,34 @@
+"""
+Django signals for the tenants app
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Hospital
+from . import registry, spatial
+from .stats import invalidate_hospital_stats
+
+# Models counted by the dashboard stats (see tenants/stats.py)
+STATS_SENDERS = ('adminapp.Doctor', 'adminapp.Appointment', 'adminapp.Category', 'myapp.UserInfo', 'myapp.Enquiry')
+
+
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def invalidate_hospital_caches(sender, **kwargs):
+    """
+    Drop cached tenants and rebuild the nearest-hospital index after a
+    hospital is added, edited or removed
+    """
+    registry.bump_version()
+    spatial.bump_version()
+    invalidate_hospital_stats()
+
+
+def invalidate_stats_for_instance(sender, instance, **kwargs):
+    """Drop cached dashboard counters of the hospital a counted row belongs to"""
+    invalidate_hospital_stats(instance.hospital_id)
+
+
+for _sender in STATS_SENDERS:
+    post_save.connect(invalidate_stats_for_instance, sender=_sender, dispatch_uid=f"tenants_stats_{_sender}_save")
+    post_delete.connect(invalidate_stats_for_instance, sender=_sender, dispatch_uid=f"tenants_stats_{_sender}_delete")
@@ -0,0 +1,197 @@
+"""
+In-memory spatial index of active hospitals.
+
+Hospitals are stored as unit vectors on the sphere in a k-d tree. Straight
+line (chord) distance between unit vectors is monotonic in great-circle
+distance, so the tree can prune with plain squared differences and still
+return the exact k nearest hospitals. The reported distance is the
+haversine great-circle distance in kilometres.
+
+The index is rebuilt lazily after a Hospital is saved or deleted: the
+signal handlers in ``tenants/signals.py`` bump its version in the database
+(see ``tenants/versioning.py``), and every process picks the change up
+within ``CACHE_VERSION_CHECK_INTERVAL`` seconds.
+"""
+import heapq
+import logging
+import math
+import threading
+
+from . import versioning
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+VERSION_CACHE_KEY = 'tenants:hospital_index:version'
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def to_unit_vector(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def chord_for_km(distance_km):
+    """Squared chord length matching a great-circle distance"""
+    angle = min(math.pi, distance_km / EARTH_RADIUS_KM)
+    return (2 * math.sin(angle / 2)) ** 2
+
+
+class SpatialIndex:
+    """
+    Static k-d tree over (latitude, longitude, item) points
+    """
+
+    def __init__(self, points):
+        self._points = [(to_unit_vector(lat, lon), lat, lon, item) for lat, lon, item in points]
+        self._root = self._build(list(range(len(self._points))), 0)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda i: self._points[i][0][axis])
+        middle = len(indexes) // 2
+        return (
+            indexes[middle],
+            axis,
+            self._build(indexes[:middle], depth + 1),
+            self._build(indexes[middle + 1:], depth + 1),
+        )
+
+    def _result(self, index, lat, lon):
+        _, point_lat, point_lon, item = self._points[index]
+        return haversine_km(lat, lon, point_lat, point_lon), item
+
+    def nearest(self, lat, lon, k=5):
+        """The k closest items as ``[(distance_km, item), ...]``, nearest first"""
+        if k <= 0 or self._root is None:
+            return []
+        target = to_unit_vector(lat, lon)
+        best = []  # max-heap of (-squared chord, index)
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            point = self._points[index][0]
+            d2 = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if len(best) < k:
+                heapq.heappush(best, (-d2, index))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, index))
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if len(best) < k or diff * diff < -best[0][0]:
+                search(far)
+
+        search(self._root)
+        ordered = sorted((-neg_d2, index) for neg_d2, index in best)
+        return [self._result(index, lat, lon) for _, index in ordered]
+
+    def within_radius(self, lat, lon, radius_km):
+        """All items within ``radius_km`` as ``[(distance_km, item), ...]``, nearest first"""
+        if self._root is None:
+            return []
+        target = to_unit_vector(lat, lon)
+        limit = chord_for_km(radius_km)
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            index, axis, left, right = node
+            point = self._points[index][0]
+            d2 = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+            if d2 <= limit:
+                found.append((d2, index))
+            diff = target[axis] - point[axis]
+            if diff < 0 or diff * diff <= limit:
+                stack.append(left)
+            if diff >= 0 or diff * diff <= limit:
+                stack.append(right)
+        found.sort()
+        return [self._result(index, lat, lon) for _, index in found]
+
+
+def hospital_entry(hospital):
+    """JSON-safe snapshot of the hospital fields the chatbot returns"""
+    return {
+        'id': str(hospital.id),
+        'name': hospital.name,
+        'address': hospital.address,
+        'city': hospital.city,
+        'state': hospital.state,
+        'phone': str(hospital.phone) if hospital.phone else 'Contact hospital directly',
+        'website': hospital.website if hospital.website else '',
+        'latitude': hospital.latitude,
+        'longitude': hospital.longitude,
+    }
+
+
+class HospitalIndex:
+    """
+    Snapshot of active hospitals: a k-d tree for geocoded ones plus the
+    list of hospitals that have no coordinates yet
+    """
+
+    def __init__(self, entries):
+        self.hospitals = list(entries)
+        self.spatial = SpatialIndex(
+            (entry['latitude'], entry['longitude'], entry)
+            for entry in self.hospitals
+            if entry['latitude'] is not None and entry['longitude'] is not None
+        )
+        self.unlocated = [entry for entry in self.hospitals if entry['latitude'] is None or entry['longitude'] is None]
+
+    def nearest(self, lat, lon, k=5):
+        return self.spatial.nearest(lat, lon, k)
+
+    def within_radius(self, lat, lon, radius_km):
+        return self.spatial.within_radius(lat, lon, radius_km)
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def bump_version():
+    """Invalidate every process's hospital index"""
+    versioning.bump_version(VERSION_CACHE_KEY)
+
+
+def get_hospital_index():
+    """Return the active-hospital index, rebuilding it if a hospital changed"""
+    global _index, _index_version
+    version = versioning.get_version(VERSION_CACHE_KEY)
+    if _index is not None and _index_version == version:
+        return _index
+
+    with _lock:
+        if _index is None or _index_version != version:
+            from .models import Hospital
+
+            hospitals = Hospital.objects.filter(is_active=True).order_by('name')
+            _index = HospitalIndex(hospital_entry(hospital) for hospital in hospitals)
+            _index_version = version
+            logger.info(
+                f"Hospital index rebuilt (version {version}, {len(_index.spatial)} geocoded, "
+                f"{len(_index.unlocated)} without coordinates)"
+            )
+    return _index
@@ -0,0 +1,92 @@
+"""
+Per-hospital dashboard counters.
+
+Every counter the dashboards and ``api_hospital_stats`` show (doctors,
+appointments by status, categories, patients, enquiries) is fetched in a
+single round-trip: each counter is compiled from an ordinary queryset and
+the results are combined as scalar subqueries of one ``SELECT``.
+
+Results are cached per hospital (and once for the platform-wide totals)
+for ``HOSPITAL_STATS_CACHE_TTL`` seconds. Writes to any counted model drop
+the affected entries straight away (see ``tenants/signals.py``), so the
+TTL only bounds staleness from bulk updates that bypass signals.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_PREFIX = 'tenants:stats:'
+
+
+def stats_cache_key(hospital_id=None):
+    return f"{STATS_CACHE_PREFIX}{hospital_id or 'all'}"
+
+
+def stats_querysets(hospital_id=None):
+    """Counter name -> queryset whose row count is the counter"""
+    from adminapp.models import Appointment, Category, Doctor
+    from myapp.models import Enquiry, UserInfo
+    from .models import Hospital
+
+    def scoped(model):
+        queryset = model.objects.all()
+        return queryset.filter(hospital_id=hospital_id) if hospital_id else queryset
+
+    appointments = scoped(Appointment)
+    querysets = {
+        'doctors': scoped(Doctor),
+        'available_doctors': scoped(Doctor).filter(is_available=True),
+        'appointments': appointments,
+        'categories': scoped(Category),
+        'patients': scoped(UserInfo),
+        'enquiries': scoped(Enquiry),
+    }
+    for status, _ in Appointment.STATUS_CHOICES:
+        querysets[f"appointments_{status}"] = appointments.filter(status=status)
+    if not hospital_id:
+        querysets['hospitals'] = Hospital.objects.filter(is_active=True)
+    return querysets
+
+
+def count_in_one_query(querysets, using=DEFAULT_DB_ALIAS):
+    """Count several querysets with a single SELECT of scalar subqueries"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = []
+    params = []
+    for name, queryset in querysets.items():
+        sql, subquery_params = queryset.order_by().values('pk').query.sql_with_params()
+        columns.append(f"(SELECT COUNT(*) FROM ({sql}) {quote(name + '_rows')}) AS {quote(name)}")
+        params.extend(subquery_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)}", params)
+        row = cursor.fetchone()
+    return dict(zip(querysets, row))
+
+
+def compute_hospital_stats(hospital=None):
+    """Uncached counters for one hospital, or platform-wide when ``hospital`` is None"""
+    return count_in_one_query(stats_querysets(hospital.pk if hospital else None))
+
+
+def get_hospital_stats(hospital=None):
+    """Cached counters for one hospital, or platform-wide when ``hospital`` is None"""
+    key = stats_cache_key(hospital.pk if hospital else None)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_hospital_stats(hospital)
+        cache.set(key, stats, timeout=getattr(settings, 'HOSPITAL_STATS_CACHE_TTL', 60))
+    return stats
+
+
+def invalidate_hospital_stats(hospital_id=None):
+    """Drop cached counters for a hospital and the platform-wide totals"""
+    keys = [stats_cache_key(None)]
+    if hospital_id:
+        keys.append(stats_cache_key(hospital_id))
+    cache.delete_many(keys)
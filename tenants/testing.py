@@ -0,0 +1,30 @@
+"""
+Test fixtures shared by the apps' test suites.
+"""
+from django.contrib.auth.models import User
+
+from .models import Hospital
+
+OWNER_USERNAME = 'owner@test.com'
+
+
+def make_owner():
+    """The user owning fixture hospitals, created on first use"""
+    owner, created = User.objects.get_or_create(username=OWNER_USERNAME, defaults={'email': OWNER_USERNAME})
+    if created:
+        owner.set_password('testpass123')
+        owner.save()
+    return owner
+
+
+def make_hospital(slug='city', **fields):
+    """Create an active hospital; ``fields`` override the defaults"""
+    values = {
+        'name': f'{slug.title()} Hospital', 'slug': slug, 'subdomain': slug, 'email': f'info@{slug}.com',
+        'phone': '+91 9876543210', 'address': 'Test Address', 'city': 'Mumbai', 'state': 'Maharashtra',
+        'country': 'India', 'postal_code': '400001',
+    }
+    values.update(fields)
+    if 'owner' not in values:
+        values['owner'] = make_owner()
+    return Hospital.objects.create(**values)
@@ -1,6 +1,29 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import os
+import pickle
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.mail.backends import locmem
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from django.contrib.auth.models import User
-from .models import Hospital, HospitalUser
+from .context import get_current_hospital, tenant_context, tenant_scoped, with_tenant_context
+from .middleware import TenantMiddleware, parse_subdomain
+from . import registry
+from .models import CacheVersion, Hospital, HospitalUser
+from .geocoding import normalize_address
+from .mail import TenantMailRouter, smtp_config
+from .spatial import SpatialIndex, haversine_km
+from .stats import compute_hospital_stats, get_hospital_stats
+from .testing import make_hospital
 
 
 class HospitalModelTest(TestCase):
@@ -56,4 +79,367 @@ class HospitalModelTest(TestCase):
         self.assertEqual(hospital_user.hospital, hospital)
         self.assertEqual(hospital_user.user, self.user)
         self.assertEqual(hospital_user.role, 'owner')
-        self.assertTrue(hospital_user.is_active)
\ No newline at end of file
+        self.assertTrue(hospital_user.is_active)
+
+class SpatialIndexTest(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.points = [(rng.uniform(8, 35), rng.uniform(68, 97), i) for i in range(500)]
+        self.index = SpatialIndex(self.points)
+
+    def brute_force(self, lat, lon):
+        return sorted((haversine_km(lat, lon, p_lat, p_lon), item) for p_lat, p_lon, item in self.points)
+
+    def test_nearest_matches_brute_force(self):
+        expected = self.brute_force(26.76, 83.37)[:5]
+        result = self.index.nearest(26.76, 83.37, k=5)
+        self.assertEqual([item for _, item in result], [item for _, item in expected])
+        for (distance, _), (expected_distance, _) in zip(result, expected):
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_within_radius_matches_brute_force(self):
+        expected = [item for distance, item in self.brute_force(19.07, 72.88) if distance <= 300]
+        result = self.index.within_radius(19.07, 72.88, 300)
+        self.assertEqual([item for _, item in result], expected)
+
+    def test_haversine_known_distance(self):
+        # Delhi to Mumbai is roughly 1150 km as the crow flies
+        self.assertAlmostEqual(haversine_km(28.6139, 77.2090, 19.0760, 72.8777), 1153, delta=5)
+
+
+class NearbyHospitalsTest(TestCase):
+    def create_hospital(self, name, latitude=None, longitude=None):
+        return make_hospital(
+            name.lower().replace(' ', '-'), name=name, city='Gorakhpur', state='Uttar Pradesh',
+            postal_code='273001', latitude=latitude, longitude=longitude,
+        )
+
+    def test_nearest_hospitals_are_sorted_by_real_distance(self):
+        from chatbot.views import find_nearby_hospitals
+
+        self.create_hospital('Far Hospital', 28.61, 77.21)
+        self.create_hospital('Near Hospital', 26.76, 83.37)
+        self.create_hospital('Unmapped Hospital')
+
+        hospitals = find_nearby_hospitals({'latitude': 26.75, 'longitude': 83.38})
+        self.assertEqual([h['name'] for h in hospitals], ['Near Hospital', 'Far Hospital', 'Unmapped Hospital'])
+        self.assertLess(hospitals[0]['distance'], 2)
+        self.assertIsNone(hospitals[2]['distance'])
+
+        # Saving a hospital invalidates the cached index
+        self.create_hospital('Nearest Hospital', 26.75, 83.38)
+        with self.assertNumQueries(1):
+            hospitals = find_nearby_hospitals({'latitude': 26.75, 'longitude': 83.38})
+        self.assertEqual(hospitals[0]['name'], 'Nearest Hospital')
+        with self.assertNumQueries(0):
+            find_nearby_hospitals({'latitude': 26.75, 'longitude': 83.38})
+
+
+class GeocodeHospitalsCommandTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.gazetteer = os.path.join(self.tmp.name, 'gazetteer.csv')
+        self.cache_path = os.path.join(self.tmp.name, 'cache.json')
+        with open(self.gazetteer, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['address', 'city', 'state', 'postal_code', 'latitude', 'longitude'])
+            writer.writerow(['', 'Mumbai', 'Maharashtra', '400001', '18.94', '72.83'])
+            writer.writerow(['', 'Pune', 'Maharashtra', '411001', '18.52', '73.85'])
+        self.hospital = make_hospital('test')
+
+    def geocode(self):
+        out = io.StringIO()
+        call_command('geocode_hospitals', backend='csv', gazetteer=self.gazetteer, cache=self.cache_path, stdout=out)
+        return out.getvalue()
+
+    def test_geocodes_incrementally(self):
+        self.assertIn('Geocoded 1 hospitals (1 backend lookups', self.geocode())
+        self.hospital.refresh_from_db()
+        self.assertEqual((self.hospital.latitude, self.hospital.longitude), (18.94, 72.83))
+
+        self.assertIn('Geocoded 0 hospitals (0 backend lookups, 0 from cache); 1 unchanged', self.geocode())
+
+        self.hospital.city = 'Pune'
+        self.hospital.postal_code = '411001'
+        self.hospital.save()
+        self.assertIn('Geocoded 1 hospitals (1 backend lookups', self.geocode())
+        self.hospital.refresh_from_db()
+        self.assertEqual(self.hospital.latitude, 18.52)
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address(' 12, M.G.  Road ', 'PUNE'), '12 m g road, pune')
+
+
+@override_settings(ALLOWED_HOSTS=['.example.com'])
+class TenantMiddlewareTest(TestCase):
+    def setUp(self):
+        self.hospital = make_hospital('city')
+        self.seen = []
+        self.middleware = TenantMiddleware(self.view)
+
+    def view(self, request):
+        self.seen.append(get_current_hospital())
+        return HttpResponse()
+
+    def resolve(self, host='city.example.com', path='/'):
+        request = RequestFactory().get(path, HTTP_HOST=host)
+        request.session = SessionStore()
+        self.middleware(request)
+        return request.hospital
+
+    def test_steady_state_costs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve().pk, self.hospital.pk)
+        with self.assertNumQueries(0):
+            hospital = self.resolve()
+        self.assertEqual(hospital.name, 'City Hospital')
+        # The tenant is current while the view runs and cleared afterwards
+        self.assertEqual(self.seen[-1].pk, self.hospital.pk)
+        self.assertIsNone(get_current_hospital())
+
+        # Callers get their own copy of the cached snapshot
+        hospital.name = 'Changed by a view'
+        self.assertEqual(self.resolve().name, 'City Hospital')
+
+    def test_saving_a_hospital_invalidates_the_registry(self):
+        self.resolve()
+        self.hospital.name = 'Renamed Hospital'
+        self.hospital.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve().name, 'Renamed Hospital')
+
+        self.hospital.is_active = False
+        self.hospital.save()
+        self.assertIsNone(self.resolve())
+
+    def test_other_processes_pick_up_a_bump_after_the_check_interval(self):
+        self.resolve()
+        # Another worker renames the hospital and bumps the shared version
+        Hospital.objects.filter(pk=self.hospital.pk).update(name='Renamed Elsewhere')
+        CacheVersion.objects.filter(key=registry.VERSION_CACHE_KEY).update(version=12345)
+        self.assertEqual(self.resolve().name, 'City Hospital')
+        with override_settings(CACHE_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(self.resolve().name, 'Renamed Elsewhere')
+
+    def test_unknown_subdomains_are_negatively_cached(self):
+        with self.assertNumQueries(2):
+            # Subdomain miss, then the development default
+            self.assertEqual(self.resolve('typo.example.com').pk, self.hospital.pk)
+        with self.assertNumQueries(0):
+            self.resolve('typo.example.com')
+
+    def test_exempt_paths_skip_tenant_resolution(self):
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.resolve(path='/static/css/site.css'))
+            self.assertIsNone(self.resolve(path='/admin/'))
+
+    def test_parse_subdomain(self):
+        self.assertEqual(parse_subdomain('City.Example.com:8000'), 'city')
+        self.assertIsNone(parse_subdomain('www.example.com'))
+        self.assertIsNone(parse_subdomain('127.0.0.1:8000'))
+        self.assertIsNone(parse_subdomain('localhost:8000'))
+
+    def test_async_middleware_scopes_tenant_to_the_request(self):
+        async def view(request):
+            self.seen.append(get_current_hospital())
+            return HttpResponse()
+
+        middleware = TenantMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = RequestFactory().get('/', HTTP_HOST='city.example.com')
+        request.session = SessionStore()
+        # async_to_sync keeps the thread-sensitive resolution on the test's connection
+        async_to_sync(middleware)(request)
+        self.assertEqual(self.seen[-1].pk, self.hospital.pk)
+        self.assertIsNone(get_current_hospital())
+
+
+class HospitalStatsTest(TestCase):
+    def setUp(self):
+        from adminapp.models import Category
+        from adminapp.testing import make_doctor
+        from myapp.models import Enquiry
+
+        self.hospital = make_hospital('city')
+        self.other = make_hospital('lake')
+        doctor = make_doctor(self.hospital)
+        make_doctor(self.hospital, 'Two', category=doctor.category, first_name='B', is_available=False)
+        other_category = Category.objects.create(hospital=self.other, name='Neurology')
+        make_doctor(self.other, 'Three', category=other_category, first_name='C')
+        Enquiry.objects.create(hospital=self.hospital, name='P', email='p@test.com', contactno='1', subject='S', message='M')
+
+    def test_counters_come_from_one_query(self):
+        with self.assertNumQueries(1):
+            stats = compute_hospital_stats(self.hospital)
+        self.assertEqual(stats['doctors'], 2)
+        self.assertEqual(stats['available_doctors'], 1)
+        self.assertEqual(stats['categories'], 1)
+        self.assertEqual(stats['enquiries'], 1)
+        self.assertEqual(stats['appointments_scheduled'], 0)
+        self.assertNotIn('hospitals', stats)
+
+        with self.assertNumQueries(1):
+            totals = compute_hospital_stats()
+        self.assertEqual(totals['doctors'], 3)
+        self.assertEqual(totals['hospitals'], 2)
+
+    def test_cached_counters_are_invalidated_by_writes(self):
+        from adminapp.models import Category
+
+        get_hospital_stats(self.hospital)
+        get_hospital_stats()
+        with self.assertNumQueries(0):
+            get_hospital_stats(self.hospital)
+
+        Category.objects.create(hospital=self.hospital, name='Neurology')
+        self.assertEqual(get_hospital_stats(self.hospital)['categories'], 2)
+        self.assertEqual(get_hospital_stats()['categories'], 3)
+
+    def test_api_hospital_stats(self):
+        response = self.client.get(f'/api/hospital-stats/{self.hospital.pk}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['doctors'], 2)
+        self.assertEqual(data['patients'], 0)
+        self.assertIn('trial_days_left', data)
+
+
+def current_hospital_name():
+    hospital = get_current_hospital()
+    return hospital.name if hospital else None
+
+
+class TenantContextTest(SimpleTestCase):
+    def setUp(self):
+        self.city = Hospital(name='City Hospital', slug='city')
+        self.lake = Hospital(name='Lake Hospital', slug='lake')
+
+    def test_tenant_context_restores_previous_tenant(self):
+        with tenant_context(self.city):
+            with tenant_context(self.lake):
+                self.assertEqual(current_hospital_name(), 'Lake Hospital')
+            self.assertEqual(current_hospital_name(), 'City Hospital')
+        self.assertIsNone(get_current_hospital())
+
+        with self.assertRaises(ValueError):
+            with tenant_context(self.city):
+                raise ValueError
+        self.assertIsNone(get_current_hospital())
+
+    def test_thread_pool_workers_get_the_submitting_tenant(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Plain submissions do not inherit the context
+            with tenant_context(self.city):
+                self.assertIsNone(executor.submit(current_hospital_name).result())
+                city = executor.submit(with_tenant_context(current_hospital_name))
+            with tenant_context(self.lake):
+                lake = executor.submit(tenant_scoped(current_hospital_name))
+                explicit = executor.submit(tenant_scoped(current_hospital_name), tenant=self.city)
+            self.assertEqual(city.result(), 'City Hospital')
+            self.assertIsNone(lake.result())  # no explicit tenant: the worker's own (empty) context
+            self.assertEqual(explicit.result(), 'City Hospital')
+
+    def test_bound_callables_pickle_for_process_pools(self):
+        with tenant_context(self.city):
+            task = pickle.loads(pickle.dumps(with_tenant_context(current_hospital_name)))
+        self.assertEqual(task(), 'City Hospital')
+        self.assertIsNone(get_current_hospital())
+
+    def test_concurrent_tasks_do_not_share_a_tenant(self):
+        async def handle(hospital):
+            with tenant_context(hospital):
+                await asyncio.sleep(0)
+                return current_hospital_name()
+
+        async def main():
+            return await asyncio.gather(handle(self.city), handle(self.lake), handle(None))
+
+        self.assertEqual(asyncio.run(main()), ['City Hospital', 'Lake Hospital', None])
+
+
+class RecordingEmailBackend(locmem.EmailBackend):
+    """locmem backend that records the connections opened and closed"""
+    opened = []
+    closed = []
+
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.config = (host, port, username, password, use_tls)
+        self.is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        self.is_open = True
+        RecordingEmailBackend.opened.append(self.config)
+        return True
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            RecordingEmailBackend.closed.append(self.config)
+
+
+class TenantMailRouterTest(SimpleTestCase):
+    def setUp(self):
+        RecordingEmailBackend.opened = []
+        RecordingEmailBackend.closed = []
+        self.router = TenantMailRouter(pool_size=1, idle_timeout=60, backend='tenants.tests.RecordingEmailBackend')
+        self.values = {
+            'smtp_host': 'smtp.city.test', 'smtp_port': 587, 'smtp_username': 'mail@city.test',
+            'smtp_password': 'secret', 'smtp_use_tls': True, 'email': 'info@city.test',
+        }
+        self.config = smtp_config(self.values)
+
+    def test_config_key_hashes_settings(self):
+        self.assertIsNone(smtp_config(dict(self.values, smtp_host='')))
+        self.assertEqual(self.config.from_email, 'mail@city.test')
+        self.assertNotIn('secret', self.config.key)
+        self.assertEqual(self.config.key, smtp_config(dict(self.values)).key)
+        self.assertNotEqual(self.config.key, smtp_config(dict(self.values, smtp_password='changed')).key)
+
+    def test_connections_are_reused_per_config(self):
+        for _ in range(3):
+            with self.router.connection(self.config) as connection:
+                self.assertTrue(connection.is_open)
+                self.assertEqual(connection.timeout, 10)
+        self.assertEqual(len(RecordingEmailBackend.opened), 1)
+        self.assertEqual(self.router.idle_count(self.config), 1)
+
+        # Two concurrent users need two connections; only pool_size stay open
+        first = self.router.acquire(self.config)
+        second = self.router.acquire(self.config)
+        self.router.release(self.config, first)
+        self.router.release(self.config, second)
+        self.assertEqual(len(RecordingEmailBackend.opened), 2)
+        self.assertEqual(self.router.idle_count(), 1)
+        self.assertEqual(len(RecordingEmailBackend.closed), 1)
+
+    def test_broken_connections_are_not_pooled(self):
+        with self.assertRaises(ConnectionError):
+            with self.router.connection(self.config):
+                raise ConnectionError
+        self.assertEqual(self.router.idle_count(), 0)
+        self.assertEqual(len(RecordingEmailBackend.closed), 1)
+
+    def test_idle_connections_are_closed(self):
+        self.router.idle_timeout = 0
+        with self.router.connection(self.config):
+            pass
+        time.sleep(0.01)
+        self.assertEqual(self.router.close_idle(), 1)
+        self.assertEqual(self.router.idle_count(), 0)
+
+    def test_changed_settings_rebuild_the_pool(self):
+        self.router.track('city', self.config)
+        with self.router.connection(self.config):
+            pass
+        changed = smtp_config(dict(self.values, smtp_password='rotated'))
+        self.router.track('city', changed)
+        self.assertEqual(self.router.idle_count(), 0)
+        self.assertEqual(RecordingEmailBackend.closed[-1][3], 'secret')
+        with self.router.connection(changed):
+            pass
+        self.assertEqual(RecordingEmailBackend.opened[-1][3], 'rotated')
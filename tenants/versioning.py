@@ -0,0 +1,64 @@
+"""
+Version tokens for process-local caches.
+
+Some lookups (hospital index, tenant registry, specialty matcher, doctor
+index) are compiled once per process and reused. Each is tagged with a
+version token stored in the ``CacheVersion`` table; signal handlers replace
+the token when the source rows change.
+
+The process that bumps a version sees it immediately. Every other process
+re-reads a version at most once per ``CACHE_VERSION_CHECK_INTERVAL``
+seconds, so it rebuilds within that interval (after the bumping
+transaction commits) and hot lookups in between cost no query. Tokens are
+random rather than counters, so a bump that is rolled back can never make
+a stale build look current again.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+# Version of a key that was never bumped
+INITIAL_VERSION = 0
+
+_known = {}  # key -> (checked_at, version)
+_lock = threading.Lock()
+
+
+def check_interval():
+    return getattr(settings, 'CACHE_VERSION_CHECK_INTERVAL', 2.0)
+
+
+def _remember(key, version):
+    with _lock:
+        _known[key] = (time.monotonic(), version)
+
+
+def get_version(key):
+    known = _known.get(key)
+    if known is not None and time.monotonic() - known[0] < check_interval():
+        return known[1]
+
+    from .models import CacheVersion
+
+    version = CacheVersion.objects.filter(key=key).values_list('version', flat=True).first()
+    if version is None:
+        version = INITIAL_VERSION
+    _remember(key, version)
+    return version
+
+
+def bump_version(key):
+    from .models import CacheVersion
+
+    version = random.randint(1, 2 ** 62)
+    if not CacheVersion.objects.filter(key=key).update(version=version):
+        try:
+            with transaction.atomic():
+                CacheVersion.objects.create(key=key, version=version)
+        except IntegrityError:
+            # Another process created the row first
+            CacheVersion.objects.filter(key=key).update(version=version)
+    _remember(key, version)
@@ -11,6 +11,9 @@ from datetime import timedelta
 import json
 
 from .models import Hospital, HospitalUser
+from .stats import get_hospital_stats
+from chatbot.analytics import chat_summary
+from chatbot.response_cache import get_response_cache
 from .forms import HospitalOnboardingForm, HospitalConfigForm
 
 
@@ -210,19 +213,15 @@ def api_hospital_stats(request, hospital_id):
     """
     hospital = get_object_or_404(Hospital, id=hospital_id)
     
-    # Import here to avoid circular imports
-    from adminapp.models import Doctor, Appointment, Category
-    from myapp.models import UserInfo, Enquiry
-    
-    stats = {
-        'doctors': Doctor.objects.filter(hospital=hospital).count(),
-        'appointments': Appointment.objects.filter(hospital=hospital).count(),
-        'categories': Category.objects.filter(hospital=hospital).count(),
-        'patients': UserInfo.objects.filter(hospital=hospital).count(),
-        'enquiries': Enquiry.objects.filter(hospital=hospital).count(),
+    stats = dict(get_hospital_stats(hospital))
+    stats.update({
         'subscription': hospital.subscription_plan,
         'trial_days_left': 0,
-    }
+        # Last 30 days, from the rollup_chat_analytics rows
+        'chat': chat_summary(hospital.id),
+        # Hit/miss counters of the serving process
+        'ai_cache': get_response_cache().stats(hospital.id),
+    })
     
     # Calculate trial days left
     if hospital.subscription_plan == 'trial' and hospital.trial_ends_at: